@@ -0,0 +1,353 @@
+"""Micro-benchmarks for the bot's hot paths.
+
+Run all of them with ``python benchmarks.py`` or a single one with
+``python benchmarks.py import``. They use synthetic data only and never
+touch expenses.db.
+"""
+import sys
+import time
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+from io import BytesIO
+from dateutil import parser as date_parser
+
+import finbot
+
+
+def timed(func, *args, repeat=3):
+    """Best wall-clock time of `repeat` runs, plus the last result."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def money_manager_frame(rows, seed=7):
+    """A DataFrame shaped like a Money Manager .xls export."""
+    rng = random.Random(seed)
+    start = datetime(2022, 1, 1)
+    categories = ['🍜 Food', '🚖 Transport', '🏠 Rent', '⚡ Utilities', '🛒 Shopping', 'Other']
+    accounts = ['Online', 'Cash', 'Credit Card', 'UPI']
+
+    data = []
+    for _ in range(rows):
+        when = start + timedelta(minutes=rng.randint(0, 3 * 365 * 24 * 60))
+        amount = round(rng.uniform(5, 2500), 2)
+        data.append({
+            'Date': when.strftime('%d/%m/%Y %H:%M:%S'),
+            'Account': rng.choice(accounts),
+            'Category': rng.choice(categories),
+            'Subcategory': rng.choice([None, 'Lunch', 'Dinner', 'Train', 'Groceries']),
+            'Note': rng.choice(['Tea', 'Lunch', 'Train ticket', None]),
+            'INR': amount,
+            'Income/Expense': 'Expense' if rng.random() > 0.05 else 'Income',
+            'Description': None,
+            'Amount': amount,
+            'Currency': 'INR',
+            'Account.1': amount
+        })
+    return pd.DataFrame(data)
+
+
+def legacy_import_rows(df, actual_columns, user_id):
+    """The original per-row iterrows() import loop, kept as the baseline."""
+    if 'Income/Expense' in df.columns:
+        df = df[df['Income/Expense'] == 'Expense']
+
+    rows = []
+    failed_count = 0
+    for index, row in df.iterrows():
+        try:
+            category = str(row[actual_columns['category']]).strip()
+            amount = float(row[actual_columns['amount']])
+
+            if amount <= 0:
+                continue
+
+            subcategory = None
+            subcat_value = row[actual_columns['subcategory']]
+            if pd.notna(subcat_value) and str(subcat_value).strip():
+                subcategory = str(subcat_value).strip()
+
+            date_value = row[actual_columns['date']]
+            expense_date = pd.to_datetime(date_value, format='%d/%m/%Y %H:%M:%S', errors='coerce')
+            if pd.isna(expense_date):
+                expense_date = pd.to_datetime(date_value, errors='coerce')
+            expense_date = expense_date.strftime('%Y-%m-%d %H:%M:%S')
+
+            description = 'Imported from Excel'
+            desc_value = row[actual_columns['description']]
+            if pd.notna(desc_value) and str(desc_value).strip():
+                description = str(desc_value).strip()
+
+            account = None
+            acc_value = row[actual_columns['account']]
+            if pd.notna(acc_value) and str(acc_value).strip():
+                account = str(acc_value).strip()
+
+            rows.append((user_id, category, subcategory, amount, description, account, expense_date))
+        except Exception:
+            failed_count += 1
+
+    return rows
+
+
+def bench_import(rows=20000):
+    df = money_manager_frame(rows)
+    actual_columns = finbot.find_import_columns(df.columns)
+
+    legacy_time, legacy_rows = timed(legacy_import_rows, df, actual_columns, 1, repeat=1)
+    vector_time, (vector_rows, failures) = timed(finbot.normalize_import_frame, df, actual_columns, 1)
+
+    assert vector_rows == legacy_rows, "vectorized import disagrees with the legacy loop"
+    print(f"import {rows} rows: iterrows {legacy_time * 1000:.0f} ms, "
+          f"vectorized {vector_time * 1000:.0f} ms ({legacy_time / vector_time:.1f}x), "
+          f"{len(vector_rows)} rows, {len(failures)} failures")
+
+
+def report_month_frame(rows, year_month='2024-03', seed=11):
+    """A DataFrame shaped like get_month_expenses_df() for one busy month."""
+    rng = random.Random(seed)
+    start = datetime.strptime(year_month, '%Y-%m')
+    categories = ['🍔 Food', '🚗 Transport', '🏠 Rent', '⚡ Utilities', '🛍️ Shopping',
+                  '🎬 Entertainment', '💊 Health', '📚 Education', '✈️ Travel', '💰 Other']
+    subcategories = [None, 'Lunch', 'Dinner', 'Cab', 'Groceries', 'Snacks']
+    accounts = [None, 'Cash', 'UPI', 'Credit Card', 'Online']
+
+    data = []
+    for _ in range(rows):
+        when = start + timedelta(minutes=rng.randint(0, 28 * 24 * 60 - 1))
+        data.append({
+            'date': when.strftime('%Y-%m-%d %H:%M:%S'),
+            'category': rng.choice(categories),
+            'subcategory': rng.choice(subcategories),
+            'amount': round(rng.uniform(5, 2500), 2),
+            'description': rng.choice(['Tea', 'Lunch', 'Cab home', 'Groceries', 'Movie']),
+            'account': rng.choice(accounts)
+        })
+    return pd.DataFrame(data).sort_values('date', ascending=False, ignore_index=True)
+
+
+def with_report_columns(df):
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'])
+    df['Day'] = df['date'].dt.strftime('%d')
+    df['Weekday'] = df['date'].dt.strftime('%A')
+    df['Date'] = df['date'].dt.strftime('%d/%m/%Y')
+    df['Time'] = df['date'].dt.strftime('%H:%M')
+    return df
+
+
+def legacy_report_sheets(df):
+    """The original per-sheet groupbys and per-category masks, kept as the baseline."""
+    sheets = {}
+    sheets['📊 Overview'] = pd.DataFrame({
+        'Metric': ['Total Expenses', 'Number of Transactions', 'Average Transaction', 'Highest Expense',
+                   'Lowest Expense', 'Daily Average', 'Most Expensive Day', 'Most Spent Category'],
+        'Value': [
+            f"₹{df['amount'].sum():.2f}",
+            len(df),
+            f"₹{df['amount'].mean():.2f}",
+            f"₹{df['amount'].max():.2f}",
+            f"₹{df['amount'].min():.2f}",
+            f"₹{df['amount'].sum() / df['Day'].nunique():.2f}",
+            df.groupby('Date')['amount'].sum().idxmax(),
+            df.groupby('category')['amount'].sum().idxmax()
+        ]
+    })
+
+    category_summary = df.groupby('category').agg({'amount': ['sum', 'count', 'mean', 'max', 'min']}).reset_index()
+    category_summary.columns = ['Category', 'Total Amount', 'Transactions', 'Avg Amount', 'Max', 'Min']
+    category_summary = category_summary.sort_values('Total Amount', ascending=False)
+    total_spent = category_summary['Total Amount'].sum()
+    category_summary['Percentage'] = (category_summary['Total Amount'] / total_spent * 100).round(2)
+    category_summary['Percentage'] = category_summary['Percentage'].astype(str) + '%'
+    for column in ['Total Amount', 'Avg Amount', 'Max', 'Min']:
+        category_summary[column] = '₹' + category_summary[column].round(2).astype(str)
+    sheets['📁 Categories'] = category_summary
+
+    daily_breakdown = df.groupby(['Date', 'Weekday']).agg({'amount': ['sum', 'count']}).reset_index()
+    daily_breakdown.columns = ['Date', 'Weekday', 'Total Spent', 'Transactions']
+    daily_breakdown = daily_breakdown.sort_values('Date', ascending=False)
+    daily_breakdown['Total Spent'] = '₹' + daily_breakdown['Total Spent'].round(2).astype(str)
+    sheets['📅 Daily'] = daily_breakdown
+
+    account_breakdown = df.groupby('account').agg({'amount': ['sum', 'count']}).reset_index()
+    account_breakdown.columns = ['Account', 'Total Spent', 'Transactions']
+    account_breakdown = account_breakdown.sort_values('Total Spent', ascending=False)
+    account_total = account_breakdown['Total Spent'].sum()
+    account_breakdown['Percentage'] = (account_breakdown['Total Spent'] / account_total * 100).round(2)
+    account_breakdown['Total Spent'] = '₹' + account_breakdown['Total Spent'].round(2).astype(str)
+    account_breakdown['Percentage'] = account_breakdown['Percentage'].astype(str) + '%'
+    sheets['💳 Accounts'] = account_breakdown
+
+    subcat_df = df[df['subcategory'].notna()].groupby(['category', 'subcategory']).agg(
+        {'amount': ['sum', 'count']}).reset_index()
+    subcat_df.columns = ['Category', 'Subcategory', 'Total', 'Count']
+    subcat_df = subcat_df.sort_values(['Category', 'Total'], ascending=[True, False])
+    subcat_df['Total'] = '₹' + subcat_df['Total'].round(2).astype(str)
+    sheets['📂 Subcategories'] = subcat_df
+
+    top_expenses = df.nlargest(min(20, len(df)), 'amount')[['Date', 'Time', 'category', 'amount', 'description']].copy()
+    top_expenses['amount'] = '₹' + top_expenses['amount'].round(2).astype(str)
+    sheets['💰 Top Expenses'] = top_expenses
+
+    detailed_df = df[['Date', 'Time', 'Weekday', 'category', 'subcategory', 'amount', 'description', 'account']].copy()
+    detailed_df['amount'] = '₹' + detailed_df['amount'].round(2).astype(str)
+    sheets['📝 All Transactions'] = detailed_df
+
+    for category in df['category'].unique():
+        category_df = df[df['category'] == category][
+            ['Date', 'Time', 'amount', 'description', 'subcategory', 'account']].copy()
+        category_df = category_df.sort_values('Date', ascending=False)
+        category_df['amount'] = '₹' + category_df['amount'].round(2).astype(str)
+        sheets[category[:31].replace('/', '-')] = category_df
+    return sheets
+
+
+def legacy_excel_report(df):
+    """The pre-numeric-format report: '₹' string columns written with pandas' ExcelWriter."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, sheet_df in legacy_report_sheets(with_report_columns(df)).items():
+            sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return output.getvalue()
+
+
+def bench_report(rows=50000):
+    month = report_month_frame(rows)
+
+    legacy_time, legacy_sheets = timed(legacy_report_sheets, with_report_columns(month))
+    single_time, (overview, sheets) = timed(finbot.aggregate_report, finbot.add_report_columns(month.copy()))
+
+    assert ['📊 Overview', *sheets] == list(legacy_sheets), "report sheets differ"
+    for name, sheet in sheets.items():
+        assert len(sheet) == len(legacy_sheets[name]), f"{name} row count differs"
+
+    legacy_build, legacy_workbook = timed(legacy_excel_report, month, repeat=1)
+    build_time, workbook = timed(finbot.build_excel_report, month.copy(), '2024-03', repeat=1)
+    print(f"report {rows} rows: per-sheet groupbys {legacy_time * 1000:.0f} ms, "
+          f"single pass {single_time * 1000:.0f} ms ({legacy_time / single_time:.1f}x)")
+    print(f"report {rows} rows: '₹' text cells {legacy_build:.1f} s, {len(legacy_workbook) / 1024:.0f} KiB; "
+          f"numeric cells {build_time:.1f} s, {len(workbook) / 1024:.0f} KiB")
+
+
+# What users type at the custom date/time prompt and in quick-add lines,
+# with what they mean when sent at DATETIME_NOW. None means "can't read it".
+DATETIME_NOW = datetime(2025, 10, 29, 9, 15, 30)
+DATETIME_CORPUS = [
+    ('now', DATETIME_NOW),
+    ('Today', DATETIME_NOW),
+    ('today 8pm', datetime(2025, 10, 29, 20, 0)),
+    ('yesterday', datetime(2025, 10, 28)),
+    ('Yesterday 18:00', datetime(2025, 10, 28, 18, 0)),
+    ('yesterday 8pm', datetime(2025, 10, 28, 20, 0)),
+    ('yesterday 8:30 PM', datetime(2025, 10, 28, 20, 30)),
+    ('yesterday 12am', datetime(2025, 10, 28, 0, 0)),
+    ('yesterday at 7:45', datetime(2025, 10, 28, 7, 45)),
+    ('2 days ago', DATETIME_NOW - timedelta(days=2)),
+    ('1 day ago', DATETIME_NOW - timedelta(days=1)),
+    ('10 days ago', DATETIME_NOW - timedelta(days=10)),
+    ('2 days ago 8pm', datetime(2025, 10, 27, 20, 0)),
+    ('3 days ago at 7:15', datetime(2025, 10, 26, 7, 15)),
+    ('2025-10-28 14:35', datetime(2025, 10, 28, 14, 35)),
+    ('2025-10-28 14:35:10', datetime(2025, 10, 28, 14, 35, 10)),
+    ('2025-10-28', datetime(2025, 10, 28)),
+    ('  2025-10-28  ', datetime(2025, 10, 28)),
+    ('2025-1-5', datetime(2025, 1, 5)),
+    ('28/10/2025 2:35 PM', datetime(2025, 10, 28, 14, 35)),
+    ('28/10/2025 2:35pm', datetime(2025, 10, 28, 14, 35)),
+    ('28/10/2025 14:35', datetime(2025, 10, 28, 14, 35)),
+    ('28/10/2025', datetime(2025, 10, 28)),
+    ('5/3/2025', datetime(2025, 3, 5)),
+    ('12/10/2026 21:30', datetime(2026, 10, 12, 21, 30)),
+    ('Oct 28 2025', datetime(2025, 10, 28)),
+    ('28 october 2025 7pm', datetime(2025, 10, 28, 19, 0)),
+    ('14:35', datetime(2025, 10, 29, 14, 35)),
+    ('31/02/2025', None),
+    ('13pm', None),
+    ('yesterday 13pm', None),
+    ('no idea', None),
+]
+
+
+def legacy_parse_human_datetime(text):
+    """The original strptime-loop parser, kept as the baseline."""
+    try:
+        text = text.strip().lower()
+        now = datetime.now()
+
+        if text in ['now', 'today']:
+            return now
+
+        if text.startswith('yesterday'):
+            rest = text.replace('yesterday', '').strip()
+            base = now - timedelta(days=1)
+            if rest:
+                try:
+                    parsed = date_parser.parse(rest, fuzzy=True)
+                    return base.replace(hour=parsed.hour, minute=parsed.minute, second=parsed.second, microsecond=0)
+                except:
+                    return base.replace(hour=0, minute=0, second=0, microsecond=0)
+            return base.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        if 'days ago' in text:
+            try:
+                days = int(text.split('days ago')[0].strip())
+                return now - timedelta(days=days)
+            except:
+                pass
+
+        for fmt in ['%Y-%m-%d %H:%M', '%Y-%m-%d', '%d/%m/%Y %I:%M %p', '%d/%m/%Y %H:%M', '%d/%m/%Y']:
+            try:
+                return datetime.strptime(text, fmt)
+            except:
+                pass
+
+        return date_parser.parse(text, fuzzy=True)
+    except:
+        return None
+
+
+def bench_datetime(rounds=200):
+    for text, expected in DATETIME_CORPUS:
+        parsed = finbot.parse_human_datetime(text, DATETIME_NOW)
+        assert parsed == expected, f"{text!r}: got {parsed}, expected {expected}"
+
+    inputs = [text for text, _ in DATETIME_CORPUS] * rounds
+
+    def run(parse, *args):
+        for text in inputs:
+            parse(text, *args)
+
+    def cold(*args):
+        finbot.parse_human_datetime_shape.cache_clear()
+        for text in inputs[:len(DATETIME_CORPUS)]:
+            finbot.parse_human_datetime(text, *args)
+
+    legacy_time, _ = timed(run, legacy_parse_human_datetime)
+    cached_time, _ = timed(run, finbot.parse_human_datetime, DATETIME_NOW)
+    cold_time, _ = timed(cold, DATETIME_NOW)
+    legacy_once = legacy_time / rounds
+    print(f"datetime {len(DATETIME_CORPUS)} inputs: legacy {legacy_once * 1000:.2f} ms, "
+          f"table {cold_time * 1000:.2f} ms uncached ({legacy_once / cold_time:.1f}x), "
+          f"{cached_time / rounds * 1000:.3f} ms cached ({legacy_time / cached_time:.0f}x)")
+
+
+BENCHMARKS = {
+    'import': bench_import,
+    'report': bench_report,
+    'datetime': bench_datetime,
+}
+
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
@@ -1,7 +1,27 @@
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import re
+import sys
+import calendar
+import csv
+import gzip
+import hashlib
+import importlib.util
+import json
+import queue
+import time
+import asyncio
+import logging
+import threading
+import tempfile
+import multiprocessing
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from functools import lru_cache
+from datetime import datetime, timedelta, time as dt_time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -13,56 +33,593 @@ from telegram.ext import (
 )
 import pandas as pd
 from io import BytesIO
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, NamedStyle
 from dateutil import parser as date_parser
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports are offered only when pyarrow is installed
+    pa = pq = None
+
+# Charts are rendered by matplotlib in the report workers, which import it
+# themselves; the bot process only needs to know whether it is installed
+CHARTS_AVAILABLE = importlib.util.find_spec('matplotlib') is not None
+
 # States for conversation handler
 CATEGORY, SUBCATEGORY, AMOUNT, DESCRIPTION, ACCOUNT, DATE_SELECT = range(6)
 ACCOUNT_SELECT, BALANCE_AMOUNT = range(6, 8)
 CUSTOM_SUBCATEGORY, CUSTOM_ACCOUNT = range(8, 10)
 CUSTOM_ACCOUNT_BALANCE = 10
+REPORT_RANGE = 11
+
+DB_PATH = os.getenv('EXPENSES_DB', 'expenses.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))
+IMPORT_CHUNK_ROWS = int(os.getenv('IMPORT_CHUNK_ROWS', '5000'))
+IMPORT_PROGRESS_INTERVAL = 3.0
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '2'))
+IMPORT_SPILL_BYTES = int(os.getenv('IMPORT_SPILL_BYTES', str(5 * 1024 * 1024)))
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '2'))
+REPORT_TIMEOUT = float(os.getenv('REPORT_TIMEOUT', '120'))
+REPORT_STREAM_ROWS = int(os.getenv('REPORT_STREAM_ROWS', '20000'))
+REPORT_STREAM_BATCH = 2000
+REPORT_MAX_RANGE_DAYS = 366
+EXPORT_BATCH_ROWS = 10000
+EXPORT_MAX_BYTES = 50 * 1024 * 1024  # Telegram's upload limit for bots
+REPORT_CACHE_DIR = os.getenv('REPORT_CACHE_DIR', 'report_cache')
+REPORT_CACHE_MAX_BYTES = int(os.getenv('REPORT_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+REPORT_PREWARM_AT = dt_time(0, 15)
+REPORT_PREWARM_MAX_USERS = int(os.getenv('REPORT_PREWARM_MAX_USERS', '500'))
+REPORT_PREWARM_INTERVAL = float(os.getenv('REPORT_PREWARM_INTERVAL', '5'))
+REPORT_PREWARM_NICE = 10
+CHART_TREND_MONTHS = 6
+CHART_PIE_SLICES = 7
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '1024'))
+QUICK_ADD_MAX_LINES = 50
+
+logger = logging.getLogger(__name__)
+
+
+# Database connection manager
+class Database:
+    """Pool of long-lived SQLite connections shared by every helper.
+
+    Connections are opened lazily (up to ``pool_size``), tuned once with the
+    pragmas below and then reused, so each update no longer pays for opening
+    the file, re-reading the schema and re-preparing its statements.
+    """
+
+    PRAGMAS = (
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA temp_store = MEMORY',
+        'PRAGMA cache_size = -16000',
+        'PRAGMA mmap_size = 134217728',
+        'PRAGMA busy_timeout = 5000',
+    )
+
+    def __init__(self, path, pool_size=4, statement_cache_size=256):
+        self.path = path
+        self.pool_size = pool_size
+        self.statement_cache_size = statement_cache_size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self):
+        # Autocommit mode: transactions are started explicitly in transaction().
+        # cached_statements keeps the prepared statements of each connection alive.
+        conn = sqlite3.connect(
+            self.path,
+            timeout=5.0,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.pool_size:
+                self._opened += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._opened -= 1
+                    raise
+
+        return self._idle.get()
+
+    def _release(self, conn):
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; nested use on the same thread shares it."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Run a block atomically. Nested transactions join the outer one."""
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+
+            conn.execute('BEGIN IMMEDIATE')
+            self._local.after_commit = []
+            try:
+                try:
+                    yield conn
+                except BaseException:
+                    conn.rollback()
+                    raise
+                conn.commit()
+            finally:
+                callbacks, self._local.after_commit = self._local.after_commit, None
+                for callback in callbacks:
+                    callback()
+
+    def in_transaction(self):
+        conn = getattr(self._local, 'conn', None)
+        return conn is not None and conn.in_transaction
+
+    def after_commit(self, callback):
+        """Run callback when this thread's transaction ends, or now outside of one.
+
+        Used to drop cached state only once other threads can read the
+        write that made it stale. Callbacks also run after a rollback.
+        """
+        callbacks = getattr(self._local, 'after_commit', None)
+        if callbacks is None:
+            callback()
+        else:
+            callbacks.append(callback)
+
+    def fetchone(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_params)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+db = Database(DB_PATH, pool_size=DB_POOL_SIZE)
+
+# One worker per pooled connection, so a worker never waits on the pool itself
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='db')
+
+
+async def run_db(func, *args):
+    """Run a blocking repository function on the DB executor and await it.
+
+    Logs how long the call waited for a worker and how long it ran, and
+    warns when the total exceeds DB_SLOW_QUERY_MS.
+    """
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    started = None
+
+    def timed_call():
+        nonlocal started
+        started = time.perf_counter()
+        return func(*args)
+
+    try:
+        return await loop.run_in_executor(db_executor, timed_call)
+    finally:
+        finished = time.perf_counter()
+        wait_ms = ((started or finished) - submitted) * 1000
+        run_ms = (finished - (started or finished)) * 1000
+        level = logging.WARNING if wait_ms + run_ms >= DB_SLOW_QUERY_MS else logging.DEBUG
+        logger.log(level, "db %s: waited %.1f ms, ran %.1f ms", func.__name__, wait_ms, run_ms)
 
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS expenses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            category TEXT NOT NULL,
-            subcategory TEXT,
-            amount REAL NOT NULL,
-            description TEXT,
-            account TEXT,
-            date TEXT NOT NULL
-        )
-    ''')
+    with db.transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS expenses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                subcategory TEXT,
+                amount REAL NOT NULL,
+                description TEXT,
+                account TEXT,
+                date TEXT NOT NULL
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                UNIQUE(user_id, name)
+            )
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS account_balances (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                account_name TEXT NOT NULL,
+                initial_balance REAL NOT NULL DEFAULT 0,
+                current_balance REAL NOT NULL DEFAULT 0,
+                last_updated TEXT NOT NULL,
+                UNIQUE(user_id, account_name)
+            )
+        ''')
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            UNIQUE(user_id, name)
-        )
-    ''')
+    run_migrations()
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS account_balances (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            account_name TEXT NOT NULL,
-            initial_balance REAL NOT NULL DEFAULT 0,
-            current_balance REAL NOT NULL DEFAULT 0,
-            last_updated TEXT NOT NULL,
-            UNIQUE(user_id, account_name)
-        )
-    ''')
 
-    conn.commit()
-    conn.close()
+def migrate_fingerprints(conn):
+    """Migration 10: fingerprint the stored expenses on the migration's connection.
+
+    A frozen copy of expense_fingerprint as released with the migration, so
+    replaying it never depends on how the live code hashes later.
+    """
+    occurrences = Counter()
+    fingerprints = []
+    for expense_id, *fields in conn.execute('''
+        SELECT id, user_id, ts, amount, category, subcategory, description, account
+        FROM expenses
+        ORDER BY id
+    ''').fetchall():
+        user_id, ts, amount, category, subcategory, description, account = fields
+        key = (user_id, ts, f'{float(amount):.2f}', category, subcategory or '', description or '', account or '')
+        occurrence = occurrences[key]
+        occurrences[key] += 1
+        digest = hashlib.blake2b('\x1f'.join(map(str, key + (occurrence,))).encode(), digest_size=16)
+        fingerprints.append((digest.hexdigest(), expense_id))
+
+    conn.executemany('UPDATE expenses SET fingerprint = ? WHERE id = ?', fingerprints)
+
+
+# Schema migrations, applied in order on startup and recorded in schema_version.
+# Each step is a list of SQL statements or callables taking the connection;
+# a step only uses that connection and never calls live application code,
+# so replaying a released migration always does what it did when released.
+# Append new steps at the end; never edit or renumber a released one.
+MIGRATIONS = [
+    (1, 'index expenses by user and date', [
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses (user_id, date)',
+    ]),
+    (2, 'index expenses by user, category and date', [
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_category_date ON expenses (user_id, category, date)',
+    ]),
+    (3, 'index expenses by user, account and date', [
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_account_date ON expenses (user_id, account, date)',
+    ]),
+    (4, 'index expenses by user and id', [
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses (user_id, id)',
+    ]),
+    (5, 'add integer timestamp column to expenses', [
+        'ALTER TABLE expenses ADD COLUMN ts INTEGER',
+        '''
+            UPDATE expenses
+            SET ts = COALESCE(CAST(strftime('%s', date) AS INTEGER),
+                              CAST(strftime('%s', substr(date, 1, 10)) AS INTEGER))
+        ''',
+    ]),
+    (6, 'index expenses by timestamp instead of date text', [
+        'DROP INDEX IF EXISTS idx_expenses_user_date',
+        'DROP INDEX IF EXISTS idx_expenses_user_category_date',
+        'DROP INDEX IF EXISTS idx_expenses_user_account_date',
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_ts ON expenses (user_id, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_category_ts ON expenses (user_id, category, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_account_ts ON expenses (user_id, account, ts)',
+    ]),
+    (7, 'add monthly and daily expense rollups', [
+        '''
+            CREATE TABLE IF NOT EXISTS expense_rollups (
+                user_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                category TEXT NOT NULL,
+                subcategory TEXT NOT NULL,
+                account TEXT NOT NULL,
+                total REAL NOT NULL,
+                txn_count INTEGER NOT NULL,
+                active_days INTEGER NOT NULL,
+                PRIMARY KEY (user_id, month, category, subcategory, account)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS expense_daily_rollups (
+                user_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                total REAL NOT NULL,
+                txn_count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, day)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            INSERT INTO expense_rollups (user_id, month, category, subcategory, account, total, txn_count, active_days)
+            SELECT user_id, strftime('%Y-%m', ts, 'unixepoch'), category,
+                   COALESCE(subcategory, ''), COALESCE(account, ''),
+                   SUM(amount), COUNT(*), COUNT(DISTINCT ts / 86400)
+            FROM expenses
+            WHERE ts IS NOT NULL
+            GROUP BY 1, 2, 3, 4, 5
+        ''',
+        '''
+            INSERT INTO expense_daily_rollups (user_id, day, total, txn_count)
+            SELECT user_id, ts / 86400, SUM(amount), COUNT(*)
+            FROM expenses
+            WHERE ts IS NOT NULL
+            GROUP BY 1, 2
+        ''',
+    ]),
+    (8, 'track import jobs so interrupted imports can resume', [
+        '''
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                file_unique_id TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows_read INTEGER NOT NULL DEFAULT 0,
+                rows_imported INTEGER NOT NULL DEFAULT 0,
+                rows_failed INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_import_jobs_user_file ON import_jobs (user_id, file_unique_id)',
+    ]),
+    (9, 'queue import jobs in the background', [
+        'ALTER TABLE import_jobs ADD COLUMN chat_id INTEGER',
+        'ALTER TABLE import_jobs ADD COLUMN file_id TEXT',
+        'ALTER TABLE import_jobs ADD COLUMN error TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_import_jobs_status ON import_jobs (status, id)',
+    ]),
+    (10, 'fingerprint expenses so re-imports skip rows already stored', [
+        'ALTER TABLE expenses ADD COLUMN fingerprint TEXT',
+        migrate_fingerprints,
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_expenses_user_fingerprint ON expenses (user_id, fingerprint)',
+        'ALTER TABLE import_jobs ADD COLUMN rows_skipped INTEGER NOT NULL DEFAULT 0',
+    ]),
+    (11, 'version monthly data and cache generated reports', [
+        '''
+            CREATE TABLE IF NOT EXISTS data_versions (
+                user_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                PRIMARY KEY (user_id, month)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS report_cache (
+                user_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                path TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                file_id TEXT,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (user_id, month, kind)
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_report_cache_last_used ON report_cache (last_used)',
+    ]),
+    (12, 'keep subcategories and accounts with usage counts', [
+        '''
+            CREATE TABLE IF NOT EXISTS subcategories (
+                user_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                name TEXT NOT NULL,
+                use_count INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (user_id, category, name)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS accounts (
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                use_count INTEGER NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (user_id, name)
+            ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_subcategories_user_usage ON subcategories (user_id, use_count, last_used)',
+        'CREATE INDEX IF NOT EXISTS idx_accounts_user_usage ON accounts (user_id, use_count, last_used)',
+        '''
+            INSERT INTO subcategories (user_id, category, name, use_count, last_used)
+            SELECT user_id, category, subcategory, COUNT(*), COALESCE(MAX(ts), 0)
+            FROM expenses
+            WHERE subcategory IS NOT NULL
+            GROUP BY 1, 2, 3
+        ''',
+        '''
+            INSERT INTO accounts (user_id, name, use_count, last_used)
+            SELECT user_id, account, COUNT(*), COALESCE(MAX(ts), 0)
+            FROM expenses
+            WHERE account IS NOT NULL
+            GROUP BY 1, 2
+        ''',
+    ]),
+]
+
+
+def get_schema_version():
+    with db.transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            )
+        ''')
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def run_migrations():
+    current_version = get_schema_version()
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        with db.transaction() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+
+            conn.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (version, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            )
+        logger.info("Applied migration %d: %s", version, description)
+
+    # Refresh planner statistics for any index that was just created
+    db.execute('PRAGMA optimize')
+
+
+# Expense timestamps: the naive local date/time stored in `date`, as seconds
+# since the epoch. It is computed as if it were UTC so the stored value never
+# depends on the server's timezone; only ranges built here are compared to it.
+def to_timestamp(value):
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return calendar.timegm(value.timetuple())
+
+
+def from_timestamp(ts):
+    return datetime(1970, 1, 1) + timedelta(seconds=ts)
+
+
+def month_range(year_month):
+    """[start, end) timestamps for a 'YYYY-MM' month."""
+    start = datetime.strptime(year_month, '%Y-%m')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return to_timestamp(start), to_timestamp(end)
+
+
+def day_range(day):
+    """[start, end) timestamps for a 'YYYY-MM-DD' day."""
+    start = datetime.strptime(day, '%Y-%m-%d')
+    return to_timestamp(start), to_timestamp(start + timedelta(days=1))
+
+
+def last_days_range(days, now=None):
+    """[start, end) timestamps from midnight `days` days ago through today."""
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return to_timestamp(today - timedelta(days=days)), to_timestamp(today + timedelta(days=1))
+
+
+def add_months(when, months):
+    """The first day of the month `months` months after `when`'s month."""
+    month = when.month - 1 + months
+    return datetime(when.year + month // 12, month % 12 + 1, 1)
+
+
+def months_between(start, end):
+    """'YYYY-MM' months overlapping the [start, end) timestamps."""
+    months = []
+    month = add_months(from_timestamp(start), 0)
+    while to_timestamp(month) < end:
+        months.append(month.strftime('%Y-%m'))
+        month = add_months(month, 1)
+    return months
+
+
+# Range reports follow the Indian financial year: April to March, with
+# Q1 = April-June. FY2024-25 starts on 1 April 2024.
+def financial_year_start(when):
+    return datetime(when.year if when.month >= 4 else when.year - 1, 4, 1)
+
+
+def financial_quarter_start(when):
+    return add_months(financial_year_start(when), (when.month - 4) % 12 // 3 * 3)
+
+
+def describe_report_range(start, end):
+    """'Q1 FY2024-25', 'FY2024-25', 'March 2024' or 'DD Mon YYYY - DD Mon YYYY' for [start, end) dates."""
+    year_start = financial_year_start(start)
+    year_name = f"FY{year_start.year}-{(year_start.year + 1) % 100:02d}"
+
+    if start == year_start and end == add_months(start, 12):
+        return year_name
+    if start == financial_quarter_start(start) and end == add_months(start, 3):
+        return f"Q{(start.month - 4) % 12 // 3 + 1} {year_name}"
+    if start.day == 1 and end == add_months(start, 1):
+        return start.strftime('%B %Y')
+    return f"{start:%d %b %Y} - {end - timedelta(days=1):%d %b %Y}"
+
+
+REPORT_RANGE_DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y']
+REPORT_RANGE_DATE = re.compile(r'\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}')
+
+
+def parse_report_range(text):
+    """[start, end) datetimes for two typed dates ('from to', both inclusive), or None.
+
+    Only the explicit formats above are accepted: a guessing parser reads
+    2024-03-05 as 3 May once it is told dates are day-first.
+    """
+    dates = []
+    for token in REPORT_RANGE_DATE.findall(text):
+        for date_format in REPORT_RANGE_DATE_FORMATS:
+            try:
+                dates.append(datetime.strptime(token, date_format))
+                break
+            except ValueError:
+                continue
+
+    if len(dates) != 2:
+        return None
+
+    start, last = sorted(dates)
+    return start, last + timedelta(days=1)
 
 
 # Default categories
@@ -71,548 +628,2626 @@ DEFAULT_CATEGORIES = [
     '🎬 Entertainment', '🛒 Shopping', '💊 Health', '📚 Education', '💰 Other'
 ]
 
+DEFAULT_SUBCATEGORIES = {
+    '🍔 Food': ['Breakfast', 'Lunch', 'Dinner', 'Snacks', 'Tea/Coffee'],
+    '🍜 Food': ['Breakfast', 'Lunch', 'Dinner', 'Snacks', 'Tea/Coffee'],
+    '🚗 Transport': ['Bus', 'Train', 'Auto', 'Taxi', 'Fuel', 'Metro'],
+    '🚖 Transport': ['Bus', 'Train', 'Auto', 'Taxi', 'Fuel', 'Metro'],
+    '🏠 Rent': ['House Rent', 'Maintenance', 'Deposit'],
+    '⚡ Utilities': ['Electricity', 'Water', 'Gas', 'Internet', 'Phone'],
+    '🎬 Entertainment': ['Movies', 'Games', 'Concerts', 'Sports'],
+    '🛒 Shopping': ['Groceries', 'Clothing', 'Electronics', 'Home Items'],
+    '💊 Health': ['Medicine', 'Doctor', 'Tests', 'Gym'],
+    '📚 Education': ['Books', 'Courses', 'Tuition', 'Stationery'],
+    '📱Mobile Recharge': ['Data Pack', 'Recharge', 'Bill Payment'],
+    '🪑 Household': ['Furniture', 'Appliances', 'Repairs', 'Cleaning']
+}
+
+DEFAULT_ACCOUNTS = ['Cash', 'Online', 'Credit Card', 'Debit Card', 'UPI', 'Mobile Wallet']
+
 
 def add_default_categories(user_id):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+    with db.transaction() as conn:
+        conn.executemany('INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)',
+                         [(user_id, category) for category in DEFAULT_CATEGORIES])
+        invalidate_user_profile(user_id)
 
-    for category in DEFAULT_CATEGORIES:
-        try:
-            cursor.execute('INSERT INTO categories (user_id, name) VALUES (?, ?)',
-                           (user_id, category))
-        except sqlite3.IntegrityError:
-            pass
 
-    conn.commit()
-    conn.close()
+def merge_subcategories(used, category):
+    """The user's own subcategories, then the unused defaults; ['General'] when there are none."""
+    merged = used + [name for name in DEFAULT_SUBCATEGORIES.get(category, []) if name not in used]
+    return merged or ['General']
 
 
-def get_user_categories(user_id):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT name FROM categories WHERE user_id = ?', (user_id,))
-    categories = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return categories if categories else DEFAULT_CATEGORIES
+def load_user_profile(user_id):
+    """Everything the add-expense and account screens look up for a user, in four queries.
 
+    Used subcategories and accounts come most-used first, then the unused defaults.
+    """
+    categories = [name for name, in db.fetchall('SELECT name FROM categories WHERE user_id = ?', (user_id,))]
 
-def get_subcategories_for_category(user_id, category):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+    used = {}
+    for category, subcategory in db.fetchall('''
+        SELECT category, name
+        FROM subcategories
+        WHERE user_id = ?
+        ORDER BY use_count DESC, last_used DESC
+    ''', (user_id,)):
+        used.setdefault(category, []).append(subcategory)
 
-    cursor.execute('''
-        SELECT DISTINCT subcategory
-        FROM expenses
-        WHERE user_id = ? AND category = ? AND subcategory IS NOT NULL
-        ORDER BY subcategory
-    ''', (user_id, category))
-
-    subcategories = [row[0] for row in cursor.fetchall()]
-    conn.close()
-
-    default_subcats = {
-        '🍔 Food': ['Breakfast', 'Lunch', 'Dinner', 'Snacks', 'Tea/Coffee'],
-        '🍜 Food': ['Breakfast', 'Lunch', 'Dinner', 'Snacks', 'Tea/Coffee'],
-        '🚗 Transport': ['Bus', 'Train', 'Auto', 'Taxi', 'Fuel', 'Metro'],
-        '🚖 Transport': ['Bus', 'Train', 'Auto', 'Taxi', 'Fuel', 'Metro'],
-        '🏠 Rent': ['House Rent', 'Maintenance', 'Deposit'],
-        '⚡ Utilities': ['Electricity', 'Water', 'Gas', 'Internet', 'Phone'],
-        '🎬 Entertainment': ['Movies', 'Games', 'Concerts', 'Sports'],
-        '🛒 Shopping': ['Groceries', 'Clothing', 'Electronics', 'Home Items'],
-        '💊 Health': ['Medicine', 'Doctor', 'Tests', 'Gym'],
-        '📚 Education': ['Books', 'Courses', 'Tuition', 'Stationery'],
-        '📱Mobile Recharge': ['Data Pack', 'Recharge', 'Bill Payment'],
-        '🪑 Household': ['Furniture', 'Appliances', 'Repairs', 'Cleaning']
+    accounts = [account for account, in db.fetchall('''
+        SELECT name
+        FROM accounts
+        WHERE user_id = ?
+        ORDER BY use_count DESC, last_used DESC
+    ''', (user_id,))]
+
+    balances = db.fetchall('''
+        SELECT account_name, initial_balance, current_balance, last_updated
+        FROM account_balances
+        WHERE user_id = ?
+        ORDER BY account_name
+    ''', (user_id,))
+
+    return {
+        'categories': categories or DEFAULT_CATEGORIES,
+        'subcategories': {category: merge_subcategories(names, category) for category, names in used.items()},
+        'accounts': accounts + [account for account in DEFAULT_ACCOUNTS if account not in accounts],
+        'balances': balances,
+        'balance_by_account': {
+            name: {'initial': initial, 'current': current, 'last_updated': updated}
+            for name, initial, current, updated in balances
+        },
     }
 
-    base_category = category
-    if base_category in default_subcats:
-        for subcat in default_subcats[base_category]:
-            if subcat not in subcategories:
-                subcategories.append(subcat)
 
-    return subcategories if subcategories else ['General']
+class ProfileCache:
+    """Size-bounded LRU of per-user profiles (see load_user_profile).
+
+    A profile is loaded on first use and dropped by invalidate(), which
+    writers schedule through invalidate_user_profile(). Reads inside a
+    transaction bypass the cache so they see its uncommitted writes, and
+    a load that raced with an invalidation is not kept. Generations are
+    only tracked for users with a load in flight.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._profiles = OrderedDict()
+        self._generations = {}
+        self._loading = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        if db.in_transaction():
+            return load_user_profile(user_id)
+
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                self._profiles.move_to_end(user_id)
+                return profile
+            self._loading[user_id] += 1
+            generation = self._generations.setdefault(user_id, 0)
+
+        profile = None
+        try:
+            profile = load_user_profile(user_id)
+        finally:
+            with self._lock:
+                if profile is not None and self._generations[user_id] == generation:
+                    self._profiles[user_id] = profile
+                    while len(self._profiles) > self.size:
+                        self._profiles.popitem(last=False)
 
+                self._loading[user_id] -= 1
+                if not self._loading[user_id]:
+                    del self._loading[user_id]
+                    del self._generations[user_id]
+        return profile
 
-def get_user_accounts(user_id):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+    def invalidate(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+            if user_id in self._generations:
+                self._generations[user_id] += 1
 
-    cursor.execute('''
-        SELECT DISTINCT account
-        FROM expenses
-        WHERE user_id = ? AND account IS NOT NULL
-        ORDER BY account
-    ''', (user_id,))
 
-    accounts = [row[0] for row in cursor.fetchall()]
-    conn.close()
+user_profiles = ProfileCache(PROFILE_CACHE_SIZE)
+
+
+def invalidate_user_profile(user_id):
+    """Drop the user's cached profile once the current write commits."""
+    db.after_commit(lambda: user_profiles.invalidate(user_id))
+
 
-    default_accounts = ['Cash', 'Online', 'Credit Card', 'Debit Card', 'UPI', 'Mobile Wallet']
+def get_profile_entry(user_id, key, load):
+    """A value derived from the user's data, kept in their cached profile.
 
-    for acc in default_accounts:
-        if acc not in accounts:
-            accounts.append(acc)
+    It is dropped with the profile on the next write; inside a transaction
+    it is loaded fresh and not kept.
+    """
+    if db.in_transaction():
+        return load()
 
-    return accounts
+    profile = user_profiles.get(user_id)
+    if key not in profile:
+        profile[key] = load()
+    return profile[key]
+
+
+def get_user_categories(user_id):
+    return list(user_profiles.get(user_id)['categories'])
+
+
+def get_subcategories_for_category(user_id, category):
+    subcategories = user_profiles.get(user_id)['subcategories'].get(category)
+    return list(subcategories or merge_subcategories([], category))
+
+
+def get_user_accounts(user_id):
+    return list(user_profiles.get(user_id)['accounts'])
 
 
 def get_description_suggestions(user_id, category, subcategory=None):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+    return list(get_profile_entry(
+        user_id, ('descriptions', category, subcategory),
+        lambda: load_description_suggestions(user_id, category, subcategory)
+    ))
+
 
+def load_description_suggestions(user_id, category, subcategory=None):
     if subcategory:
-        cursor.execute('''
+        rows = db.fetchall('''
             SELECT description, COUNT(*) as freq
             FROM expenses
             WHERE user_id = ? AND category = ? AND subcategory = ?
                 AND description != 'No description' AND description != 'Imported from Excel'
             GROUP BY description
-            ORDER BY freq DESC, MAX(date) DESC
+            ORDER BY freq DESC, MAX(ts) DESC
             LIMIT 6
         ''', (user_id, category, subcategory))
     else:
-        cursor.execute('''
+        rows = db.fetchall('''
             SELECT description, COUNT(*) as freq
             FROM expenses
             WHERE user_id = ? AND category = ?
                 AND description != 'No description' AND description != 'Imported from Excel'
             GROUP BY description
-            ORDER BY freq DESC, MAX(date) DESC
+            ORDER BY freq DESC, MAX(ts) DESC
             LIMIT 6
         ''', (user_id, category))
 
-    suggestions = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    suggestions = [row[0] for row in rows]
 
     return suggestions
 
 
-# Parse human-readable date/time
-def parse_human_datetime(text):
-    try:
-        text = text.strip().lower()
-        now = datetime.now()
+# Parse human-readable date/time. Inputs are normalized, then matched
+# against a table of precompiled shapes; dateutil's fuzzy parser is only the
+# last resort. Results are memoized per (input, reference date). Inputs
+# relative to the current time ("now", "2 days ago") are cached as an
+# offset, so a cached answer never freezes the clock.
+TIME_OF_DAY = r'(?:at\s+)?(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?(?::(?P<second>\d{2}))?\s*(?P<ampm>am|pm)?'
+HUMAN_TIME = r'(?:\s+' + TIME_OF_DAY + r')?'
 
-        if text in ['now', 'today']:
-            return now
 
-        if text.startswith('yesterday'):
-            rest = text.replace('yesterday', '').strip()
-            base = now - timedelta(days=1)
-            if rest:
-                try:
-                    parsed = date_parser.parse(rest, fuzzy=True)
-                    return base.replace(hour=parsed.hour, minute=parsed.minute, second=parsed.second, microsecond=0)
-                except:
-                    return base.replace(hour=0, minute=0, second=0, microsecond=0)
-            return base.replace(hour=0, minute=0, second=0, microsecond=0)
+def human_time(match):
+    """(hour, minute, second) of the optional time-of-day group, or None when it is absent.
 
-        if 'days ago' in text:
-            try:
-                days = int(text.split('days ago')[0].strip())
-                return now - timedelta(days=days)
-            except:
-                pass
+    A bare hour needs am/pm, as in "8pm"; "14" alone is not read as a time.
+    """
+    hour, minute, second, ampm = match.group('hour', 'minute', 'second', 'ampm')
+    if hour is None:
+        return None
+    if minute is None and ampm is None:
+        raise ValueError(f"ambiguous time {hour!r}")
+
+    hour = int(hour)
+    if ampm:
+        if not 1 <= hour <= 12:
+            raise ValueError(f"invalid 12-hour time {hour!r}")
+        hour = hour % 12 + (12 if ampm == 'pm' else 0)
+    return hour, int(minute or 0), int(second or 0)
+
+
+def on_day(day, match):
+    return datetime.combine(day, dt_time(*(human_time(match) or (0, 0, 0))))
+
+
+def day_first_date(match, today):
+    """dd/mm[/yy[yy]] with any of - / . as separator.
+
+    Without a year it is the latest such date up to today, so "5/12" typed
+    in October means last December rather than a future one.
+    """
+    day, month, year = int(match['day']), int(match['month']), match['year']
+    if year is not None:
+        return datetime(int(year) + (2000 if len(year) == 2 else 0), month, day)
+
+    when = datetime(today.year, month, day)
+    return when if when.date() <= today else datetime(today.year - 1, month, day)
+
+
+def days_ago(match, today):
+    """"2 days ago" is relative to the current time; "2 days ago 8pm" is a time on that day."""
+    days = timedelta(days=int(match['days']))
+    if match['hour'] is None:
+        return 'ago', days
+    return 'at', on_day(today - days, match)
+
+
+# (pattern, builder): a builder returns ('at', datetime) or ('ago', timedelta)
+HUMAN_DATETIME_SHAPES = [
+    (re.compile(r'(?:now|today)'), lambda match, today: ('ago', timedelta(0))),
+    (re.compile(r'(?P<days>\d+) days? ago' + HUMAN_TIME), days_ago),
+    (re.compile(r'yesterday' + HUMAN_TIME), lambda match, today: ('at', on_day(today - timedelta(days=1), match))),
+    (re.compile(r'today' + HUMAN_TIME), lambda match, today: ('at', on_day(today, match))),
+    (re.compile(TIME_OF_DAY), lambda match, today: ('at', on_day(today, match))),
+    (re.compile(r'(?P<year>\d{4})(?P<sep>[-/.])(?P<month>\d{1,2})(?P=sep)(?P<day>\d{1,2})' + HUMAN_TIME),
+     lambda match, today: ('at', on_day(datetime(int(match['year']), int(match['month']), int(match['day'])), match))),
+    (re.compile(r'(?P<day>\d{1,2})(?P<sep>[-/.])(?P<month>\d{1,2})(?:(?P=sep)(?P<year>\d{4}|\d{2}))?' + HUMAN_TIME),
+     lambda match, today: ('at', on_day(day_first_date(match, today), match))),
+]
+
+
+@lru_cache(maxsize=1024)
+def parse_human_datetime_shape(text, today):
+    """('at', datetime) or ('ago', timedelta) for normalized text, or None.
 
-        # Try common formats
-        for fmt in ['%Y-%m-%d %H:%M', '%Y-%m-%d', '%d/%m/%Y %I:%M %p', '%d/%m/%Y %H:%M', '%d/%m/%Y']:
+    Text that has a known shape but an impossible value, such as "13pm" or
+    "31/02/2025", is rejected rather than guessed at by dateutil.
+    """
+    for pattern, build in HUMAN_DATETIME_SHAPES:
+        match = pattern.fullmatch(text)
+        if match:
             try:
-                return datetime.strptime(text, fmt)
-            except:
-                pass
+                return build(match, today)
+            except ValueError:
+                return None
+
+    if text.startswith('yesterday'):
+        # "yesterday" followed by a time the table doesn't know, e.g. "yesterday evening 7"
+        base = datetime.combine(today - timedelta(days=1), dt_time())
+        try:
+            parsed = date_parser.parse(text[len('yesterday'):], fuzzy=True)
+            return 'at', base.replace(hour=parsed.hour, minute=parsed.minute, second=parsed.second)
+        except (ValueError, OverflowError):
+            return 'at', base
+
+    try:
+        return 'at', date_parser.parse(text, fuzzy=True, dayfirst=True, default=datetime.combine(today, dt_time()))
+    except (ValueError, OverflowError):
+        return None
+
+
+def parse_human_datetime(text, now=None):
+    """The datetime a user meant by text, relative to now; None when it can't be read."""
+    now = now or datetime.now()
+    result = parse_human_datetime_shape(' '.join(text.lower().split()), now.date())
+
+    if result is None:
+        return None
+    kind, value = result
+    return now - value if kind == 'ago' else value
+
+
+# Quick add: one message such as "250 food lunch upi yesterday 8pm" is
+# matched against a per-user index of category, subcategory and account
+# names, built on first use and kept in the user's cached profile.
+QUICK_ADD_AMOUNT = re.compile(r'^(?:₹|rs\.?|inr)?(\d+(?:\.\d{1,2})?)$', re.IGNORECASE)
+QUICK_ADD_TIME = re.compile(r'^\d{1,2}(?::\d{2})?(?:am|pm)$|^\d{1,2}:\d{2}$', re.IGNORECASE)
+QUICK_ADD_CLOCK = re.compile(r'^\d{1,2}(?::\d{2})?$')
+QUICK_ADD_MERIDIEM = re.compile(r'^[ap]\.?m\.?$', re.IGNORECASE)
+# Dots only count as date separators with a 4-digit year, so "12.50" stays an amount
+QUICK_ADD_DATE = re.compile(r'^\d{1,4}[-/]\d{1,2}(?:[-/]\d{1,4})?$|^\d{1,2}\.\d{1,2}\.\d{4}$|^\d{4}\.\d{1,2}\.\d{1,2}$')
+QUICK_ADD_DAY_WORDS = {'today', 'yesterday', 'now'}
+QUICK_ADD_MAX_WORDS = 3
+
+
+def lookup_key(name):
+    """Lower-cased name without emoji and extra spaces, as typed by users."""
+    return ' '.join(re.sub(r'[^\w\s&/.-]', ' ', name).lower().split())
+
+
+def build_quick_add_index(user_id):
+    """{'category' | 'account': {key: name}, 'subcategory': {key: [(category, name)]}}."""
+    index = {'category': {}, 'subcategory': {}, 'account': {}}
+
+    for category in get_user_categories(user_id):
+        index['category'].setdefault(lookup_key(category), category)
+        for subcategory in get_subcategories_for_category(user_id, category):
+            index['subcategory'].setdefault(lookup_key(subcategory), []).append((category, subcategory))
+
+    for account in get_user_accounts(user_id):
+        index['account'].setdefault(lookup_key(account), account)
+
+    return index
+
+
+def get_quick_add_index(user_id):
+    return get_profile_entry(user_id, 'quick_add_index', lambda: build_quick_add_index(user_id))
+
 
-        # Fallback to dateutil parser
-        return date_parser.parse(text, fuzzy=True)
-    except:
+def parse_quick_add(text, index):
+    """Split a quick-add message into expense fields.
+
+    Returns a dict with amount, category, subcategory, account, description,
+    day_text and time_text, and date_text joining the two (None when
+    absent), or None when the message has no amount.
+    Names may span up to QUICK_ADD_MAX_WORDS words; the longest match wins.
+    """
+    # "2:35 pm" is one time; "at" before a time is dropped
+    tokens = []
+    for token in text.split():
+        if QUICK_ADD_MERIDIEM.match(token) and tokens and QUICK_ADD_CLOCK.match(tokens[-1]):
+            tokens[-1] += token.replace('.', '')
+        else:
+            tokens.append(token)
+    tokens = [token for token, following in zip(tokens, tokens[1:] + [''])
+              if not (token.lower() == 'at' and QUICK_ADD_TIME.match(following))]
+
+    amount = None
+    found = {'category': None, 'subcategory': None, 'account': None}
+    day_words, dates, times, rest = [], [], [], []
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        lowered = token.lower()
+
+        match = QUICK_ADD_AMOUNT.match(token.replace(',', ''))
+        if amount is None and match:
+            amount = float(match.group(1))
+            i += 1
+            continue
+
+        if lowered in QUICK_ADD_DAY_WORDS:
+            day_words.append(lowered)
+            i += 1
+            continue
+        if (lowered.isdigit() and i + 2 < len(tokens)
+                and tokens[i + 1].lower() in ('day', 'days') and tokens[i + 2].lower() == 'ago'):
+            day_words.append(f'{lowered} days ago')
+            i += 3
+            continue
+        if QUICK_ADD_TIME.match(token):
+            times.append(lowered)
+            i += 1
+            continue
+        if QUICK_ADD_DATE.match(token):
+            dates.append(token)
+            i += 1
+            continue
+
+        for words in range(min(QUICK_ADD_MAX_WORDS, len(tokens) - i), 0, -1):
+            key = lookup_key(' '.join(tokens[i:i + words]))
+            kind = next((kind for kind in ('category', 'subcategory', 'account')
+                         if found[kind] is None and key in index[kind]), None)
+            if kind:
+                found[kind] = index[kind][key]
+                i += words
+                break
+        else:
+            rest.append(token)
+            i += 1
+
+    if amount is None:
         return None
 
+    # A subcategory picks its category when none was given, and must belong
+    # to the one that was
+    category, subcategory = found['category'], None
+    for owner, name in found['subcategory'] or []:
+        if category is None or owner == category:
+            category, subcategory = owner, name
+            break
+    else:
+        if found['subcategory']:
+            rest.insert(0, found['subcategory'][0][1])
+
+    return {
+        'amount': amount,
+        'category': category,
+        'subcategory': subcategory,
+        'account': found['account'],
+        'description': ' '.join(rest) or None,
+        'day_text': ' '.join(day_words + dates) or None,
+        'time_text': ' '.join(times) or None,
+        'date_text': ' '.join(day_words + dates + times) or None,
+    }
+
+
+def resolve_quick_add(text, index):
+    """(expense, error) for one quick-add line.
+
+    expense holds the finalize_save_expense fields; error is a short reason
+    when the line can't be saved. Both are None when it has no amount.
+    """
+    parsed = parse_quick_add(text, index)
+    if parsed is None or parsed['amount'] <= 0:
+        return None, None
+
+    if parsed['category'] is None:
+        return None, "no category matched (try " + ", ".join(index['category']) + ")"
+
+    # The day ("2 days ago", "28/10/2025") and the time ("8pm") are read
+    # separately, then the time is applied to that day
+    now = datetime.now()
+    chosen_dt = day = parse_human_datetime(parsed['day_text'], now) if parsed['day_text'] else now
+    time_of_day = parse_human_datetime(parsed['time_text'], now) if parsed['time_text'] else None
+    if not day or (parsed['time_text'] and not time_of_day):
+        return None, f"couldn't understand the date/time \"{parsed['date_text']}\""
+    if time_of_day:
+        chosen_dt = datetime.combine(day.date(), time_of_day.time())
+
+    return {
+        'category': parsed['category'],
+        'subcategory': parsed['subcategory'],
+        'amount': parsed['amount'],
+        'description': parsed['description'] or 'No description',
+        'account': parsed['account'],
+        'chosen_dt': chosen_dt,
+    }, None
+
 
 def get_account_balance(user_id, account_name):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+    if db.in_transaction():
+        # Writers read the one row they are about to change, not the whole profile
+        row = db.fetchone('''
+            SELECT initial_balance, current_balance, last_updated
+            FROM account_balances
+            WHERE user_id = ? AND account_name = ?
+        ''', (user_id, account_name))
+        return dict(zip(('initial', 'current', 'last_updated'), row)) if row else None
 
-    cursor.execute('''
-        SELECT initial_balance, current_balance, last_updated
-        FROM account_balances
-        WHERE user_id = ? AND account_name = ?
-    ''', (user_id, account_name))
+    balance = user_profiles.get(user_id)['balance_by_account'].get(account_name)
+    return dict(balance) if balance else None
+
+
+def update_account_balance(user_id, account_name, amount, operation='set'):
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with db.transaction() as conn:
+        existing = conn.execute('''
+            SELECT current_balance FROM account_balances
+            WHERE user_id = ? AND account_name = ?
+        ''', (user_id, account_name)).fetchone()
+
+        if existing:
+            if operation == 'set':
+                new_balance = amount
+            elif operation == 'add':
+                new_balance = existing[0] + amount
+            elif operation == 'subtract':
+                new_balance = existing[0] - amount
+            else:
+                new_balance = amount
+
+            conn.execute('''
+                UPDATE account_balances
+                SET current_balance = ?, last_updated = ?
+                WHERE user_id = ? AND account_name = ?
+            ''', (new_balance, current_time, user_id, account_name))
+        else:
+            conn.execute('''
+                INSERT INTO account_balances (user_id, account_name, initial_balance, current_balance, last_updated)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, account_name, amount, amount, current_time))
+
+        invalidate_user_profile(user_id)
+
+
+def get_all_account_balances(user_id):
+    return list(user_profiles.get(user_id)['balances'])
 
-    result = cursor.fetchone()
-    conn.close()
 
-    if result:
-        return {'initial': result[0], 'current': result[1], 'last_updated': result[2]}
+def get_available_months(user_id):
+    rows = db.fetchall('''
+        SELECT DISTINCT month
+        FROM expense_rollups
+        WHERE user_id = ?
+        ORDER BY month DESC
+    ''', (user_id,))
+
+    months = [row[0] for row in rows]
+    return months
+
+
+# Get category and subcategory-wise breakdown
+def get_category_subcategory_breakdown(user_id, year_month):
+    results = db.fetchall('''
+        SELECT category, NULLIF(subcategory, ''), SUM(total), SUM(txn_count)
+        FROM expense_rollups
+        WHERE user_id = ? AND month = ?
+        GROUP BY category, subcategory
+        ORDER BY category, SUM(total) DESC
+    ''', (user_id, year_month))
+
+    # Organize by category
+    breakdown = {}
+    for cat, subcat, amount, count in results:
+        if cat not in breakdown:
+            breakdown[cat] = {'total': 0, 'subcategories': []}
+        breakdown[cat]['total'] += amount
+        breakdown[cat]['subcategories'].append({
+            'name': subcat or 'No subcategory',
+            'amount': amount,
+            'count': count
+        })
+
+    return breakdown
+
+
+# Rollups: expense_rollups keeps total, count and active days per
+# (user, month, category, subcategory, account) and expense_daily_rollups
+# keeps total and count per (user, day). Missing subcategory/account are
+# stored as ''. Every write to expenses updates them in the same transaction.
+def apply_to_rollups(conn, user_id, category, subcategory, account, amount, ts, sign):
+    """Add (sign=1) or remove (sign=-1) one expense from the rollups.
+
+    Call it before inserting or after deleting the expense row, so the
+    active-day check below only sees the user's other expenses.
+    """
+    day = ts // 86400
+    month = from_timestamp(ts).strftime('%Y-%m')
+
+    other_same_day = conn.execute('''
+        SELECT 1 FROM expenses
+        WHERE user_id = ? AND category = ? AND ts >= ? AND ts < ?
+            AND subcategory IS ? AND account IS ?
+        LIMIT 1
+    ''', (user_id, category, day * 86400, (day + 1) * 86400, subcategory, account)).fetchone()
+    active_days = 0 if other_same_day else sign
+
+    conn.execute('''
+        INSERT INTO expense_rollups (user_id, month, category, subcategory, account, total, txn_count, active_days)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, month, category, subcategory, account) DO UPDATE SET
+            total = total + excluded.total,
+            txn_count = txn_count + excluded.txn_count,
+            active_days = active_days + excluded.active_days
+    ''', (user_id, month, category, subcategory or '', account or '', sign * amount, sign, active_days))
+
+    conn.execute('''
+        INSERT INTO expense_daily_rollups (user_id, day, total, txn_count)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            total = total + excluded.total,
+            txn_count = txn_count + excluded.txn_count
+    ''', (user_id, day, sign * amount, sign))
+
+    bump_data_versions(conn, user_id, [month])
+
+    if sign < 0:
+        conn.execute('''
+            DELETE FROM expense_rollups
+            WHERE user_id = ? AND month = ? AND category = ? AND subcategory = ? AND account = ?
+                AND txn_count <= 0
+        ''', (user_id, month, category, subcategory or '', account or ''))
+        conn.execute('''
+            DELETE FROM expense_daily_rollups
+            WHERE user_id = ? AND day = ? AND txn_count <= 0
+        ''', (user_id, day))
+
+
+# Data versions: a per-(user, month) counter bumped by every write that
+# changes that month's expenses. Cached reports are valid only for the
+# version they were built from.
+def bump_data_versions(conn, user_id, months):
+    conn.executemany('''
+        INSERT INTO data_versions (user_id, month, version) VALUES (?, ?, 1)
+        ON CONFLICT (user_id, month) DO UPDATE SET version = version + 1
+    ''', [(user_id, month) for month in months])
+
+
+# Subcategory and account usage: how many of the user's expenses use each
+# one and the newest such expense's ts, so pickers can list them most-used
+# first without scanning expenses.
+def record_usage(conn, user_id, expenses):
+    """Count (category, subcategory, account, ts) expenses that were just inserted."""
+    subcategories = {}
+    accounts = {}
+    for category, subcategory, account, ts in expenses:
+        keys = []
+        if subcategory is not None:
+            keys.append((subcategories, (category, subcategory)))
+        if account is not None:
+            keys.append((accounts, account))
+        for usage, key in keys:
+            count, last_used = usage.get(key, (0, 0))
+            usage[key] = (count + 1, max(last_used, ts or 0))
+
+    conn.executemany('''
+        INSERT INTO subcategories (user_id, category, name, use_count, last_used)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, category, name) DO UPDATE SET
+            use_count = use_count + excluded.use_count,
+            last_used = MAX(last_used, excluded.last_used)
+    ''', [(user_id, *key, count, last_used) for key, (count, last_used) in subcategories.items()])
+    conn.executemany('''
+        INSERT INTO accounts (user_id, name, use_count, last_used)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id, name) DO UPDATE SET
+            use_count = use_count + excluded.use_count,
+            last_used = MAX(last_used, excluded.last_used)
+    ''', [(user_id, key, count, last_used) for key, (count, last_used) in accounts.items()])
+
+
+def refresh_usage(conn, user_id, category, subcategory, account):
+    """Recount one subcategory and account from expenses after a delete."""
+    if subcategory is not None:
+        count, last_used = conn.execute('''
+            SELECT COUNT(*), COALESCE(MAX(ts), 0) FROM expenses
+            WHERE user_id = ? AND category = ? AND subcategory = ?
+        ''', (user_id, category, subcategory)).fetchone()
+        conn.execute('''
+            UPDATE subcategories SET use_count = ?, last_used = ?
+            WHERE user_id = ? AND category = ? AND name = ?
+        ''', (count, last_used, user_id, category, subcategory))
+        conn.execute('''
+            DELETE FROM subcategories
+            WHERE user_id = ? AND category = ? AND name = ? AND use_count <= 0
+        ''', (user_id, category, subcategory))
+
+    if account is not None:
+        count, last_used = conn.execute('''
+            SELECT COUNT(*), COALESCE(MAX(ts), 0) FROM expenses
+            WHERE user_id = ? AND account = ?
+        ''', (user_id, account)).fetchone()
+        conn.execute('''
+            UPDATE accounts SET use_count = ?, last_used = ?
+            WHERE user_id = ? AND name = ?
+        ''', (count, last_used, user_id, account))
+        conn.execute('''
+            DELETE FROM accounts WHERE user_id = ? AND name = ? AND use_count <= 0
+        ''', (user_id, account))
+
+
+def rebuild_usage(user_id=None):
+    """Recompute subcategory and account usage from expenses, for one user or everyone."""
+    where, params = ('1', ()) if user_id is None else ('user_id = ?', (user_id,))
+    with db.transaction() as conn:
+        conn.execute(f'DELETE FROM subcategories WHERE {where}', params)
+        conn.execute(f'DELETE FROM accounts WHERE {where}', params)
+        conn.execute(f'''
+            INSERT INTO subcategories (user_id, category, name, use_count, last_used)
+            SELECT user_id, category, subcategory, COUNT(*), COALESCE(MAX(ts), 0)
+            FROM expenses
+            WHERE {where} AND subcategory IS NOT NULL
+            GROUP BY 1, 2, 3
+        ''', params)
+        conn.execute(f'''
+            INSERT INTO accounts (user_id, name, use_count, last_used)
+            SELECT user_id, account, COUNT(*), COALESCE(MAX(ts), 0)
+            FROM expenses
+            WHERE {where} AND account IS NOT NULL
+            GROUP BY 1, 2
+        ''', params)
+
+
+def get_data_version(user_id, year_month):
+    row = db.fetchone(
+        'SELECT version FROM data_versions WHERE user_id = ? AND month = ?',
+        (user_id, year_month)
+    )
+    return row[0] if row else 0
+
+
+def get_range_data_version(user_id, months):
+    """Version of a report spanning several months.
+
+    Every month's version only ever grows, so their sum changes whenever
+    any of them does.
+    """
+    placeholders = ', '.join('?' * len(months))
+    return db.fetchone(f'''
+        SELECT COALESCE(SUM(version), 0) FROM data_versions
+        WHERE user_id = ? AND month IN ({placeholders})
+    ''', (user_id, *months))[0]
+
+
+def rebuild_rollups(user_id=None, months=None):
+    """Recompute rollups from expenses.
+
+    With no arguments every user is rebuilt; otherwise only `user_id`, and
+    only the given 'YYYY-MM' months when `months` is passed.
+    """
+    with db.transaction() as conn:
+        if user_id is None:
+            conn.execute('DELETE FROM expense_rollups')
+            conn.execute('DELETE FROM expense_daily_rollups')
+            scopes = [('1', ())]
+        elif months is None:
+            conn.execute('DELETE FROM expense_rollups WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM expense_daily_rollups WHERE user_id = ?', (user_id,))
+            scopes = [('user_id = ?', (user_id,))]
+        else:
+            scopes = []
+            for month in months:
+                start, end = month_range(month)
+                conn.execute('DELETE FROM expense_rollups WHERE user_id = ? AND month = ?', (user_id, month))
+                conn.execute('''
+                    DELETE FROM expense_daily_rollups
+                    WHERE user_id = ? AND day >= ? AND day < ?
+                ''', (user_id, start // 86400, end // 86400))
+                scopes.append(('user_id = ? AND ts >= ? AND ts < ?', (user_id, start, end)))
+
+        for where, params in scopes:
+            conn.execute(f'''
+                INSERT INTO expense_rollups (user_id, month, category, subcategory, account, total, txn_count, active_days)
+                SELECT user_id, strftime('%Y-%m', ts, 'unixepoch'), category,
+                       COALESCE(subcategory, ''), COALESCE(account, ''),
+                       SUM(amount), COUNT(*), COUNT(DISTINCT ts / 86400)
+                FROM expenses
+                WHERE {where} AND ts IS NOT NULL
+                GROUP BY 1, 2, 3, 4, 5
+            ''', params)
+            conn.execute(f'''
+                INSERT INTO expense_daily_rollups (user_id, day, total, txn_count)
+                SELECT user_id, ts / 86400, SUM(amount), COUNT(*)
+                FROM expenses
+                WHERE {where} AND ts IS NOT NULL
+                GROUP BY 1, 2
+            ''', params)
+
+
+def rebuild_rollups_command():
+    init_db()
+    rebuild_rollups()
+    rebuild_usage()
+    users, rows = db.fetchone('SELECT COUNT(DISTINCT user_id), COUNT(*) FROM expense_rollups')
+    print(f"✅ Rebuilt {rows} rollup rows for {users} users, and subcategory and account usage")
+    return 0
+
+
+# Repository queries used by the handlers (run through run_db)
+def get_month_category_totals(user_id, year_month):
+    return db.fetchall('''
+        SELECT category, SUM(total), SUM(txn_count)
+        FROM expense_rollups
+        WHERE user_id = ? AND month = ?
+        GROUP BY category
+        ORDER BY SUM(total) DESC
+    ''', (user_id, year_month))
+
+
+def get_month_report(user_id, year_month):
+    start, end = month_range(year_month)
+
+    categories_data = get_month_category_totals(user_id, year_month)
+    total = sum(amount for _, amount, _ in categories_data)
+
+    days_count = db.fetchone('''
+        SELECT COUNT(*)
+        FROM expense_daily_rollups
+        WHERE user_id = ? AND day >= ? AND day < ?
+    ''', (user_id, start // 86400, end // 86400))[0] or 1
+
+    return total, categories_data, days_count
+
+
+def get_range_totals(user_id, start, end, category=None):
+    """(count, total) of expenses in [start, end), read from the rollups.
+
+    Ranges must cover whole days, and whole months when a category is given.
+    """
+    if category is None:
+        return db.fetchone('''
+            SELECT COALESCE(SUM(txn_count), 0), SUM(total)
+            FROM expense_daily_rollups
+            WHERE user_id = ? AND day >= ? AND day < ?
+        ''', (user_id, start // 86400, end // 86400))
+
+    return db.fetchone('''
+        SELECT COALESCE(SUM(txn_count), 0), SUM(total)
+        FROM expense_rollups
+        WHERE user_id = ? AND category = ? AND month >= ? AND month < ?
+    ''', (user_id, category, from_timestamp(start).strftime('%Y-%m'), from_timestamp(end).strftime('%Y-%m')))
+
+
+def get_range_month_category_totals(user_id, start, end):
+    """(month, category, total, count) rows for [start, end), month by month.
+
+    Months the range covers entirely are read from the rollups; only the
+    partial months at its edges are aggregated from expenses.
+    """
+    rows = []
+    for month in months_between(start, end):
+        month_start, month_end = month_range(month)
+        if start <= month_start and month_end <= end:
+            rows += db.fetchall('''
+                SELECT month, category, SUM(total), SUM(txn_count)
+                FROM expense_rollups
+                WHERE user_id = ? AND month = ?
+                GROUP BY category
+            ''', (user_id, month))
+        else:
+            rows += db.fetchall('''
+                SELECT ?, category, SUM(amount), COUNT(*)
+                FROM expenses
+                WHERE user_id = ? AND ts >= ? AND ts < ?
+                GROUP BY category
+            ''', (month, user_id, max(start, month_start), min(end, month_end)))
+    return rows
+
+
+def get_transactions_page(user_id, start, end, limit, before=None, category=None):
+    """Keyset page of expenses in [start, end), newest first.
+
+    `before` is the (ts, id) of the last row already shown; the page starts
+    right after it, so every page is a single index seek plus `limit` rows.
+    Rows are (date, category, subcategory, amount, description, account, ts, id).
+    """
+    sql = '''
+        SELECT date, category, subcategory, amount, description, account, ts, id
+        FROM expenses
+        WHERE user_id = ? AND ts >= ? AND ts < ?
+    '''
+    params = [user_id, start, end]
+
+    if category is not None:
+        sql += ' AND category = ?'
+        params.append(category)
+
+    if before is not None:
+        sql += ' AND ts <= ? AND (ts < ? OR id < ?)'
+        params.extend([before[0], before[0], before[1]])
+
+    sql += ' ORDER BY ts DESC, id DESC LIMIT ?'
+    params.append(limit)
+
+    return db.fetchall(sql, params)
+
+
+def get_top_expenses(user_id, year_month, limit=10):
+    return db.fetchall('''
+        SELECT date, category, subcategory, amount, description
+        FROM expenses
+        WHERE user_id = ? AND ts >= ? AND ts < ?
+        ORDER BY amount DESC
+        LIMIT ?
+    ''', (user_id, *month_range(year_month), limit))
+
+
+def get_account_activity(user_id, account):
+    txn_count, total_spent = db.fetchone('''
+        SELECT COUNT(*), SUM(amount)
+        FROM expenses
+        WHERE user_id = ? AND account = ?
+    ''', (user_id, account))
+
+    last_txn = db.fetchone('''
+        SELECT date, amount, category
+        FROM expenses
+        WHERE user_id = ? AND account = ?
+        ORDER BY ts DESC
+        LIMIT 1
+    ''', (user_id, account))
+
+    return txn_count, total_spent or 0, last_txn
+
+
+def get_month_expenses_df(user_id, year_month):
+    query = '''
+        SELECT date, category, subcategory, amount, description, account
+        FROM expenses
+        WHERE user_id = ? AND ts >= ? AND ts < ?
+        ORDER BY ts DESC
+    '''
+
+    with db.connection() as conn:
+        return pd.read_sql_query(query, conn, params=(user_id, *month_range(year_month)))
+
+
+# Expense fingerprints: a content hash of what the user sees in an expense.
+# Identical rows are numbered by occurrence before hashing, so genuine
+# repeats (two identical teas) stay distinct while a re-imported export maps
+# onto exactly the rows it created the first time.
+def expense_fingerprint(user_id, ts, amount, category, subcategory, description, account, occurrences):
+    key = (user_id, ts, f'{float(amount):.2f}', category, subcategory or '', description or '', account or '')
+    occurrence = occurrences[key]
+    occurrences[key] += 1
+    return hashlib.blake2b('\x1f'.join(map(str, key + (occurrence,))).encode(), digest_size=16).hexdigest()
+
+
+def insert_expenses(rows, occurrences=None):
+    """Insert the (user_id, category, subcategory, amount, description, account, date)
+    rows that are not stored yet; returns (inserted, skipped).
+
+    Pass the same occurrences Counter for every chunk of one file so identical
+    rows on either side of a chunk boundary are numbered consistently. The
+    rollups of every month that gained rows are rebuilt in the same transaction.
+    """
+    if occurrences is None:
+        occurrences = Counter()
+
+    candidates = []
+    for user_id, category, subcategory, amount, description, account, date_str in rows:
+        ts = to_timestamp(date_str)
+        fingerprint = expense_fingerprint(
+            user_id, ts, amount, category, subcategory, description, account, occurrences
+        )
+        candidates.append((user_id, category, subcategory, amount, description, account, date_str, ts, fingerprint))
+
+    with db.transaction() as conn:
+        existing = set()
+        by_user = {}
+        for row in candidates:
+            by_user.setdefault(row[0], []).append(row[8])
+
+        for user_id, fingerprints in by_user.items():
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(fingerprints), 500):
+                batch = fingerprints[start:start + 500]
+                existing.update(fingerprint for fingerprint, in conn.execute(f'''
+                    SELECT fingerprint FROM expenses
+                    WHERE user_id = ? AND fingerprint IN ({','.join('?' * len(batch))})
+                ''', (user_id, *batch)))
+
+        new_rows = [row for row in candidates if row[8] not in existing]
+        conn.executemany('''
+            INSERT INTO expenses (user_id, category, subcategory, amount, description, account, date, ts, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', new_rows)
+
+        touched = {}
+        for row in new_rows:
+            touched.setdefault(row[0], []).append(row)
+        for user_id, user_rows in touched.items():
+            months = {row[6][:7] for row in user_rows}
+            rebuild_rollups(user_id, sorted(months))
+            bump_data_versions(conn, user_id, months)
+            record_usage(conn, user_id, [(row[1], row[2], row[5], row[7]) for row in user_rows])
+            invalidate_user_profile(user_id)
+
+    return len(new_rows), len(candidates) - len(new_rows)
+
+
+def advance_occurrences(rows, occurrences):
+    """Number rows an earlier run already committed, exactly as insert_expenses did."""
+    for user_id, category, subcategory, amount, description, account, date_str in rows:
+        expense_fingerprint(
+            user_id, to_timestamp(date_str), amount, category, subcategory, description, account, occurrences
+        )
+
+
+def change_account_balance(user_id, account_name, amount, operation):
+    """Apply a balance operation and return the resulting current balance."""
+    with db.transaction():
+        update_account_balance(user_id, account_name, amount, operation)
+        return get_account_balance(user_id, account_name)['current']
+
+
+def save_expense(user_id, category, subcategory, amount, description, account, date_str):
+    """Insert one expense and charge its account; returns the new balance or None."""
+    ts = to_timestamp(date_str)
+    with db.transaction() as conn:
+        occurrences = Counter()
+        while True:
+            fingerprint = expense_fingerprint(
+                user_id, ts, amount, category, subcategory, description, account, occurrences
+            )
+            if not conn.execute(
+                'SELECT 1 FROM expenses WHERE user_id = ? AND fingerprint = ?', (user_id, fingerprint)
+            ).fetchone():
+                break
+
+        apply_to_rollups(conn, user_id, category, subcategory, account, amount, ts, 1)
+        conn.execute('''
+            INSERT INTO expenses (user_id, category, subcategory, amount, description, account, date, ts, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, category, subcategory, amount, description, account, date_str, ts, fingerprint))
+        record_usage(conn, user_id, [(category, subcategory, account, ts)])
+
+        invalidate_user_profile(user_id)
+        if account and get_account_balance(user_id, account):
+            return change_account_balance(user_id, account, amount, 'subtract')
     return None
 
 
-def update_account_balance(user_id, account_name, amount, operation='set'):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+def save_expenses(user_id, expenses):
+    """Insert many (category, subcategory, amount, description, account, date) expenses at once.
+
+    Unlike insert_expenses nothing is skipped as a duplicate: like
+    save_expense, each row takes the next unused fingerprint. Rollups are
+    rebuilt once per touched month and each account is charged once with
+    its total. Returns {account: new balance} for accounts with a balance.
+    """
+    with db.transaction() as conn:
+        occurrences = Counter()
+        taken = set()
+        rows = []
+        for category, subcategory, amount, description, account, date_str in expenses:
+            ts = to_timestamp(date_str)
+            while True:
+                fingerprint = expense_fingerprint(
+                    user_id, ts, amount, category, subcategory, description, account, occurrences
+                )
+                if fingerprint not in taken and not conn.execute(
+                    'SELECT 1 FROM expenses WHERE user_id = ? AND fingerprint = ?', (user_id, fingerprint)
+                ).fetchone():
+                    break
+            taken.add(fingerprint)
+            rows.append((user_id, category, subcategory, amount, description, account, date_str, ts, fingerprint))
+
+        conn.executemany('''
+            INSERT INTO expenses (user_id, category, subcategory, amount, description, account, date, ts, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+        months = sorted({row[6][:7] for row in rows})
+        rebuild_rollups(user_id, months)
+        bump_data_versions(conn, user_id, months)
+        record_usage(conn, user_id, [(row[1], row[2], row[5], row[7]) for row in rows])
+        invalidate_user_profile(user_id)
+
+        account_totals = Counter()
+        for row in rows:
+            if row[5]:
+                account_totals[row[5]] += row[3]
+        if not account_totals:
+            return {}
+
+        # One UPDATE per account; accounts without a balance row are left alone
+        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany('''
+            UPDATE account_balances
+            SET current_balance = current_balance - ?, last_updated = ?
+            WHERE user_id = ? AND account_name = ?
+        ''', [(total, current_time, user_id, account) for account, total in account_totals.items()])
+
+        return dict(conn.execute(f'''
+            SELECT account_name, current_balance
+            FROM account_balances
+            WHERE user_id = ? AND account_name IN ({', '.join('?' * len(account_totals))})
+        ''', (user_id, *account_totals)).fetchall())
+
+
+def delete_last_expense(user_id):
+    """Delete the user's newest expense, refunding its account.
+
+    Returns (expense_row, new_balance); both are None when there is nothing
+    to delete, and new_balance is None when the account has no balance.
+    """
+    with db.transaction() as conn:
+        row = conn.execute('''
+            SELECT id, category, amount, description, account, subcategory, ts
+            FROM expenses
+            WHERE user_id = ?
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (user_id,)).fetchone()
+
+        if not row:
+            return None, None
+
+        last_expense = row[:5]
+        expense_id, category, amount, description, account, subcategory, ts = row
+
+        new_balance = None
+        if account and get_account_balance(user_id, account):
+            new_balance = change_account_balance(user_id, account, amount, 'add')
+
+        conn.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
+        if ts is not None:
+            apply_to_rollups(conn, user_id, category, subcategory, account, amount, ts, -1)
+        refresh_usage(conn, user_id, category, subcategory, account)
+        invalidate_user_profile(user_id)
+
+    return last_expense, new_balance
+
+
+# Hot repository calls checked by check_query_plans(), with sample arguments
+HOT_QUERIES = [
+    (load_user_profile, (0,)),
+    (load_description_suggestions, (0, '🍔 Food', 'Lunch')),
+    (load_description_suggestions, (0, '🍔 Food')),
+    (get_available_months, (0,)),
+    (get_category_subcategory_breakdown, (0, '2025-10')),
+    (get_month_report, (0, '2025-10')),
+    (get_range_totals, (0, *month_range('2025-10'))),
+    (get_range_totals, (0, *month_range('2025-10'), '🍔 Food')),
+    (get_transactions_page, (0, *month_range('2025-10'), 50)),
+    (get_transactions_page, (0, *month_range('2025-10'), 50, (1761955200, 100))),
+    (get_transactions_page, (0, *month_range('2025-10'), 30, (1761955200, 100), '🍔 Food')),
+    (get_top_expenses, (0, '2025-10')),
+    (get_account_activity, (0, 'Cash')),
+    (get_month_expenses_df, (0, '2025-10')),
+]
+
+
+def check_query_plans():
+    """Run EXPLAIN QUERY PLAN on every statement the hot queries issue.
+
+    Returns a list of (function name, statement, plan detail) for each step
+    that scans a whole table instead of searching an index.
+    """
+    problems = []
+
+    for func, args in HOT_QUERIES:
+        statements = []
+        with db.connection() as conn:
+            conn.set_trace_callback(statements.append)
+            try:
+                func(*args)
+            finally:
+                conn.set_trace_callback(None)
+
+            for statement in statements:
+                if not statement.lstrip().upper().startswith('SELECT'):
+                    continue
+                for row in conn.execute('EXPLAIN QUERY PLAN ' + statement):
+                    detail = row[-1]
+                    if detail.startswith('SCAN ') and 'CONSTANT ROW' not in detail:
+                        problems.append((func.__name__, ' '.join(statement.split()), detail))
+
+    return problems
+
+
+def check_indexes_command():
+    init_db()
+    problems = check_query_plans()
+
+    for name, statement, detail in problems:
+        print(f"❌ {name}: {detail}\n   {statement}")
+
+    if problems:
+        print(f"{len(problems)} hot query step(s) do not use an index")
+        return 1
+
+    print(f"✅ All {len(HOT_QUERIES)} hot queries use an index")
+    return 0
+
+
+# Generate professional Excel report
+# Report cache: generated files live in REPORT_CACHE_DIR, one per (user,
+# month, kind), tagged with the data version they were built from. Once a
+# file has been sent its Telegram file_id is kept, so an unchanged report is
+# re-sent without rebuilding or re-uploading it. The least recently used
+# files are evicted above REPORT_CACHE_MAX_BYTES; their file_id stays usable.
+def get_cached_report(user_id, year_month, kind, version):
+    """Return (path, file_id) of a current cached report, or None."""
+    with db.transaction() as conn:
+        row = conn.execute('''
+            SELECT path, file_id FROM report_cache
+            WHERE user_id = ? AND month = ? AND kind = ? AND version = ?
+        ''', (user_id, year_month, kind, version)).fetchone()
+
+        if not row:
+            return None
+
+        conn.execute('''
+            UPDATE report_cache SET last_used = ?
+            WHERE user_id = ? AND month = ? AND kind = ?
+        ''', (time.time(), user_id, year_month, kind))
+
+    path, file_id = row
+    if path and not os.path.exists(path):
+        path = None
+    return (path, file_id) if path or file_id else None
+
+
+def store_cached_report(user_id, year_month, kind, version, report, extension):
+    """Add a generated report to the cache and evict old files; returns its path.
+
+    report is the file's bytes, or the path of a finished file inside
+    REPORT_CACHE_DIR, which is moved into place.
+    """
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = os.path.join(REPORT_CACHE_DIR, f'{user_id}_{year_month}_{kind}_v{version}{extension}')
+
+    # Write then rename, so readers never see a partial file
+    if isinstance(report, str):
+        os.replace(report, path)
+    else:
+        with open(path + '.tmp', 'wb') as handle:
+            handle.write(report)
+        os.replace(path + '.tmp', path)
+    size = os.path.getsize(path)
+
+    with db.transaction() as conn:
+        previous = conn.execute(
+            'SELECT path FROM report_cache WHERE user_id = ? AND month = ? AND kind = ?',
+            (user_id, year_month, kind)
+        ).fetchone()
+
+        conn.execute('''
+            INSERT OR REPLACE INTO report_cache (user_id, month, kind, version, path, size, file_id, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, NULL, ?)
+        ''', (user_id, year_month, kind, version, path, size, time.time()))
+
+        evicted = evict_report_cache(conn, keep=path)
+
+    if previous and previous[0] and previous[0] != path:
+        evicted.append(previous[0])
+    for old_path in evicted:
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+    return path
+
+
+def evict_report_cache(conn, keep=None):
+    """Drop the least recently used files above the size cap; returns their paths.
+
+    The file at keep, usually the one just stored, is never evicted.
+    """
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM report_cache WHERE path IS NOT NULL').fetchone()[0]
+    evicted = []
+
+    for user_id, month, kind, path, size in conn.execute('''
+        SELECT user_id, month, kind, path, size FROM report_cache
+        WHERE path IS NOT NULL
+        ORDER BY last_used
+    ''').fetchall():
+        if total <= REPORT_CACHE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+
+        conn.execute('''
+            UPDATE report_cache SET path = NULL, size = 0
+            WHERE user_id = ? AND month = ? AND kind = ?
+        ''', (user_id, month, kind))
+        evicted.append(path)
+        total -= size
+
+    # Entries with neither a file nor a file_id can never be served
+    conn.execute('DELETE FROM report_cache WHERE path IS NULL AND file_id IS NULL')
+    return evicted
+
+
+def set_cached_report_file_id(user_id, year_month, kind, version, file_id):
+    db.execute('''
+        UPDATE report_cache SET file_id = ?
+        WHERE user_id = ? AND month = ? AND kind = ? AND version = ?
+    ''', (file_id, user_id, year_month, kind, version))
+
+
+def read_cached_report(path):
+    with open(path, 'rb') as handle:
+        return BytesIO(handle.read())
+
+
+def clear_cached_report_file_id(user_id, year_month, kind):
+    db.execute(
+        'UPDATE report_cache SET file_id = NULL WHERE user_id = ? AND month = ? AND kind = ?',
+        (user_id, year_month, kind)
+    )
+
+
+# Building a workbook is CPU-bound pandas/openpyxl work, so it runs in
+# worker processes; report_slots caps how many reports are in flight.
+report_executor = ProcessPoolExecutor(
+    max_workers=REPORT_WORKERS,
+    mp_context=multiprocessing.get_context('spawn')
+)
+report_slots = asyncio.Semaphore(REPORT_WORKERS)
+
+
+async def generate_professional_excel_report(user_id, year_month, context, **build_options):
+    """Build the month's report in report_executor.
+
+    Months up to REPORT_STREAM_ROWS expenses are built with pandas and come
+    back as a BytesIO. Bigger months are streamed from SQLite by the worker
+    into a temp file in REPORT_CACHE_DIR, and its path is returned instead.
+    Returns None when the month is empty. Raises TimeoutError when waiting
+    for and building the report together take longer than REPORT_TIMEOUT
+    seconds. build_options are passed on to run_report_build.
+    """
+    count, _ = await run_db(get_range_totals, user_id, *month_range(year_month))
+
+    if not count:
+        return None
+
+    if count > REPORT_STREAM_ROWS:
+        path = new_report_path(f'{user_id}_{year_month}_')
+        build_args = (stream_excel_report, user_id, *month_range(year_month), path)
+        abandon = lambda: discard_report_file(path)
+    else:
+        df = await run_db(get_month_expenses_df, user_id, year_month)
+        build_args = (build_excel_report, df, year_month)
+        abandon = None
+
+    report = await run_report_build(*build_args, abandon=abandon, **build_options)
+    return report if isinstance(report, str) else BytesIO(report)
+
+
+async def generate_range_report(user_id, start, end):
+    """Stream the report for [start, end) into a temp file; returns its path.
+
+    Ranges are always streamed, so a heavy user's whole financial year is
+    never loaded into one DataFrame. Returns None when the range is empty;
+    raises TimeoutError like generate_professional_excel_report.
+    """
+    start, end = to_timestamp(start), to_timestamp(end)
+    count, _ = await run_db(get_range_totals, user_id, start, end)
+
+    if not count:
+        return None
+
+    path = new_report_path(f'{user_id}_{start}_{end}_')
+    return await run_report_build(
+        stream_excel_report, user_id, start, end, path, abandon=lambda: discard_report_file(path)
+    )
+
+
+def new_report_path(prefix, suffix='.xlsx.tmp'):
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=REPORT_CACHE_DIR)
+    os.close(fd)
+    return path
+
+
+async def run_report_build(func, *args, executor=report_executor, slots=report_slots, abandon=None):
+    """Run func(*args) in executor once one of slots is free, within REPORT_TIMEOUT.
+
+    A timeout only stops the waiting: the worker process keeps building, so
+    its slot is held until the build really ends and abandoned builds still
+    count against REPORT_WORKERS. slots=None runs without taking a slot.
+    When the build fails or is given up on, abandon() is called to remove
+    what it leaves behind, again once the worker ends if it was still running.
+    """
+    loop = asyncio.get_running_loop()
+    state = {'future': None, 'abandoned': False}
+
+    def finished(future):
+        if slots is not None:
+            slots.release()
+        if not future.cancelled():
+            future.exception()  # An abandoned build's error is not logged as unretrieved
+        if state['abandoned']:
+            abandon()
+
+    async def start():
+        if slots is not None:
+            await slots.acquire()
+        try:
+            future = loop.run_in_executor(executor, func, *args)
+        except BaseException:
+            if slots is not None:
+                slots.release()
+            raise
+        state['future'] = future
+        future.add_done_callback(finished)
+        return future
+
+    deadline = loop.time() + REPORT_TIMEOUT
+    try:
+        future = await asyncio.wait_for(start(), REPORT_TIMEOUT)
+        return await asyncio.wait_for(asyncio.shield(future), max(0, deadline - loop.time()))
+    except BaseException:
+        if abandon is not None:
+            state['abandoned'] = True
+            if state['future'] is None or state['future'].done():
+                abandon()
+        raise
+
+
+def discard_report_file(path):
+    """Remove a temp report and the worker's partial file, if they exist."""
+    for leftover in (path, path + '.part'):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
+
+
+# Month-end pre-generation. Shortly after midnight on the 1st, last month's
+# report is built for the users who were active in it, one at a time and
+# REPORT_PREWARM_INTERVAL seconds apart, in a single niced worker process
+# that never takes one of the interactive report_slots. Morning export
+# presses then hit the report cache instead of all building at once.
+def lower_process_priority():
+    # os.nice is POSIX-only; elsewhere, or when not permitted, the worker
+    # simply runs at normal priority rather than failing to start
+    if not hasattr(os, 'nice'):
+        return
+    try:
+        os.nice(REPORT_PREWARM_NICE)
+    except OSError as e:
+        logger.warning("Could not lower the pre-build worker's priority: %s", e)
+
+
+prewarm_executor = ProcessPoolExecutor(
+    max_workers=1,
+    mp_context=multiprocessing.get_context('spawn'),
+    initializer=lower_process_priority
+)
+
+
+def get_month_active_users(year_month, limit):
+    """Users with expenses in the month, busiest first."""
+    return [user_id for user_id, in db.fetchall('''
+        SELECT user_id FROM expense_rollups
+        WHERE month = ?
+        GROUP BY user_id
+        ORDER BY SUM(txn_count) DESC
+        LIMIT ?
+    ''', (year_month, limit))]
+
+
+async def prewarm_month_report(user_id, year_month):
+    """Build and cache the month's report unless a current copy exists; returns True if built."""
+    version = await run_db(get_data_version, user_id, year_month)
+    if await run_db(get_cached_report, user_id, year_month, 'xlsx', version):
+        return False
+
+    report = await generate_professional_excel_report(
+        user_id, year_month, None, executor=prewarm_executor, slots=None
+    )
+    if report is None:
+        return False
+
+    try:
+        await run_db(store_cached_report, user_id, year_month, 'xlsx', version,
+                     report if isinstance(report, str) else report.getvalue(), '.xlsx')
+    except BaseException:
+        if isinstance(report, str):
+            await asyncio.to_thread(discard_report_file, report)
+        raise
+    return True
+
+
+async def prewarm_month_reports(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue callback: pre-build last month's reports for its active users."""
+    year_month = add_months(datetime.now(), -1).strftime('%Y-%m')
+    users = await run_db(get_month_active_users, year_month, REPORT_PREWARM_MAX_USERS)
+    started = time.monotonic()
+    built = 0
+
+    for user_id in users:
+        try:
+            built += await prewarm_month_report(user_id, year_month)
+        except TimeoutError:
+            logger.warning("Pre-building the %s report for user %s timed out", year_month, user_id)
+        except Exception:
+            logger.exception("Pre-building the %s report for user %s failed", year_month, user_id)
+        await asyncio.sleep(REPORT_PREWARM_INTERVAL)
+
+    logger.info("Pre-built %d of %d %s reports in %.0fs",
+                built, len(users), year_month, time.monotonic() - started)
+
+
+def schedule_report_prewarm(application):
+    if application.job_queue is None:
+        logger.warning("JobQueue unavailable (install python-telegram-bot[job-queue]); "
+                       "month-end reports will not be pre-built")
+        return
+
+    # The server's local time, the same clock expenses are recorded in
+    when = REPORT_PREWARM_AT.replace(tzinfo=datetime.now().astimezone().tzinfo)
+    application.job_queue.run_monthly(prewarm_month_reports, when, day=1, name='prewarm_month_reports')
+
+
+# Spending charts: a category pie, the month's daily bars and the last
+# CHART_TREND_MONTHS months, in one PNG. They are cached like reports, under
+# kind 'chart', versioned by every month the trend covers.
+def get_month_chart_data(user_id, year_month, trend_months):
+    """(categories, days, trend) for render_month_chart, all read from the rollups."""
+    categories = [(category, total) for category, total, _ in get_month_category_totals(user_id, year_month)]
+
+    start, end = month_range(year_month)
+    days = [(from_timestamp(day * 86400).day, total) for day, total in db.fetchall('''
+        SELECT day, total FROM expense_daily_rollups
+        WHERE user_id = ? AND day >= ? AND day < ?
+        ORDER BY day
+    ''', (user_id, start // 86400, end // 86400))]
+
+    totals = dict(db.fetchall('''
+        SELECT month, SUM(total) FROM expense_rollups
+        WHERE user_id = ? AND month >= ? AND month <= ?
+        GROUP BY month
+    ''', (user_id, trend_months[0], trend_months[-1])))
+    trend = [(month, totals.get(month, 0)) for month in trend_months]
+
+    return categories, days, trend
+
+
+def chart_label(text):
+    """Drop emoji from a label; the headless backend's fonts have no glyphs for them."""
+    return re.sub(r'[^\w\s&/.,()-]', '', text).strip() or text
+
+
+def render_month_chart(title, categories, days, trend):
+    """Render the month's charts as PNG bytes; runs in report_executor."""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 8), dpi=110)
+    grid = figure.add_gridspec(2, 2)
+
+    shown, rest = categories[:CHART_PIE_SLICES], categories[CHART_PIE_SLICES:]
+    labels = [chart_label(category) for category, _ in shown]
+    values = [total for _, total in shown]
+    if rest:
+        labels.append('Other')
+        values.append(sum(total for _, total in rest))
+    pie = figure.add_subplot(grid[0, 0])
+    pie.pie(values, labels=labels, autopct='%1.0f%%', startangle=90, counterclock=False)
+    pie.set_title('By category')
+
+    months = figure.add_subplot(grid[0, 1])
+    months.plot([datetime.strptime(month, '%Y-%m').strftime('%b') for month, _ in trend],
+                [total for _, total in trend], marker='o')
+    months.set_title(f'Last {len(trend)} months')
+    months.set_ylim(bottom=0)
+    months.grid(alpha=0.3)
+
+    daily = figure.add_subplot(grid[1, :])
+    daily.bar([day for day, _ in days], [total for _, total in days])
+    daily.set_title('Daily spending')
+    daily.set_xlabel('Day of month')
+    daily.grid(axis='y', alpha=0.3)
+
+    figure.suptitle(title, fontsize=14)
+    figure.tight_layout()
+
+    buffer = BytesIO()
+    figure.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+async def send_month_chart(bot, chat_id, user_id, year_month):
+    """Send the month's chart as a photo, re-using a cached copy when it is current.
+
+    Runs as a background task after a report message, so failures are
+    logged rather than raised.
+    """
+    if not CHARTS_AVAILABLE:
+        return
+
+    try:
+        month_start = datetime.strptime(year_month, '%Y-%m')
+        trend_months = [add_months(month_start, -back).strftime('%Y-%m')
+                        for back in range(CHART_TREND_MONTHS - 1, -1, -1)]
+        caption = f"📊 {month_start:%B %Y} at a glance"
+
+        version = await run_db(get_range_data_version, user_id, trend_months)
+        cached = await run_db(get_cached_report, user_id, year_month, 'chart', version)
+
+        if cached and cached[1]:
+            try:
+                await bot.send_photo(chat_id=chat_id, photo=cached[1], caption=caption)
+                return
+            except BadRequest as e:
+                logger.warning("Cached chart file_id for user %s, %s was rejected: %s", user_id, year_month, e)
+                await run_db(clear_cached_report_file_id, user_id, year_month, 'chart')
+
+        photo = None
+        if cached and cached[0]:
+            try:
+                photo = await asyncio.to_thread(read_cached_report, cached[0])
+            except FileNotFoundError:
+                photo = None
+
+        if photo is None:
+            categories, days, trend = await run_db(get_month_chart_data, user_id, year_month, trend_months)
+            if not categories:
+                return
+
+            png = await run_report_build(render_month_chart, f'{month_start:%B %Y}', categories, days, trend)
+            await run_db(store_cached_report, user_id, year_month, 'chart', version, png, '.png')
+            photo = BytesIO(png)
+
+        sent = await bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+        await run_db(set_cached_report_file_id, user_id, year_month, 'chart', version, sent.photo[-1].file_id)
+    except Exception:
+        logger.exception("Sending the %s chart to user %s failed", year_month, user_id)
+
+
+# Report cells are written as real numbers, dates and times. Styles are
+# applied through openpyxl's public cell API: the formats below are set as
+# number formats, which is much cheaper per cell than assigning a named
+# style, and the bold header is a named style registered once per workbook.
+REPORT_STYLES = {
+    'rupee': '"₹"#,##0.00',
+    'percent': '0.00%',
+    'date': 'dd/mm/yyyy',
+    'time': 'hh:mm',
+    'month': 'mmm yyyy',
+}
+
+REPORT_COLUMN_STYLES = {
+    'Total Amount': 'rupee', 'Avg Amount': 'rupee', 'Max': 'rupee', 'Min': 'rupee',
+    'Total Spent': 'rupee', 'Total': 'rupee', 'amount': 'rupee',
+    'Percentage': 'percent', 'Date': 'date', 'Time': 'time',
+    'Month': 'month', 'Change': 'rupee', 'Change %': 'percent',
+}
+
+REPORT_SHEET_COLUMNS = {
+    '📁 Categories': ['Category', 'Total Amount', 'Transactions', 'Avg Amount', 'Max', 'Min', 'Percentage'],
+    '📅 Daily': ['Date', 'Weekday', 'Total Spent', 'Transactions'],
+    '💳 Accounts': ['Account', 'Total Spent', 'Transactions', 'Percentage'],
+    '📂 Subcategories': ['Category', 'Subcategory', 'Total', 'Count'],
+    '💰 Top Expenses': ['Date', 'Time', 'category', 'amount', 'description'],
+    '📝 All Transactions': ['Date', 'Time', 'Weekday', 'category', 'subcategory', 'amount', 'description', 'account'],
+    '📆 Monthly': ['Month', 'Total Spent', 'Transactions', 'Change', 'Change %'],
+}
+REPORT_CATEGORY_COLUMNS = ['Date', 'Time', 'amount', 'description', 'subcategory', 'account']
+
+
+def new_report_workbook():
+    workbook = Workbook(write_only=True)
+    workbook.add_named_style(NamedStyle(name='header', font=Font(bold=True)))
+    return workbook
+
+
+def report_cell(sheet, value, style):
+    """value as a cell in a REPORT_STYLES format or named style, or as is when either is None."""
+    if style is None or value is None:
+        return value
+    cell = WriteOnlyCell(sheet, value=value)
+    if style in REPORT_STYLES:
+        cell.number_format = REPORT_STYLES[style]
+    else:
+        cell.style = style
+    return cell
+
+
+def add_report_sheet(workbook, title, columns, style_names=None):
+    """Create a write-only sheet with a bold header row; returns (sheet, column style names).
+
+    Column styles come from REPORT_COLUMN_STYLES unless style_names lists
+    one named style (or None) per column.
+    """
+    sheet = workbook.create_sheet(title)
+    sheet.append([report_cell(sheet, column, 'header') for column in columns])
+    if style_names is None:
+        style_names = [REPORT_COLUMN_STYLES.get(column) for column in columns]
+    return sheet, list(style_names)
+
+
+def append_report_row(sheet, styles, values):
+    sheet.append([report_cell(sheet, value, style) for value, style in zip(values, styles)])
+
+
+def write_report_overview(workbook, count, total_spent, highest, lowest, days, busiest_day, top_category):
+    sheet, _ = add_report_sheet(workbook, '📊 Overview', ['Metric', 'Value'])
+    for metric, value, style in [
+        ('Total Expenses', total_spent, 'rupee'),
+        ('Number of Transactions', count, None),
+        ('Average Transaction', total_spent / count, 'rupee'),
+        ('Highest Expense', highest, 'rupee'),
+        ('Lowest Expense', lowest, 'rupee'),
+        ('Daily Average', total_spent / days, 'rupee'),
+        ('Most Expensive Day', busiest_day, 'date'),
+        ('Most Spent Category', top_category, None),
+    ]:
+        append_report_row(sheet, [None, style], [metric, value])
+
+
+def write_report_trends(workbook, months, month_totals):
+    """Month-over-month sheets for a report spanning several months.
+
+    month_totals are get_range_month_category_totals() rows; months lists
+    every 'YYYY-MM' in the range, so months without expenses show as 0.
+    """
+    monthly = {month: [0.0, 0] for month in months}
+    categories = {}
+    for month, category, total, txn_count in month_totals:
+        monthly[month][0] += total
+        monthly[month][1] += txn_count
+        categories.setdefault(category, dict.fromkeys(months, 0.0))[month] += total
+
+    sheet, styles = add_report_sheet(workbook, '📆 Monthly', REPORT_SHEET_COLUMNS['📆 Monthly'])
+    previous = None
+    for month in months:
+        total, txn_count = monthly[month]
+        change = change_ratio = None
+        if previous is not None:
+            change = round(total - previous, 2)
+            change_ratio = change / previous if previous else None
+        append_report_row(sheet, styles, [
+            datetime.strptime(month, '%Y-%m').date(), round(total, 2), txn_count, change, change_ratio
+        ])
+        previous = total
+
+    month_names = [datetime.strptime(month, '%Y-%m').strftime('%b %Y') for month in months]
+    sheet, styles = add_report_sheet(
+        workbook, '📈 Category Trends', ['Category', *month_names, 'Total'],
+        [None, *['rupee'] * len(months), 'rupee']
+    )
+    for category, totals in sorted(categories.items(), key=lambda item: -sum(item[1].values())):
+        values = [round(totals[month], 2) for month in months]
+        append_report_row(sheet, styles, [category, *values, round(sum(totals.values()), 2)])
+
+
+def aggregate_report(df):
+    """Compute every report sheet from a single grouping pass over the rows.
+
+    df needs the Date, Time and Weekday columns from add_report_columns().
+    The rows are grouped once at (category, subcategory, account, day)
+    grain; the category, daily, account and subcategory sheets and the
+    overview metrics are rolled up from that much smaller frame. Returns
+    (overview, sheets): the write_report_overview() arguments and an ordered
+    {sheet name: DataFrame} dict whose columns match REPORT_SHEET_COLUMNS.
+    """
+    base = df.groupby(
+        ['category', 'subcategory', 'account', 'Date', 'Weekday'], dropna=False
+    )['amount'].agg(['sum', 'count', 'max', 'min']).reset_index()
+
+    by_category = base.groupby('category').agg(
+        total=('sum', 'sum'), count=('count', 'sum'), max=('max', 'max'), min=('min', 'min')
+    )
+    by_day = base.groupby(['Date', 'Weekday']).agg(total=('sum', 'sum'), count=('count', 'sum')).reset_index()
+
+    total_spent = by_category['total'].sum()
+    overview = (
+        len(df), round(total_spent, 2), by_category['max'].max(), by_category['min'].min(),
+        len(by_day), by_day.loc[by_day['total'].idxmax(), 'Date'], by_category['total'].idxmax()
+    )
+    sheets = {}
+
+    category_summary = by_category.reset_index()
+    category_summary['mean'] = category_summary['total'] / category_summary['count']
+    category_summary['share'] = category_summary['total'] / total_spent
+    category_summary = category_summary[['category', 'total', 'count', 'mean', 'max', 'min', 'share']]
+    category_summary.columns = REPORT_SHEET_COLUMNS['📁 Categories']
+    sheets['📁 Categories'] = category_summary.sort_values('Total Amount', ascending=False).round(
+        {'Total Amount': 2, 'Avg Amount': 2}
+    )
+
+    daily_breakdown = by_day.sort_values('Date', ascending=False)
+    daily_breakdown.columns = REPORT_SHEET_COLUMNS['📅 Daily']
+    sheets['📅 Daily'] = daily_breakdown.round({'Total Spent': 2})
+
+    if base['account'].notna().any():
+        account_breakdown = base.groupby('account').agg(total=('sum', 'sum'), count=('count', 'sum')).reset_index()
+        account_breakdown['share'] = account_breakdown['total'] / account_breakdown['total'].sum()
+        account_breakdown.columns = REPORT_SHEET_COLUMNS['💳 Accounts']
+        sheets['💳 Accounts'] = account_breakdown.sort_values('Total Spent', ascending=False).round(
+            {'Total Spent': 2}
+        )
+
+    if base['subcategory'].notna().any():
+        subcat_df = base.groupby(['category', 'subcategory']).agg(
+            total=('sum', 'sum'), count=('count', 'sum')
+        ).reset_index()
+        subcat_df.columns = REPORT_SHEET_COLUMNS['📂 Subcategories']
+        sheets['📂 Subcategories'] = subcat_df.sort_values(['Category', 'Total'], ascending=[True, False]).round(
+            {'Total': 2}
+        )
+
+    sheets['💰 Top Expenses'] = df.nlargest(min(20, len(df)), 'amount')[REPORT_SHEET_COLUMNS['💰 Top Expenses']]
+    sheets['📝 All Transactions'] = df[REPORT_SHEET_COLUMNS['📝 All Transactions']]
+
+    # One groupby hands out every category's rows, instead of a mask per
+    # category; rows keep the newest-first order of df
+    for category, category_df in df.groupby('category', sort=False):
+        sheets[category[:31].replace('/', '-')] = category_df[REPORT_CATEGORY_COLUMNS]
+
+    return overview, sheets
+
+
+def add_report_columns(df):
+    df['amount'] = df['amount'].round(2)
+    when = pd.to_datetime(df['date'])
+    df['Weekday'] = when.dt.strftime('%A')
+    df['Date'] = when.dt.date
+    df['Time'] = when.dt.time
+    return df
+
+
+def build_excel_report(df, year_month):
+    """Write the month's report workbook and return its bytes; runs in report_executor."""
+    overview, sheets = aggregate_report(add_report_columns(df))
+
+    workbook = new_report_workbook()
+    write_report_overview(workbook, *overview)
+
+    for sheet_name, sheet_df in sheets.items():
+        sheet, styles = add_report_sheet(workbook, sheet_name, list(sheet_df.columns))
+        for values in sheet_df.astype(object).where(sheet_df.notna(), None).itertuples(index=False, name=None):
+            append_report_row(sheet, styles, values)
+
+    output = BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def stream_excel_report(user_id, start, end, path):
+    """Write the report for [start, end) straight from SQLite into the xlsx at path.
+
+    The constant-memory counterpart of build_excel_report for big months
+    and for quarter/financial-year ranges; runs in report_executor. Sheet
+    totals come from SQL aggregates and the transaction rows are fetched in
+    REPORT_STREAM_BATCH batches and appended through openpyxl's write-only
+    mode, which spools each sheet to disk, so memory stays flat however many
+    rows the range has. Ranges over several months get the month-over-month
+    sheets too. Returns path.
+    """
+    scope = (user_id, start, end)
+    workbook = new_report_workbook()
+
+    with db.connection() as conn:
+        count, total_spent, highest, lowest = conn.execute('''
+            SELECT COUNT(*), SUM(amount), MAX(amount), MIN(amount)
+            FROM expenses
+            WHERE user_id = ? AND ts >= ? AND ts < ?
+        ''', scope).fetchone()
+
+        categories = conn.execute('''
+            SELECT category, SUM(amount) AS total, COUNT(*), AVG(amount), MAX(amount), MIN(amount)
+            FROM expenses
+            WHERE user_id = ? AND ts >= ? AND ts < ?
+            GROUP BY category
+            ORDER BY total DESC
+        ''', scope).fetchall()
+
+        days = []
+        for day, day_total, day_count in conn.execute('''
+            SELECT ts / 86400 AS day, SUM(amount), COUNT(*)
+            FROM expenses
+            WHERE user_id = ? AND ts >= ? AND ts < ?
+            GROUP BY day
+            ORDER BY day
+        ''', scope):
+            when = from_timestamp(day * 86400)
+            days.append((when.date(), when.strftime('%A'), round(day_total, 2), day_count))
+
+        write_report_overview(
+            workbook, count, round(total_spent, 2), highest, lowest, len(days),
+            max(days, key=lambda row: row[2])[0], categories[0][0]
+        )
+
+        sheet, styles = add_report_sheet(workbook, '📁 Categories', REPORT_SHEET_COLUMNS['📁 Categories'])
+        for category, total, txn_count, average, maximum, minimum in categories:
+            append_report_row(sheet, styles, [
+                category, round(total, 2), txn_count, round(average, 2), maximum, minimum, total / total_spent
+            ])
+
+        sheet, styles = add_report_sheet(workbook, '📅 Daily', REPORT_SHEET_COLUMNS['📅 Daily'])
+        for row in reversed(days):
+            append_report_row(sheet, styles, row)
+
+        # Trends stop at the last day with expenses, so a financial year that
+        # is still running doesn't end in a row of empty future months
+        months = months_between(start, to_timestamp(days[-1][0]) + 86400)
+        if len(months) > 1:
+            write_report_trends(workbook, months, get_range_month_category_totals(user_id, start, end))
+
+        accounts = conn.execute('''
+            SELECT account, SUM(amount) AS total, COUNT(*)
+            FROM expenses
+            WHERE user_id = ? AND ts >= ? AND ts < ? AND account IS NOT NULL
+            GROUP BY account
+            ORDER BY total DESC
+        ''', scope).fetchall()
+
+        if accounts:
+            account_total = sum(row[1] for row in accounts)
+            sheet, styles = add_report_sheet(workbook, '💳 Accounts', REPORT_SHEET_COLUMNS['💳 Accounts'])
+            for account, total, txn_count in accounts:
+                append_report_row(sheet, styles, [account, round(total, 2), txn_count, total / account_total])
+
+        subcategories = conn.execute('''
+            SELECT category, subcategory, SUM(amount) AS total, COUNT(*)
+            FROM expenses
+            WHERE user_id = ? AND ts >= ? AND ts < ? AND subcategory IS NOT NULL
+            GROUP BY category, subcategory
+            ORDER BY category, total DESC
+        ''', scope).fetchall()
+
+        if subcategories:
+            sheet, styles = add_report_sheet(workbook, '📂 Subcategories', REPORT_SHEET_COLUMNS['📂 Subcategories'])
+            for category, subcategory, total, txn_count in subcategories:
+                append_report_row(sheet, styles, [category, subcategory, round(total, 2), txn_count])
+
+        sheet, styles = add_report_sheet(workbook, '💰 Top Expenses', REPORT_SHEET_COLUMNS['💰 Top Expenses'])
+        for ts, category, amount, description in conn.execute('''
+            SELECT ts, category, amount, description
+            FROM expenses
+            WHERE user_id = ? AND ts >= ? AND ts < ?
+            ORDER BY amount DESC
+            LIMIT 20
+        ''', scope):
+            when = from_timestamp(ts)
+            append_report_row(sheet, styles, [when.date(), when.time(), category, round(amount, 2), description])
+
+        # One pass over the rows fills All Transactions and, as each category
+        # first appears, its own sheet
+        all_sheet, all_styles = add_report_sheet(
+            workbook, '📝 All Transactions', REPORT_SHEET_COLUMNS['📝 All Transactions']
+        )
+        category_sheets = {}
+
+        cursor = conn.execute('''
+            SELECT ts, category, subcategory, amount, description, account
+            FROM expenses
+            WHERE user_id = ? AND ts >= ? AND ts < ?
+            ORDER BY ts DESC
+        ''', scope)
+
+        while True:
+            batch = cursor.fetchmany(REPORT_STREAM_BATCH)
+            if not batch:
+                break
+
+            for ts, category, subcategory, amount, description, account in batch:
+                when = from_timestamp(ts)
+                date, time_of_day = when.date(), when.time()
+                amount = round(amount, 2)
+                append_report_row(all_sheet, all_styles, [
+                    date, time_of_day, when.strftime('%A'), category, subcategory, amount, description, account
+                ])
+
+                if category not in category_sheets:
+                    category_sheets[category] = add_report_sheet(
+                        workbook, category[:31].replace('/', '-'), REPORT_CATEGORY_COLUMNS
+                    )
+                sheet, styles = category_sheets[category]
+                append_report_row(sheet, styles, [date, time_of_day, amount, description, subcategory, account])
+
+    # Saved beside path and renamed on success, so a build the bot stopped
+    # waiting for never leaves a half-written report at path
+    partial = path + '.part'
+    try:
+        workbook.save(partial)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return path
+
+
+# Full-history exports: a generator pipeline from one SQLite cursor to a
+# compressed file. Rows move through in EXPORT_BATCH_ROWS batches, so memory
+# stays bounded however long the user's history is.
+EXPORT_COLUMNS = ['date', 'category', 'subcategory', 'amount', 'description', 'account']
+
+
+def iter_expense_batches(user_id, batch_size=EXPORT_BATCH_ROWS):
+    """Yield the user's expenses oldest first, batch_size rows at a time."""
+    with db.connection() as conn:
+        cursor = conn.execute('''
+            SELECT date, category, subcategory, amount, description, account
+            FROM expenses
+            WHERE user_id = ?
+            ORDER BY ts
+        ''', (user_id,))
+
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield batch
+
+
+def write_csv_export(batches, path):
+    rows = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(EXPORT_COLUMNS)
+        for batch in batches:
+            writer.writerows(batch)
+            rows += len(batch)
+    return rows
+
+
+def write_jsonl_export(batches, path):
+    rows = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as handle:
+        for batch in batches:
+            handle.writelines(
+                json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in batch
+            )
+            rows += len(batch)
+    return rows
+
+
+def write_parquet_export(batches, path):
+    """One row group per batch; dates are written as timestamps."""
+    schema = pa.schema([
+        ('date', pa.timestamp('s')), ('category', pa.string()), ('subcategory', pa.string()),
+        ('amount', pa.float64()), ('description', pa.string()), ('account', pa.string())
+    ])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for batch in batches:
+            columns = [list(column) for column in zip(*batch)]
+            columns[0] = [datetime.fromisoformat(value) for value in columns[0]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            rows += len(batch)
+    return rows
+
+
+# format -> (button label, file extension, writer)
+EXPORT_FORMATS = {
+    'csv': ('📄 CSV (gzip)', '.csv.gz', write_csv_export),
+    'jsonl': ('🧾 JSON Lines (gzip)', '.jsonl.gz', write_jsonl_export),
+    'parquet': ('🧱 Parquet', '.parquet', write_parquet_export),
+}
+
+
+def available_export_formats():
+    return [name for name in EXPORT_FORMATS if name != 'parquet' or pq is not None]
+
+
+def write_expense_export(user_id, export_format, path):
+    """Write the user's whole history to path; runs in report_executor. Returns the row count."""
+    return EXPORT_FORMATS[export_format][2](iter_expense_batches(user_id), path)
+
+
+# Import expenses from Excel/CSV
+IMPORT_COLUMN_MAPPING = {
+    'date': ['Date', 'date', 'DATE', 'day', 'Day', 'Transaction Date'],
+    'category': ['Category', 'category', 'CATEGORY', 'type', 'Type'],
+    'subcategory': ['Subcategory', 'subcategory', 'Sub Category', 'SubCategory'],
+    'amount': ['Amount', 'amount', 'AMOUNT', 'INR', 'price', 'Price', 'cost', 'Cost'],
+    'description': ['Note', 'note', 'Description', 'description', 'DESCRIPTION', 'details', 'Details'],
+    'account': ['Account', 'account', 'Payment Method', 'Method']
+}
+
+# Tried in order against a sample of each date column; Money Manager first
+IMPORT_DATE_FORMATS = [
+    '%d/%m/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+    '%d/%m/%Y %H:%M', '%d/%m/%Y %I:%M %p', '%d/%m/%Y', '%d-%m-%Y'
+]
+
+
+def find_import_columns(columns):
+    actual_columns = {}
+    for key, possible_names in IMPORT_COLUMN_MAPPING.items():
+        for col in columns:
+            if col in possible_names:
+                actual_columns[key] = col
+                break
+    return actual_columns
+
+
+def clean_text_column(series, default=None):
+    """Strip a column to strings, mapping blanks and NaN to `default`."""
+    text = series.astype('string').str.strip()
+    text = text.mask(text == '')
+    return text.astype(object).where(text.notna(), default)
+
+
+def parse_import_dates(series, sample_size=50):
+    """Parse a date column in one pass, detecting its format from a sample.
+
+    Values no format matches fall back to pandas' own inference; anything
+    still unparsable comes back as NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    text = series.astype('string').str.strip()
+    sample = text.dropna().head(sample_size)
+
+    parsed = None
+    for fmt in IMPORT_DATE_FORMATS:
+        if pd.to_datetime(sample, format=fmt, errors='coerce').notna().all():
+            parsed = pd.to_datetime(text, format=fmt, errors='coerce')
+            break
+
+    if parsed is None:
+        parsed = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
 
-    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    missing = parsed.isna() & series.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(series[missing], format='mixed', errors='coerce')
 
-    cursor.execute('''
-        SELECT current_balance FROM account_balances
-        WHERE user_id = ? AND account_name = ?
-    ''', (user_id, account_name))
+    return parsed
 
-    existing = cursor.fetchone()
 
-    if existing:
-        if operation == 'set':
-            new_balance = amount
-        elif operation == 'add':
-            new_balance = existing[0] + amount
-        elif operation == 'subtract':
-            new_balance = existing[0] - amount
-        else:
-            new_balance = amount
+def normalize_import_frame(df, actual_columns, user_id, now=None):
+    """Turn an uploaded sheet into expense rows, column by column.
 
-        cursor.execute('''
-            UPDATE account_balances
-            SET current_balance = ?, last_updated = ?
-            WHERE user_id = ? AND account_name = ?
-        ''', (new_balance, current_time, user_id, account_name))
-    else:
-        cursor.execute('''
-            INSERT INTO account_balances (user_id, account_name, initial_balance, current_balance, last_updated)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, account_name, amount, amount, current_time))
+    Returns (rows, failures): rows are insert_expenses() tuples and failures
+    are (row_index, reason) for rows that could not be imported. Rows with a
+    zero or negative amount are skipped without being reported, as before.
+    """
+    now_str = (now or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
 
-    conn.commit()
-    conn.close()
+    if 'Income/Expense' in df.columns:
+        df = df[df['Income/Expense'] == 'Expense']
 
+    amount = pd.to_numeric(df[actual_columns['amount']], errors='coerce')
+    category = clean_text_column(df[actual_columns['category']])
 
-def get_all_account_balances(user_id):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+    bad_amount = amount.isna()
+    bad_category = category.isna() & ~bad_amount
+    valid = ~bad_amount & ~bad_category & (amount > 0)
 
-    cursor.execute('''
-        SELECT account_name, initial_balance, current_balance, last_updated
-        FROM account_balances
-        WHERE user_id = ?
-        ORDER BY account_name
-    ''', (user_id,))
+    failures = [(index, "invalid amount") for index in amount.index[bad_amount]]
+    failures += [(index, "missing category") for index in category.index[bad_category]]
+    failures.sort()
 
-    balances = cursor.fetchall()
-    conn.close()
+    df = df[valid]
+    n = len(df)
 
-    return balances
+    def optional_text(key, default=None):
+        if key in actual_columns:
+            return clean_text_column(df[actual_columns[key]], default).tolist()
+        return [default] * n
 
+    if 'date' in actual_columns:
+        dates = parse_import_dates(df[actual_columns['date']])
+        dates = dates.dt.strftime('%Y-%m-%d %H:%M:%S').where(dates.notna(), now_str).tolist()
+    else:
+        dates = [now_str] * n
+
+    rows = list(zip(
+        [user_id] * n,
+        category[valid].tolist(),
+        optional_text('subcategory'),
+        amount[valid].astype(float).tolist(),
+        optional_text('description', 'Imported from Excel'),
+        optional_text('account'),
+        dates
+    ))
+
+    return rows, failures
+
+
+# Import jobs are persisted in import_jobs and run in the background by
+# import_queue. A CSV import commits each chunk together with the job's
+# progress, so an interrupted import resumes after its last committed chunk,
+# either when the bot restarts or when the same file is uploaded again.
+IMPORT_JOB_COLUMNS = ('id, user_id, chat_id, file_id, file_name, status, '
+                      'rows_read, rows_imported, rows_skipped, rows_failed')
+
+
+def import_job_from_row(row):
+    return dict(zip(IMPORT_JOB_COLUMNS.split(', '), row))
+
+
+def create_import_job(user_id, chat_id, file_id, file_unique_id, file_name):
+    """Queue an import of a file, reusing an unfinished job for the same file.
+
+    Returns (job, created); created is False when that file is already
+    queued or running.
+    """
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    with db.transaction() as conn:
+        row = conn.execute(f'''
+            SELECT {IMPORT_JOB_COLUMNS}
+            FROM import_jobs
+            WHERE user_id = ? AND file_unique_id = ? AND status != 'done'
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (user_id, file_unique_id)).fetchone()
+
+        if row:
+            job = import_job_from_row(row)
+            if job['status'] in ('queued', 'running'):
+                return job, False
+
+            conn.execute('''
+                UPDATE import_jobs
+                SET status = 'queued', chat_id = ?, file_id = ?, error = NULL, updated_at = ?
+                WHERE id = ?
+            ''', (chat_id, file_id, now, job['id']))
+            job.update(status='queued', chat_id=chat_id, file_id=file_id)
+            return job, True
+
+        cursor = conn.execute('''
+            INSERT INTO import_jobs (user_id, chat_id, file_id, file_unique_id, file_name, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)
+        ''', (user_id, chat_id, file_id, file_unique_id, file_name, now, now))
+
+        job = dict(id=cursor.lastrowid, user_id=user_id, chat_id=chat_id, file_id=file_id, file_name=file_name,
+                   status='queued', rows_read=0, rows_imported=0, rows_skipped=0, rows_failed=0)
+        return job, True
+
+
+def get_unfinished_import_jobs():
+    rows = db.fetchall(f'''
+        SELECT {IMPORT_JOB_COLUMNS}
+        FROM import_jobs
+        WHERE status IN ('queued', 'running')
+        ORDER BY id
+    ''')
+    return [import_job_from_row(row) for row in rows]
 
-def get_available_months(user_id):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT DISTINCT strftime('%Y-%m', date) as month
-        FROM expenses
+def get_import_jobs(user_id, limit=5):
+    return db.fetchall('''
+        SELECT id, file_name, status, rows_read, rows_imported, rows_skipped, rows_failed, error
+        FROM import_jobs
         WHERE user_id = ?
-        ORDER BY month DESC
-    ''', (user_id,))
-
-    months = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return months
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (user_id, limit))
 
 
-# Get category and subcategory-wise breakdown
-def get_category_subcategory_breakdown(user_id, year_month):
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+def set_import_job_status(job_id, status, error=None):
+    db.execute(
+        'UPDATE import_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+        (status, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id)
+    )
 
-    cursor.execute('''
-        SELECT category, subcategory, SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        GROUP BY category, subcategory
-        ORDER BY category, SUM(amount) DESC
-    ''', (user_id, f'{year_month}%'))
 
-    results = cursor.fetchall()
-    conn.close()
+def commit_import_chunk(job_id, rows, rows_read, rows_failed, occurrences=None):
+    """Insert a chunk's new rows and record the job's progress; returns (inserted, skipped)."""
+    with db.transaction() as conn:
+        inserted, skipped = insert_expenses(rows, occurrences)
+        conn.execute('''
+            UPDATE import_jobs
+            SET rows_read = rows_read + ?, rows_imported = rows_imported + ?,
+                rows_skipped = rows_skipped + ?, rows_failed = rows_failed + ?, updated_at = ?
+            WHERE id = ?
+        ''', (rows_read, inserted, skipped, rows_failed, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id))
+    return inserted, skipped
+
+
+# Parsing is CPU-bound, so it runs in worker processes instead of on the
+# event loop; 'spawn' keeps the children from inheriting the bot's threads.
+import_executor = ProcessPoolExecutor(
+    max_workers=IMPORT_WORKERS,
+    mp_context=multiprocessing.get_context('spawn')
+)
 
-    # Organize by category
-    breakdown = {}
-    for cat, subcat, amount, count in results:
-        if cat not in breakdown:
-            breakdown[cat] = {'total': 0, 'subcategories': []}
-        breakdown[cat]['total'] += amount
-        breakdown[cat]['subcategories'].append({
-            'name': subcat or 'No subcategory',
-            'amount': amount,
-            'count': count
-        })
 
-    return breakdown
+async def run_in_import_process(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(import_executor, func, *args)
 
 
-# Generate professional Excel report
-async def generate_professional_excel_report(user_id, year_month, context):
-    conn = sqlite3.connect('expenses.db')
+def parse_excel_import(source, user_id):
+    """Read and normalize a whole Excel file; runs in import_executor.
 
-    query = '''
-        SELECT date, category, subcategory, amount, description, account
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        ORDER BY date DESC
-    '''
+    source is a file path or the file's bytes. Returns (rows_read, rows,
+    failures), or None when the file lacks the required columns.
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
 
-    df = pd.read_sql_query(query, conn, params=(user_id, f'{year_month}%'))
-    conn.close()
+    df = pd.read_excel(source)
+    actual_columns = find_import_columns(df.columns)
 
-    if df.empty:
+    if 'category' not in actual_columns or 'amount' not in actual_columns:
         return None
 
-    df['date'] = pd.to_datetime(df['date'])
-    df['Day'] = df['date'].dt.strftime('%d')
-    df['Weekday'] = df['date'].dt.strftime('%A')
-    df['Date'] = df['date'].dt.strftime('%d/%m/%Y')
-    df['Time'] = df['date'].dt.strftime('%H:%M')
+    rows, failures = normalize_import_frame(df, actual_columns, user_id)
+    return len(df), rows, failures
 
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-
-        month_name = datetime.strptime(year_month, '%Y-%m').strftime('%B %Y')
-        overview_data = {
-            'Metric': [
-                'Total Expenses',
-                'Number of Transactions',
-                'Average Transaction',
-                'Highest Expense',
-                'Lowest Expense',
-                'Daily Average',
-                'Most Expensive Day',
-                'Most Spent Category'
-            ],
-            'Value': [
-                f"₹{df['amount'].sum():.2f}",
-                len(df),
-                f"₹{df['amount'].mean():.2f}",
-                f"₹{df['amount'].max():.2f}",
-                f"₹{df['amount'].min():.2f}",
-                f"₹{df['amount'].sum() / df['Day'].nunique():.2f}",
-                df.groupby('Date')['amount'].sum().idxmax(),
-                df.groupby('category')['amount'].sum().idxmax()
-            ]
-        }
-        overview_df = pd.DataFrame(overview_data)
-        overview_df.to_excel(writer, sheet_name='📊 Overview', index=False)
-
-        category_summary = df.groupby('category').agg({
-            'amount': ['sum', 'count', 'mean', 'max', 'min']
-        }).reset_index()
-        category_summary.columns = ['Category', 'Total Amount', 'Transactions', 'Avg Amount', 'Max', 'Min']
-        category_summary = category_summary.sort_values('Total Amount', ascending=False)
-        total_spent = category_summary['Total Amount'].sum()
-        category_summary['Percentage'] = (category_summary['Total Amount'] / total_spent * 100).round(2)
-        category_summary['Percentage'] = category_summary['Percentage'].astype(str) + '%'
-        category_summary['Total Amount'] = '₹' + category_summary['Total Amount'].round(2).astype(str)
-        category_summary['Avg Amount'] = '₹' + category_summary['Avg Amount'].round(2).astype(str)
-        category_summary['Max'] = '₹' + category_summary['Max'].round(2).astype(str)
-        category_summary['Min'] = '₹' + category_summary['Min'].round(2).astype(str)
-        category_summary.to_excel(writer, sheet_name='📁 Categories', index=False)
-
-        daily_breakdown = df.groupby(['Date', 'Weekday']).agg({
-            'amount': ['sum', 'count']
-        }).reset_index()
-        daily_breakdown.columns = ['Date', 'Weekday', 'Total Spent', 'Transactions']
-        daily_breakdown = daily_breakdown.sort_values('Date', ascending=False)
-        daily_breakdown['Total Spent'] = '₹' + daily_breakdown['Total Spent'].round(2).astype(str)
-        daily_breakdown.to_excel(writer, sheet_name='📅 Daily', index=False)
-
-        if df['account'].notna().any():
-            account_breakdown = df.groupby('account').agg({
-                'amount': ['sum', 'count']
-            }).reset_index()
-            account_breakdown.columns = ['Account', 'Total Spent', 'Transactions']
-            account_breakdown = account_breakdown.sort_values('Total Spent', ascending=False)
-            account_total = account_breakdown['Total Spent'].sum()
-            account_breakdown['Percentage'] = (account_breakdown['Total Spent'] / account_total * 100).round(2)
-            account_breakdown['Total Spent'] = '₹' + account_breakdown['Total Spent'].round(2).astype(str)
-            account_breakdown['Percentage'] = account_breakdown['Percentage'].astype(str) + '%'
-            account_breakdown.to_excel(writer, sheet_name='💳 Accounts', index=False)
-
-        if df['subcategory'].notna().any():
-            subcat_df = df[df['subcategory'].notna()].groupby(['category', 'subcategory']).agg({
-                'amount': ['sum', 'count']
-            }).reset_index()
-            subcat_df.columns = ['Category', 'Subcategory', 'Total', 'Count']
-            subcat_df = subcat_df.sort_values(['Category', 'Total'], ascending=[True, False])
-            subcat_df['Total'] = '₹' + subcat_df['Total'].round(2).astype(str)
-            subcat_df.to_excel(writer, sheet_name='📂 Subcategories', index=False)
-
-        top_expenses = df.nlargest(min(20, len(df)), 'amount')[
-            ['Date', 'Time', 'category', 'amount', 'description']].copy()
-        top_expenses['amount'] = '₹' + top_expenses['amount'].round(2).astype(str)
-        top_expenses.to_excel(writer, sheet_name='💰 Top Expenses', index=False)
-
-        detailed_df = df[
-            ['Date', 'Time', 'Weekday', 'category', 'subcategory', 'amount', 'description', 'account']].copy()
-        detailed_df['amount'] = '₹' + detailed_df['amount'].round(2).astype(str)
-        detailed_df.to_excel(writer, sheet_name='📝 All Transactions', index=False)
-
-        for category in df['category'].unique():
-            category_df = df[df['category'] == category][
-                ['Date', 'Time', 'amount', 'description', 'subcategory', 'account']].copy()
-            category_df = category_df.sort_values('Date', ascending=False)
-            category_df['amount'] = '₹' + category_df['amount'].round(2).astype(str)
-            sheet_name = category[:31].replace('/', '-')
-            category_df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    output.seek(0)
-    return output
 
+async def import_excel_file(job, source):
+    """Import an Excel file in one transaction (pandas cannot stream .xls/.xlsx).
 
-# Import expenses from Excel/CSV
-async def handle_excel_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    document = update.message.document
+    Returns (imported, skipped, failed, sample_failures), or None when the
+    file lacks the required columns.
+    """
+    if job['rows_read']:
+        # Committed before an interruption; only the status was not updated
+        return job['rows_imported'], job['rows_skipped'], job['rows_failed'], []
 
-    if not (document.file_name.endswith('.xlsx') or document.file_name.endswith('.xls') or document.file_name.endswith(
-            '.csv')):
-        await update.message.reply_text(
-            "❌ Please upload a valid Excel file (.xlsx, .xls) or CSV file (.csv)"
+    if not isinstance(source, str):
+        source = source.getvalue()
+
+    parsed = await run_in_import_process(parse_excel_import, source, job['user_id'])
+    if parsed is None:
+        return None
+
+    rows_read, rows, failures = parsed
+    imported, skipped = await run_db(commit_import_chunk, job['id'], rows, rows_read, len(failures))
+    return imported, skipped, len(failures), failures[:5]
+
+
+async def stream_csv_import(job, source, progress):
+    """Import a CSV in IMPORT_CHUNK_ROWS chunks, editing the progress message.
+
+    Returns (imported, skipped, failed, sample_failures), or None when the
+    file lacks the required columns.
+    """
+    resumed_from = rows_read = job['rows_read']
+    imported = job['rows_imported']
+    skipped = job['rows_skipped']
+    failed = job['rows_failed']
+
+    occurrences = Counter()
+    actual_columns = None
+    sample_failures = []
+    last_progress = time.monotonic()
+
+    with open(source, 'rb') if isinstance(source, str) else nullcontext(source) as handle:
+        file_size = handle.seek(0, os.SEEK_END) or 1
+        handle.seek(0)
+
+        # The file is read from the start even when resuming: rows_read counts
+        # records, not lines, and the committed rows still have to be replayed
+        # into occurrences so later duplicates of them keep their numbering.
+        reader = pd.read_csv(handle, chunksize=IMPORT_CHUNK_ROWS)
+        position = 0
+        with reader:
+            while True:
+                chunk = await asyncio.to_thread(next, reader, None)
+                if chunk is None:
+                    break
+
+                if actual_columns is None:
+                    actual_columns = find_import_columns(chunk.columns)
+                    if 'category' not in actual_columns or 'amount' not in actual_columns:
+                        return None
+
+                chunk.index += position
+                position += len(chunk)
+
+                committed = min(len(chunk), max(0, resumed_from - (position - len(chunk))))
+                if committed:
+                    rows, _ = await run_in_import_process(
+                        normalize_import_frame, chunk.iloc[:committed], actual_columns, job['user_id']
+                    )
+                    advance_occurrences(rows, occurrences)
+                    chunk = chunk.iloc[committed:]
+                    if chunk.empty:
+                        continue
+
+                rows, failures = await run_in_import_process(
+                    normalize_import_frame, chunk, actual_columns, job['user_id']
+                )
+                chunk_imported, chunk_skipped = await run_db(
+                    commit_import_chunk, job['id'], rows, len(chunk), len(failures), occurrences
+                )
+
+                rows_read += len(chunk)
+                imported += chunk_imported
+                skipped += chunk_skipped
+                failed += len(failures)
+                sample_failures.extend(failures[:5 - len(sample_failures)])
+
+                if time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    percent = min(100, handle.tell() * 100 // file_size)
+                    await progress.edit_text(
+                        f"📊 Processing {job['file_name']} (import #{job['id']})... {percent}%\n"
+                        f"Rows read: {rows_read:,} | Imported: {imported:,} | Skipped: {skipped:,}"
+                    )
+
+    return imported, skipped, failed, sample_failures
+
+
+@asynccontextmanager
+async def download_import_file(bot, job):
+    """Download an upload into memory, spilling to a unique temp file when large.
+
+    Yields a BytesIO for files up to IMPORT_SPILL_BYTES and a temp file path
+    above that; either way nothing is left behind afterwards.
+    """
+    file = await bot.get_file(job['file_id'])
+
+    if file.file_size and file.file_size > IMPORT_SPILL_BYTES:
+        fd, path = tempfile.mkstemp(
+            prefix=f"import_{job['user_id']}_{job['id']}_",
+            suffix=os.path.splitext(job['file_name'])[1]
         )
-        return
+        os.close(fd)
+        try:
+            await file.download_to_drive(path)
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+    else:
+        buffer = BytesIO()
+        await file.download_to_memory(buffer)
+        buffer.seek(0)
+        try:
+            yield buffer
+        finally:
+            buffer.close()
 
-    await update.message.reply_text("📥 Downloading your file...")
 
-    file = await context.bot.get_file(document.file_id)
-    file_path = f"temp_{user_id}_{document.file_name}"
-    await file.download_to_drive(file_path)
+async def run_import_job(bot, job):
+    chat_id = job['chat_id']
 
+    # Everything after the status change is inside the try, so a job whose
+    # first message fails (bot blocked, network error) ends up 'failed'
+    # instead of staying 'running' forever
     try:
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
-
-        await update.message.reply_text("📊 Processing your expenses...")
-
-        column_mapping = {
-            'date': ['Date', 'date', 'DATE', 'day', 'Day', 'Transaction Date'],
-            'category': ['Category', 'category', 'CATEGORY', 'type', 'Type'],
-            'subcategory': ['Subcategory', 'subcategory', 'Sub Category', 'SubCategory'],
-            'amount': ['Amount', 'amount', 'AMOUNT', 'INR', 'price', 'Price', 'cost', 'Cost'],
-            'description': ['Note', 'note', 'Description', 'description', 'DESCRIPTION', 'details', 'Details'],
-            'account': ['Account', 'account', 'Payment Method', 'Method']
-        }
-
-        actual_columns = {}
-        for key, possible_names in column_mapping.items():
-            for col in df.columns:
-                if col in possible_names:
-                    actual_columns[key] = col
-                    break
+        await run_db(set_import_job_status, job['id'], 'running')
 
-        if 'category' not in actual_columns or 'amount' not in actual_columns:
-            await update.message.reply_text(
+        if job['rows_read']:
+            text = f"↩️ Resuming import #{job['id']} after row {job['rows_read']:,}..."
+        else:
+            text = f"📊 Processing {job['file_name']} (import #{job['id']})..."
+        progress = await bot.send_message(chat_id, text)
+
+        async with download_import_file(bot, job) as source:
+            if job['file_name'].endswith('.csv'):
+                outcome = await stream_csv_import(job, source, progress)
+            else:
+                outcome = await import_excel_file(job, source)
+
+        if outcome is None:
+            await run_db(set_import_job_status, job['id'], 'failed', 'missing Category/Amount columns')
+            await bot.send_message(
+                chat_id,
                 "❌ File must have at least 'Category' and 'Amount' columns.\n\n"
                 "Supported formats:\n"
                 "✅ Money Manager exports\n"
                 "✅ Generic Excel: Date, Category, Amount, Description"
             )
-            os.remove(file_path)
             return
 
-        if 'Income/Expense' in df.columns:
-            df = df[df['Income/Expense'] == 'Expense']
+        imported_count, skipped_count, failed_count, failures = outcome
+        await run_db(set_import_job_status, job['id'], 'done')
 
-        conn = sqlite3.connect('expenses.db')
-        cursor = conn.cursor()
+        message = f"✅ *Import Successful!*\n\n" \
+                  f"📊 Imported: *{imported_count}* expenses\n"
 
-        imported_count = 0
-        failed_count = 0
+        if skipped_count > 0:
+            message += f"⏭️ Skipped: {skipped_count} already imported\n"
 
-        for index, row in df.iterrows():
-            try:
-                category = str(row[actual_columns['category']]).strip()
-                amount = float(row[actual_columns['amount']])
+        if job['rows_read']:
+            message += f"↩️ Resumed after row {job['rows_read']:,}\n"
 
-                if amount <= 0:
-                    continue
+        if failed_count > 0:
+            message += f"⚠️ Failed: {failed_count} rows\n"
+            for index, reason in failures[:5]:
+                message += f"   • Row {index + 2}: {reason}\n"
+            if failed_count > 5:
+                message += f"   • ...and {failed_count - 5} more\n"
 
-                subcategory = None
-                if 'subcategory' in actual_columns:
-                    subcat_value = row[actual_columns['subcategory']]
-                    if pd.notna(subcat_value) and str(subcat_value).strip():
-                        subcategory = str(subcat_value).strip()
-
-                if 'date' in actual_columns:
-                    try:
-                        date_value = row[actual_columns['date']]
-                        if isinstance(date_value, str):
-                            expense_date = pd.to_datetime(date_value, format='%d/%m/%Y %H:%M:%S', errors='coerce')
-                            if pd.isna(expense_date):
-                                expense_date = pd.to_datetime(date_value, errors='coerce')
-                        else:
-                            expense_date = pd.to_datetime(date_value)
-
-                        if pd.notna(expense_date):
-                            expense_date = expense_date.strftime('%Y-%m-%d %H:%M:%S')
-                        else:
-                            expense_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    except:
-                        expense_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                else:
-                    expense_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data='menu')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        await bot.send_message(chat_id, message, reply_markup=reply_markup, parse_mode='Markdown')
+
+    except Exception as e:
+        logger.exception("Import job %d failed", job['id'])
+        await run_db(set_import_job_status, job['id'], 'failed', str(e))
+        try:
+            await bot.send_message(
+                chat_id,
+                f"❌ Error processing file: {str(e)}\n\n"
+                "Supported formats:\n"
+                "✅ Money Manager exports (.xls, .xlsx)\n"
+                "✅ Generic Excel with Date, Category, Amount columns"
+            )
+        except Exception:
+            logger.warning("Could not tell chat %s that import job %d failed", chat_id, job['id'])
+
+
+class ImportQueue:
+    """Runs import jobs in the background on a bounded number of workers.
+
+    Waiting jobs are kept per user and dispatched round-robin, with at most
+    one running job per user, so one user's uploads cannot hold every worker.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.bot = None
+        self.pending = OrderedDict()
+        self.running = {}
+        self.job_ids = set()
+        self.tasks = set()
+
+    async def start(self, bot):
+        """Attach the bot and requeue jobs left unfinished by the last run."""
+        self.bot = bot
+        for job in await run_db(get_unfinished_import_jobs):
+            self.submit(job)
+        self._dispatch()
+
+    def submit(self, job):
+        if job['id'] in self.job_ids:
+            return
+        self.job_ids.add(job['id'])
+        self.pending.setdefault(job['user_id'], deque()).append(job)
+        self._dispatch()
 
-                description = 'Imported from Excel'
-                if 'description' in actual_columns:
-                    desc_value = row[actual_columns['description']]
-                    if pd.notna(desc_value) and str(desc_value).strip():
-                        description = str(desc_value).strip()
+    def jobs_ahead(self, job_id):
+        """Number of waiting jobs submitted before job_id."""
+        return sum(1 for jobs in self.pending.values() for job in jobs if job['id'] < job_id)
 
-                account = None
-                if 'account' in actual_columns:
-                    acc_value = row[actual_columns['account']]
-                    if pd.notna(acc_value) and str(acc_value).strip():
-                        account = str(acc_value).strip()
+    def _dispatch(self):
+        if self.bot is None:
+            return
 
-                cursor.execute('''
-                    INSERT INTO expenses (user_id, category, subcategory, amount, description, account, date)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, category, subcategory, amount, description, account, expense_date))
+        for user_id in list(self.pending):
+            if len(self.running) >= self.workers:
+                break
+            if user_id in self.running:
+                continue
+
+            jobs = self.pending[user_id]
+            job = jobs.popleft()
+            if jobs:
+                self.pending.move_to_end(user_id)
+            else:
+                del self.pending[user_id]
+
+            self.running[user_id] = job['id']
+            task = asyncio.create_task(self._run(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, job):
+        try:
+            await run_import_job(self.bot, job)
+        except Exception:
+            logger.exception("Import job %d crashed", job['id'])
+        finally:
+            del self.running[job['user_id']]
+            self.job_ids.discard(job['id'])
+            self._dispatch()
 
-                imported_count += 1
 
-            except Exception as e:
-                failed_count += 1
-                print(f"Error importing row {index}: {e}")
+import_queue = ImportQueue(IMPORT_WORKERS)
 
-        conn.commit()
-        conn.close()
 
-        os.remove(file_path)
+async def start_import_queue(application):
+    await import_queue.start(application.bot)
 
-        message = f"✅ *Import Successful!*\n\n" \
-                  f"📊 Imported: *{imported_count}* expenses\n"
 
-        if failed_count > 0:
-            message += f"⚠️ Failed: {failed_count} rows\n"
+async def post_init(application):
+    await start_import_queue(application)
+    schedule_report_prewarm(application)
 
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data='menu')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
 
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+async def handle_excel_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    document = update.message.document
 
-    except Exception as e:
+    if not (document.file_name.endswith('.xlsx') or document.file_name.endswith('.xls') or document.file_name.endswith(
+            '.csv')):
         await update.message.reply_text(
-            f"❌ Error processing file: {str(e)}\n\n"
-            "Supported formats:\n"
-            "✅ Money Manager exports (.xls, .xlsx)\n"
-            "✅ Generic Excel with Date, Category, Amount columns"
+            "❌ Please upload a valid Excel file (.xlsx, .xls) or CSV file (.csv)"
+        )
+        return
+
+    job, created = await run_db(
+        create_import_job, user_id, update.effective_chat.id,
+        document.file_id, document.file_unique_id, document.file_name
+    )
+
+    if not created:
+        await update.message.reply_text(
+            f"⏳ This file is already being imported as #{job['id']}.\n"
+            "Use /jobs to check its progress."
         )
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        return
+
+    import_queue.submit(job)
+    ahead = import_queue.jobs_ahead(job['id'])
+
+    message = f"📥 Import #{job['id']} queued"
+    if ahead:
+        message += f" behind {ahead} other job(s)"
+    message += ".\nI'll message you when it's done. Use /jobs to check progress."
+
+    await update.message.reply_text(message)
+
+
+async def show_import_jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    jobs = await run_db(get_import_jobs, user_id)
+
+    if not jobs:
+        await update.message.reply_text("📭 No imports yet. Send an Excel or CSV file to start one.")
+        return
+
+    status_icons = {'queued': '⏳', 'running': '🔄', 'done': '✅', 'failed': '❌'}
+
+    # Plain text: file names often contain Markdown characters
+    message = "📥 Your Recent Imports\n\n"
+    for job_id, file_name, status, rows_read, rows_imported, rows_skipped, rows_failed, error in jobs:
+        message += f"{status_icons.get(status, '•')} #{job_id} {file_name} - {status}"
+        if status == 'queued':
+            message += f" ({import_queue.jobs_ahead(job_id)} ahead)"
+        message += (f"\n   Rows read: {rows_read:,} | Imported: {rows_imported:,} | "
+                    f"Skipped: {rows_skipped:,} | Failed: {rows_failed:,}\n")
+        if error:
+            message += f"   Error: {error}\n"
+        message += "\n"
+
+    await update.message.reply_text(message)
 
 
 # Command handlers
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    add_default_categories(user_id)
+    await run_db(add_default_categories, user_id)
 
     keyboard = [
         [InlineKeyboardButton("➕ Add Expense", callback_data='add_expense')],
@@ -637,7 +3272,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "💳 Account balance tracking\n"
         "💡 Smart description suggestions\n"
         "📅 Custom date selection\n"
-        "🎯 Custom subcategory & accounts\n\n"
+        "🎯 Custom subcategory & accounts\n"
+        "⚡ Quick add: just send `250 food lunch upi`\n\n"
         "Choose an option below:",
         reply_markup=reply_markup,
         parse_mode='Markdown'
@@ -674,7 +3310,7 @@ async def category_breakdown_menu(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
 
     user_id = update.effective_user.id
-    months = get_available_months(user_id)
+    months = await run_db(get_available_months, user_id)
 
     if not months:
         await query.edit_message_text(
@@ -710,7 +3346,7 @@ async def view_category_breakdown(update: Update, context: ContextTypes.DEFAULT_
 
     month_name = datetime.strptime(month, '%Y-%m').strftime('%B %Y')
 
-    breakdown = get_category_subcategory_breakdown(user_id, month)
+    breakdown = await run_db(get_category_subcategory_breakdown, user_id, month)
 
     if not breakdown:
         message = f"📈 *{month_name} - Complete Breakdown*\n\nNo expenses recorded."
@@ -769,6 +3405,9 @@ async def view_category_breakdown(update: Update, context: ContextTypes.DEFAULT_
         parse_mode='Markdown'
     )
 
+    if breakdown:
+        context.application.create_task(send_month_chart(context.bot, query.message.chat_id, user_id, month))
+
 
 async def show_category_detail_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -783,19 +3422,7 @@ async def show_category_detail_menu(update: Update, context: ContextTypes.DEFAUL
     month_name = datetime.strptime(month, '%Y-%m').strftime('%B %Y')
 
     # Get all categories for this month
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT category, SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        GROUP BY category
-        ORDER BY SUM(amount) DESC
-    ''', (user_id, f'{month}%'))
-
-    categories = cursor.fetchall()
-    conn.close()
+    categories = await run_db(get_month_category_totals, user_id, month)
 
     if not categories:
         await query.edit_message_text(
@@ -835,84 +3462,24 @@ async def view_category_detail_transactions(update: Update, context: ContextType
 
     month_name = datetime.strptime(month, '%Y-%m').strftime('%B %Y')
 
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT date, subcategory, amount, description, account
-        FROM expenses
-        WHERE user_id = ? AND category = ? AND date LIKE ?
-        ORDER BY date DESC
-    ''', (user_id, category, f'{month}%'))
-
-    transactions = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND category = ? AND date LIKE ?
-    ''', (user_id, category, f'{month}%'))
-
-    total, count = cursor.fetchone()
-    conn.close()
-
-    if not transactions:
-        message = f"📋 *{category}*\n{month_name}\n\nNo transactions found."
-    else:
-        message = f"📋 *{category}*\n" \
-                  f"📆 {month_name}\n\n" \
-                  f"💰 Total: ₹{total:.2f} | 🔢 Count: {count}\n\n" \
-                  f"━━━━━━━━━━━━━━━━━\n\n"
-
-        current_date = None
-        for txn in transactions:
-            txn_date = datetime.strptime(txn[0], '%Y-%m-%d %H:%M:%S')
-            date_str = txn_date.strftime('%d %b')
-            time_str = txn_date.strftime('%I:%M %p')
-
-            # Group by date
-            if date_str != current_date:
-                if current_date is not None:
-                    message += "\n"
-                message += f"📅 *{date_str}*\n"
-                current_date = date_str
-
-            subcategory = txn[1]
-            amount = txn[2]
-            description = txn[3]
-            account = txn[4]
-
-            # Format each transaction
-            subcat_text = f" • {subcategory}" if subcategory else ""
-            account_text = f" ({account})" if account else ""
-
-            message += f"  🕐 {time_str} - ₹{amount:.2f}{subcat_text}{account_text}\n"
-
-            if description and description != 'No description':
-                desc_short = description[:40] + "..." if len(description) > 40 else description
-                message += f"     📝 {desc_short}\n"
-
-    keyboard = [
-        [InlineKeyboardButton("🔙 Back to Categories", callback_data=f'catdetail_{month}')],
-        [InlineKeyboardButton("📊 Back to Breakdown", callback_data=f'breakdown_{month}')],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
+    context.user_data['txn_session'] = new_txn_session(
+        'catdetail', user_id, *month_range(month), page_size=40, category=category,
+        title=f"📋 *{category}*\n📆 {month_name}",
+        empty_text="No transactions found.",
+        back_rows=[
+            [("🔙 Back to Categories", f'catdetail_{month}')],
+            [("📊 Back to Breakdown", f'breakdown_{month}')]
+        ]
     )
 
+    await show_txn_page(update, context)
+
 
 # View transactions menu
 async def view_transactions_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    context.user_data['txn_page'] = 0
-
     keyboard = [
         [InlineKeyboardButton("📅 Today's Expenses", callback_data='view_today')],
         [InlineKeyboardButton("🗓️ Last 7 Days", callback_data='view_week')],
@@ -930,181 +3497,67 @@ async def view_transactions_menu(update: Update, context: ContextTypes.DEFAULT_T
     )
 
 
-# View today's transactions
-async def view_today_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
-    user_id = update.effective_user.id
-    today = datetime.now().strftime('%Y-%m-%d')
-
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT date, category, subcategory, amount, description, account
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        ORDER BY date DESC
-        LIMIT 20
-    ''', (user_id, f'{today}%'))
-
-    transactions = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-    ''', (user_id, f'{today}%'))
-
-    total, count = cursor.fetchone()
-    conn.close()
-
-    if not transactions:
-        message = "📅 *Today's Expenses*\n\nNo expenses recorded today."
-    else:
-        message = f"📅 *Today's Expenses*\n\n" \
-                  f"💰 Total: ₹{total:.2f} | 🔢 Count: {count}\n\n"
-
-        for txn in transactions:
-            date_str = datetime.strptime(txn[0], '%Y-%m-%d %H:%M:%S').strftime('%I:%M %p')
-            category = txn[1]
-            subcategory = f" • {txn[2]}" if txn[2] else ""
-            amount = txn[3]
-            description = txn[4]
-            account = f" ({txn[5]})" if txn[5] else ""
-
-            message += f"🕐 *{date_str}* - ₹{amount:.2f}\n"
-            message += f"   {category}{subcategory}{account}\n"
-            message += f"   📝 {description}\n\n"
-
-    keyboard = [
-        [InlineKeyboardButton("🔙 Back", callback_data='view_transactions')],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-
-# View last 7 days
-async def view_week_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
-    user_id = update.effective_user.id
-
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT date, category, subcategory, amount, description, account
-        FROM expenses
-        WHERE user_id = ? AND date >= date('now', '-7 days')
-        ORDER BY date DESC
-        LIMIT 30
-    ''', (user_id,))
-
-    transactions = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND date >= date('now', '-7 days')
-    ''', (user_id,))
-
-    total, count = cursor.fetchone()
-    conn.close()
-
-    if not transactions:
-        message = "🗓️ *Last 7 Days*\n\nNo expenses in the last week."
-    else:
-        message = f"🗓️ *Last 7 Days*\n\n" \
-                  f"💰 Total: ₹{total:.2f} | 🔢 Count: {count}\n\n"
-
-        current_date = None
-        for txn in transactions:
-            txn_date = datetime.strptime(txn[0], '%Y-%m-%d %H:%M:%S')
-            date_str = txn_date.strftime('%d %b')
-            time_str = txn_date.strftime('%I:%M %p')
-
-            if date_str != current_date:
-                if current_date is not None:
-                    message += "\n"
-                message += f"📅 *{date_str}*\n"
-                current_date = date_str
-
-            category = txn[1]
-            amount = txn[3]
-            description = txn[4][:30] + "..." if len(txn[4]) > 30 else txn[4]
+# Transaction browser: every listing below is a keyset-paginated session kept
+# in user_data['txn_session']. Totals are read once when the session starts
+# and 'cursors' is a stack of the (ts, id) of the last row of each earlier
+# page, so moving to any page costs one index seek.
+def new_txn_session(view, user_id, start, end, page_size, title, empty_text, back_rows, category=None):
+    return {
+        'view': view,
+        'user_id': user_id,
+        'start': start,
+        'end': end,
+        'category': category,
+        'page_size': page_size,
+        'title': title,
+        'empty_text': empty_text,
+        'back_rows': back_rows,
+        'cursors': [],
+        'last_seen': None,
+        'total_count': None,
+        'total_amount': None
+    }
 
-            message += f"  {time_str} - ₹{amount:.2f} - {category}\n"
 
-    keyboard = [
-        [InlineKeyboardButton("🔙 Back", callback_data='view_transactions')],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+def load_txn_page(session):
+    if session['total_count'] is None:
+        session['total_count'], session['total_amount'] = get_range_totals(
+            session['user_id'], session['start'], session['end'], session['category']
+        )
 
-    await query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
+    before = session['cursors'][-1] if session['cursors'] else None
+    rows = get_transactions_page(
+        session['user_id'], session['start'], session['end'],
+        session['page_size'] + 1, before, session['category']
     )
+    return rows[:session['page_size']], len(rows) > session['page_size']
 
 
-# View this month with pagination
-async def view_month_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
-    user_id = update.effective_user.id
-    current_month = datetime.now().strftime('%Y-%m')
-
-    page = context.user_data.get('txn_page', 0)
-    items_per_page = 50
-    offset = page * items_per_page
-
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT COUNT(*), SUM(amount)
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-    ''', (user_id, f'{current_month}%'))
-
-    total_count, total_amount = cursor.fetchone()
-
-    if total_count == 0:
-        await query.edit_message_text(
-            f"📆 *{datetime.now().strftime('%B %Y')}*\n\nNo expenses this month.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='view_transactions')]]),
-            parse_mode='Markdown'
-        )
-        return
+def format_txn_lines(view, transactions):
+    message = ""
 
-    cursor.execute('''
-        SELECT date, category, subcategory, amount, description, account
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        ORDER BY date DESC
-        LIMIT ? OFFSET ?
-    ''', (user_id, f'{current_month}%', items_per_page, offset))
+    if view == 'today':
+        for txn in transactions:
+            date_str = datetime.strptime(txn[0], '%Y-%m-%d %H:%M:%S').strftime('%I:%M %p')
+            subcategory = f" • {txn[2]}" if txn[2] else ""
+            account = f" ({txn[5]})" if txn[5] else ""
 
-    transactions = cursor.fetchall()
-    conn.close()
+            message += f"🕐 *{date_str}* - ₹{txn[3]:.2f}\n"
+            message += f"   {txn[1]}{subcategory}{account}\n"
+            message += f"   📝 {txn[4]}\n\n"
+        return message
 
-    total_pages = (total_count + items_per_page - 1) // items_per_page
+    if view == 'category':
+        for txn in transactions:
+            date_str = datetime.strptime(txn[0], '%Y-%m-%d %H:%M:%S').strftime('%d %b, %I:%M %p')
+            subcategory = f" • {txn[2]}" if txn[2] else ""
 
-    message = f"📆 *{datetime.now().strftime('%B %Y')}*\n\n" \
-              f"💰 Total: ₹{total_amount:.2f} | 🔢 Count: {total_count}\n" \
-              f"📄 Page {page + 1}/{total_pages} (Showing {offset + 1}-{min(offset + len(transactions), total_count)})\n\n"
+            message += f"📅 *{date_str}*\n"
+            message += f"   ₹{txn[3]:.2f}{subcategory}\n"
+            message += f"   📝 {txn[4]}\n\n"
+        return message
 
+    # week, month and catdetail group transactions under a date heading
     current_date = None
     for txn in transactions:
         txn_date = datetime.strptime(txn[0], '%Y-%m-%d %H:%M:%S')
@@ -1117,11 +3570,55 @@ async def view_month_transactions(update: Update, context: ContextTypes.DEFAULT_
             message += f"📅 *{date_str}*\n"
             current_date = date_str
 
-        category = txn[1]
-        amount = txn[3]
-        description = txn[4][:25] + "..." if len(txn[4]) > 25 else txn[4]
+        category, subcategory, amount, description, account = txn[1:6]
+
+        if view == 'week':
+            message += f"  {time_str} - ₹{amount:.2f} - {category}\n"
+        elif view == 'month':
+            description = description[:25] + "..." if len(description) > 25 else description
+            message += f"  {time_str} | ₹{amount:.2f} | {category} | {description}\n"
+        else:
+            subcat_text = f" • {subcategory}" if subcategory else ""
+            account_text = f" ({account})" if account else ""
+            message += f"  🕐 {time_str} - ₹{amount:.2f}{subcat_text}{account_text}\n"
+
+            if description and description != 'No description':
+                desc_short = description[:40] + "..." if len(description) > 40 else description
+                message += f"     📝 {desc_short}\n"
+
+    return message
+
+
+async def show_txn_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    session = context.user_data['txn_session']
+
+    transactions, has_next = await run_db(load_txn_page, session)
+    session['last_seen'] = tuple(transactions[-1][6:8]) if transactions else None
+
+    back_keyboard = [[InlineKeyboardButton(text, callback_data=data) for text, data in row]
+                     for row in session['back_rows']]
+    back_keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data='menu')])
+
+    if not transactions:
+        await query.edit_message_text(
+            f"{session['title']}\n\n{session['empty_text']}",
+            reply_markup=InlineKeyboardMarkup(back_keyboard),
+            parse_mode='Markdown'
+        )
+        return
+
+    page = len(session['cursors'])
+    page_size = session['page_size']
+    total_count = session['total_count']
+    total_pages = max((total_count + page_size - 1) // page_size, page + 1)
+    first = page * page_size + 1
 
-        message += f"  {time_str} | ₹{amount:.2f} | {category} | {description}\n"
+    message = f"{session['title']}\n\n" \
+              f"💰 Total: ₹{session['total_amount'] or 0:.2f} | 🔢 Count: {total_count}\n"
+    if total_pages > 1:
+        message += f"📄 Page {page + 1}/{total_pages} (Showing {first}-{first + len(transactions) - 1})\n"
+    message += "\n" + format_txn_lines(session['view'], transactions)
 
     keyboard = []
     nav_row = []
@@ -1129,44 +3626,101 @@ async def view_month_transactions(update: Update, context: ContextTypes.DEFAULT_
     if page > 0:
         nav_row.append(InlineKeyboardButton("⬅️ Previous", callback_data='txn_prev'))
 
-    if page < total_pages - 1:
+    if has_next:
         nav_row.append(InlineKeyboardButton("Next ➡️", callback_data='txn_next'))
 
     if nav_row:
         keyboard.append(nav_row)
 
-    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data='view_transactions')])
-    keyboard.append([InlineKeyboardButton("🏠 Main Menu", callback_data='menu')])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    keyboard.extend(back_keyboard)
 
     await query.edit_message_text(
         message,
-        reply_markup=reply_markup,
+        reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='Markdown'
     )
 
 
+# View today's transactions
+async def view_today_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    context.user_data['txn_session'] = new_txn_session(
+        'today', user_id, *day_range(today), page_size=20,
+        title="📅 *Today's Expenses*",
+        empty_text="No expenses recorded today.",
+        back_rows=[[("🔙 Back", 'view_transactions')]]
+    )
+
+    await show_txn_page(update, context)
+
+
+# View last 7 days
+async def view_week_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+
+    context.user_data['txn_session'] = new_txn_session(
+        'week', user_id, *last_days_range(7), page_size=30,
+        title="🗓️ *Last 7 Days*",
+        empty_text="No expenses in the last week.",
+        back_rows=[[("🔙 Back", 'view_transactions')]]
+    )
+
+    await show_txn_page(update, context)
+
+
+# View this month with pagination
+async def view_month_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+    current_month = datetime.now().strftime('%Y-%m')
+
+    context.user_data['txn_session'] = new_txn_session(
+        'month', user_id, *month_range(current_month), page_size=50,
+        title=f"📆 *{datetime.now().strftime('%B %Y')}*",
+        empty_text="No expenses this month.",
+        back_rows=[[("🔙 Back", 'view_transactions')]]
+    )
+
+    await show_txn_page(update, context)
+
+
 # Pagination handlers
 async def txn_previous_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    current_page = context.user_data.get('txn_page', 0)
-    if current_page > 0:
-        context.user_data['txn_page'] = current_page - 1
+    session = context.user_data.get('txn_session')
+    if session is None:
+        return await view_transactions_menu(update, context)
 
-    await view_month_transactions(update, context)
+    if session['cursors']:
+        session['cursors'].pop()
+
+    await show_txn_page(update, context)
 
 
 async def txn_next_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    current_page = context.user_data.get('txn_page', 0)
-    context.user_data['txn_page'] = current_page + 1
+    session = context.user_data.get('txn_session')
+    if session is None:
+        return await view_transactions_menu(update, context)
+
+    if session['last_seen'] is not None:
+        session['cursors'].append(session['last_seen'])
 
-    await view_month_transactions(update, context)
+    await show_txn_page(update, context)
 
 
 # Search by category
@@ -1175,7 +3729,7 @@ async def search_by_category(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
 
     user_id = update.effective_user.id
-    categories = get_user_categories(user_id)
+    categories = await run_db(get_user_categories, user_id)
 
     keyboard = []
     for i in range(0, len(categories), 2):
@@ -1203,58 +3757,15 @@ async def view_category_transactions(update: Update, context: ContextTypes.DEFAU
     user_id = update.effective_user.id
     current_month = datetime.now().strftime('%Y-%m')
 
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT date, subcategory, amount, description, account
-        FROM expenses
-        WHERE user_id = ? AND category = ? AND date LIKE ?
-        ORDER BY date DESC
-        LIMIT 30
-    ''', (user_id, category, f'{current_month}%'))
-
-    transactions = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND category = ? AND date LIKE ?
-    ''', (user_id, category, f'{current_month}%'))
-
-    total, count = cursor.fetchone()
-    conn.close()
-
-    if not transactions:
-        message = f"🔍 *{category}*\n\nNo expenses in this category this month."
-    else:
-        message = f"🔍 *{category}*\n" \
-                  f"📆 {datetime.now().strftime('%B %Y')}\n\n" \
-                  f"💰 Total: ₹{total:.2f} | 🔢 Count: {count}\n\n"
-
-        for txn in transactions:
-            txn_date = datetime.strptime(txn[0], '%Y-%m-%d %H:%M:%S')
-            date_str = txn_date.strftime('%d %b, %I:%M %p')
-            subcategory = f" • {txn[1]}" if txn[1] else ""
-            amount = txn[2]
-            description = txn[3]
-
-            message += f"📅 *{date_str}*\n"
-            message += f"   ₹{amount:.2f}{subcategory}\n"
-            message += f"   📝 {description}\n\n"
-
-    keyboard = [
-        [InlineKeyboardButton("🔙 Back to Categories", callback_data='search_category')],
-        [InlineKeyboardButton("🏠 Main Menu", callback_data='menu')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(
-        message,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
+    context.user_data['txn_session'] = new_txn_session(
+        'category', user_id, *month_range(current_month), page_size=30, category=category,
+        title=f"🔍 *{category}*\n📆 {datetime.now().strftime('%B %Y')}",
+        empty_text="No expenses in this category this month.",
+        back_rows=[[("🔙 Back to Categories", 'search_category')]]
     )
 
+    await show_txn_page(update, context)
+
 
 # View top 10 expenses
 async def view_top10_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1264,19 +3775,7 @@ async def view_top10_expenses(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = update.effective_user.id
     current_month = datetime.now().strftime('%Y-%m')
 
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT date, category, subcategory, amount, description
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        ORDER BY amount DESC
-        LIMIT 10
-    ''', (user_id, f'{current_month}%'))
-
-    transactions = cursor.fetchall()
-    conn.close()
+    transactions = await run_db(get_top_expenses, user_id, current_month)
 
     if not transactions:
         message = f"💰 *Top 10 Expenses*\n📆 {datetime.now().strftime('%B %Y')}\n\nNo expenses this month."
@@ -1313,7 +3812,7 @@ async def manage_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     user_id = update.effective_user.id
-    balances = get_all_account_balances(user_id)
+    balances = await run_db(get_all_account_balances, user_id)
 
     if not balances:
         message = "💳 *Account Balance Manager*\n\n" \
@@ -1362,7 +3861,7 @@ async def view_account_details(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
 
     user_id = update.effective_user.id
-    balances = get_all_account_balances(user_id)
+    balances = await run_db(get_all_account_balances, user_id)
 
     if not balances:
         message = "💳 No accounts found.\n\nAdd an account first!"
@@ -1370,28 +3869,7 @@ async def view_account_details(update: Update, context: ContextTypes.DEFAULT_TYP
         message = "💳 *Detailed Account Information*\n\n"
 
         for account, initial, current, updated in balances:
-            conn = sqlite3.connect('expenses.db')
-            cursor = conn.cursor()
-
-            cursor.execute('''
-                SELECT COUNT(*), SUM(amount)
-                FROM expenses
-                WHERE user_id = ? AND account = ?
-            ''', (user_id, account))
-
-            txn_count, total_spent = cursor.fetchone()
-            total_spent = total_spent if total_spent else 0
-
-            cursor.execute('''
-                SELECT date, amount, category
-                FROM expenses
-                WHERE user_id = ? AND account = ?
-                ORDER BY date DESC
-                LIMIT 1
-            ''', (user_id, account))
-
-            last_txn = cursor.fetchone()
-            conn.close()
+            txn_count, total_spent, last_txn = await run_db(get_account_activity, user_id, account)
 
             spent_calc = initial - current
 
@@ -1430,7 +3908,7 @@ async def start_balance_update(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data['balance_operation'] = operation
 
     user_id = update.effective_user.id
-    accounts = get_user_accounts(user_id)
+    accounts = await run_db(get_user_accounts, user_id)
 
     keyboard = []
     for i in range(0, len(accounts), 2):
@@ -1487,7 +3965,7 @@ async def account_for_balance_selected(update: Update, context: ContextTypes.DEF
     context.user_data['selected_account'] = account
 
     user_id = update.effective_user.id
-    balance_info = get_account_balance(user_id, account)
+    balance_info = await run_db(get_account_balance, user_id, account)
     operation = context.user_data['balance_operation']
 
     if balance_info and operation != 'add_account_balance':
@@ -1524,7 +4002,7 @@ async def custom_account_balance_name_entered(update: Update, context: ContextTy
 
     # Check if account already exists
     user_id = update.effective_user.id
-    existing_balance = get_account_balance(user_id, account_name)
+    existing_balance = await run_db(get_account_balance, user_id, account_name)
 
     if existing_balance:
         await update.message.reply_text(
@@ -1557,20 +4035,18 @@ async def balance_amount_entered(update: Update, context: ContextTypes.DEFAULT_T
         operation = context.user_data['balance_operation']
 
         if operation == 'add_account_balance' or operation == 'update_balance':
-            update_account_balance(user_id, account, amount, 'set')
+            await run_db(update_account_balance, user_id, account, amount, 'set')
             message = f"✅ *Balance Set Successfully!*\n\n" \
                       f"Account: {account}\n" \
                       f"Balance: ₹{amount:.2f}"
         elif operation == 'add_money':
-            update_account_balance(user_id, account, amount, 'add')
-            new_balance = get_account_balance(user_id, account)['current']
+            new_balance = await run_db(change_account_balance, user_id, account, amount, 'add')
             message = f"✅ *Money Added!*\n\n" \
                       f"Account: {account}\n" \
                       f"Added: ₹{amount:.2f}\n" \
                       f"New Balance: ₹{new_balance:.2f}"
         else:
-            update_account_balance(user_id, account, amount, 'subtract')
-            new_balance = get_account_balance(user_id, account)['current']
+            new_balance = await run_db(change_account_balance, user_id, account, amount, 'subtract')
             message = f"✅ *Money Deducted!*\n\n" \
                       f"Account: {account}\n" \
                       f"Deducted: ₹{amount:.2f}\n" \
@@ -1602,7 +4078,7 @@ async def show_previous_months(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
 
     user_id = update.effective_user.id
-    months = get_available_months(user_id)
+    months = await run_db(get_available_months, user_id)
 
     if not months:
         await query.edit_message_text(
@@ -1633,34 +4109,7 @@ async def view_month_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     month = query.data.replace('view_month_', '')
 
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT SUM(amount) FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-    ''', (user_id, f'{month}%'))
-
-    total = cursor.fetchone()[0] or 0
-
-    cursor.execute('''
-        SELECT category, SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        GROUP BY category
-        ORDER BY SUM(amount) DESC
-    ''', (user_id, f'{month}%'))
-
-    categories_data = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT COUNT(DISTINCT DATE(date))
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-    ''', (user_id, f'{month}%'))
-
-    days_count = cursor.fetchone()[0] or 1
-    conn.close()
+    total, categories_data, days_count = await run_db(get_month_report, user_id, month)
 
     month_name = datetime.strptime(month, '%Y-%m').strftime('%B %Y')
 
@@ -1698,7 +4147,7 @@ async def export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     user_id = update.effective_user.id
-    months = get_available_months(user_id)
+    months = await run_db(get_available_months, user_id)
 
     if not months:
         await query.edit_message_text(
@@ -1714,11 +4163,14 @@ async def export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton(f"📊 {month_name}", callback_data=f'export_excel_{month}')
         ])
 
+    keyboard.extend(report_range_buttons())
+    keyboard.append([InlineKeyboardButton("📅 Custom range", callback_data='export_custom')])
+    keyboard.append([InlineKeyboardButton("🗄️ Full history (CSV/JSONL/Parquet)", callback_data='export_all')])
     keyboard.append([InlineKeyboardButton("🔙 Back to Menu", callback_data='menu')])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await query.edit_message_text(
-        "📤 *Export Professional Reports*\n\nSelect month:",
+        "📤 *Export Professional Reports*\n\nSelect a month, quarter, financial year or custom range:",
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
@@ -1732,73 +4184,288 @@ async def export_excel_report(update: Update, context: ContextTypes.DEFAULT_TYPE
     month = query.data.replace('export_excel_', '')
     month_name = datetime.strptime(month, '%Y-%m').strftime('%B_%Y')
 
-    excel_file = await generate_professional_excel_report(user_id, month, context)
+    caption = f"📊 *Professional Expense Report - {month_name.replace('_', ' ')}*\n\n" \
+              f"*Report Contains:*\n" \
+              f"📈 Overview with key metrics\n" \
+              f"📁 Category-wise breakdown\n" \
+              f"📅 Daily spending analysis\n" \
+              f"💳 Account-wise summary\n" \
+              f"📂 Subcategory details\n" \
+              f"💰 Top 20 expenses\n" \
+              f"📝 All transactions\n" \
+              f"📊 Individual category sheets"
+
+    # Read the version before the rows, so a write in between only makes
+    # the cached copy look older than it is, never newer
+    version = await run_db(get_data_version, user_id, month)
+    await send_excel_report(
+        context, query.message.chat_id, user_id, month, version,
+        lambda: generate_professional_excel_report(user_id, month, context),
+        f'Expense_Report_{month_name}.xlsx', caption, query.edit_message_text
+    )
+
+
+async def send_excel_report(context, chat_id, user_id, key, version, generate, filename, caption, edit_status):
+    """Send the report cached under key ('YYYY-MM' or a date range), building it if needed.
+
+    A current cached copy is re-sent by file_id or read from disk; otherwise
+    generate() builds it (returning a path, a BytesIO or None when there is
+    no data) and the result is cached. edit_status(text, reply_markup=...)
+    updates the message that shows progress.
+    """
+    back_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='export_menu')]])
+    cached = await run_db(get_cached_report, user_id, key, 'xlsx', version)
+
+    if cached and cached[1]:
+        try:
+            await context.bot.send_document(
+                chat_id=chat_id,
+                document=cached[1],
+                caption=caption,
+                parse_mode='Markdown'
+            )
+            await edit_status("✅ Professional Excel report sent!", reply_markup=back_markup)
+            return
+        except BadRequest as e:
+            logger.warning("Cached report file_id for user %s, %s was rejected: %s", user_id, key, e)
+            await run_db(clear_cached_report_file_id, user_id, key, 'xlsx')
+
+    excel_file = None
+    if cached and cached[0]:
+        try:
+            excel_file = await asyncio.to_thread(read_cached_report, cached[0])
+        except FileNotFoundError:
+            excel_file = None
 
     if excel_file is None:
-        await query.edit_message_text(
-            "❌ No data found for this month.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='export_menu')]])
-        )
-        return
+        await edit_status("⏳ Your report is being prepared...")
+
+        try:
+            excel_file = await generate()
+            if isinstance(excel_file, str):
+                try:
+                    path = await run_db(store_cached_report, user_id, key, 'xlsx', version, excel_file, '.xlsx')
+                except BaseException:
+                    await asyncio.to_thread(discard_report_file, excel_file)
+                    raise
+                excel_file = await asyncio.to_thread(read_cached_report, path)
+            elif excel_file is not None:
+                await run_db(store_cached_report, user_id, key, 'xlsx', version, excel_file.getvalue(), '.xlsx')
+        except TimeoutError:
+            logger.warning("Report for user %s, %s timed out after %.0fs", user_id, key, REPORT_TIMEOUT)
+            await edit_status(
+                "⌛ The report is taking too long to build. Please try again in a few minutes.",
+                reply_markup=back_markup
+            )
+            return
+        except Exception:
+            logger.exception("Building the report for user %s, %s failed", user_id, key)
+            await edit_status(
+                "❌ Something went wrong while building the report. Please try again later.",
+                reply_markup=back_markup
+            )
+            return
+
+        if excel_file is None:
+            await edit_status("❌ No data found for this period.", reply_markup=back_markup)
+            return
 
-    await context.bot.send_document(
-        chat_id=query.message.chat_id,
+    sent = await context.bot.send_document(
+        chat_id=chat_id,
         document=excel_file,
-        filename=f'Expense_Report_{month_name}.xlsx',
-        caption=f"📊 *Professional Expense Report - {month_name.replace('_', ' ')}*\n\n"
-                f"*Report Contains:*\n"
-                f"📈 Overview with key metrics\n"
-                f"📁 Category-wise breakdown\n"
-                f"📅 Daily spending analysis\n"
-                f"💳 Account-wise summary\n"
-                f"📂 Subcategory details\n"
-                f"💰 Top 20 expenses\n"
-                f"📝 All transactions\n"
-                f"📊 Individual category sheets",
+        filename=filename,
+        caption=caption,
         parse_mode='Markdown'
     )
+    await run_db(set_cached_report_file_id, user_id, key, 'xlsx', version, sent.document.file_id)
 
-    await query.edit_message_text(
-        "✅ Professional Excel report sent!",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='export_menu')]])
+    await edit_status("✅ Professional Excel report sent!", reply_markup=back_markup)
+
+
+def report_range_buttons(now=None):
+    """Export buttons for this and last quarter and financial year."""
+    today = now or datetime.now()
+    quarter = financial_quarter_start(today)
+    year = financial_year_start(today)
+    ranges = [
+        ("🗓️ This quarter", quarter, add_months(quarter, 3)),
+        ("🗓️ Last quarter", add_months(quarter, -3), quarter),
+        ("📆 This financial year", year, add_months(year, 12)),
+        ("📆 Last financial year", add_months(year, -12), year),
+    ]
+    return [
+        [InlineKeyboardButton(
+            f"{label} ({describe_report_range(start, end)})",
+            callback_data=f'export_range_{start:%Y%m%d}_{end:%Y%m%d}'
+        )]
+        for label, start, end in ranges
+    ]
+
+
+async def export_range_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer("📊 Generating range report...")
+
+    start, end = (datetime.strptime(day, '%Y%m%d') for day in query.data.split('_')[2:4])
+    await send_range_report(context, query.message.chat_id, update.effective_user.id, start, end,
+                            query.edit_message_text)
+
+
+async def send_range_report(context, chat_id, user_id, start, end, edit_status):
+    """Send the report for the [start, end) dates through the report cache."""
+    name = describe_report_range(start, end)
+    key = f'{start:%Y%m%d}-{end:%Y%m%d}'
+    months = months_between(to_timestamp(start), to_timestamp(end))
+
+    caption = f"📊 *Professional Expense Report - {name}*\n\n" \
+              f"*Report Contains:*\n" \
+              f"📈 Overview with key metrics\n" \
+              f"📁 Category-wise breakdown\n" \
+              f"📅 Daily spending analysis\n"
+    if len(months) > 1:
+        caption += f"📆 Month-over-month comparison\n" \
+                   f"📈 Category trends by month\n"
+    caption += f"💳 Account-wise summary\n" \
+               f"📂 Subcategory details\n" \
+               f"💰 Top 20 expenses\n" \
+               f"📝 All transactions\n" \
+               f"📊 Individual category sheets"
+
+    version = await run_db(get_range_data_version, user_id, months)
+    await send_excel_report(
+        context, chat_id, user_id, key, version,
+        lambda: generate_range_report(user_id, start, end),
+        f"Expense_Report_{name.replace(' ', '_')}.xlsx", caption, edit_status
     )
 
 
-async def current_month_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def export_custom_range_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
+    await query.edit_message_text(
+        "📅 *Custom Range Report*\n\n"
+        "Send the first and last day, e.g.:\n"
+        "`01/04/2024 31/12/2024`\n"
+        "`2024-04-01 to 2024-12-31`\n\n"
+        f"Ranges can span up to {REPORT_MAX_RANGE_DAYS} days. Send /cancel to go back.",
+        parse_mode='Markdown'
+    )
+    return REPORT_RANGE
+
+
+async def export_custom_range_entered(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    dates = parse_report_range(update.message.text)
+
+    if dates is None:
+        await update.message.reply_text(
+            "❌ Please send two dates like `01/04/2024 31/12/2024`.",
+            parse_mode='Markdown'
+        )
+        return REPORT_RANGE
+
+    start, end = dates
+    if (end - start).days > REPORT_MAX_RANGE_DAYS:
+        await update.message.reply_text(
+            f"❌ Ranges can span up to {REPORT_MAX_RANGE_DAYS} days. Please send a shorter range."
+        )
+        return REPORT_RANGE
+
+    status = await update.message.reply_text("📊 Generating range report...")
+    await send_range_report(context, update.effective_chat.id, update.effective_user.id, start, end,
+                            status.edit_text)
+    return ConversationHandler.END
+
+
+async def export_all_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export_all and the export menu button: pick a format for the full history."""
+    keyboard = [
+        [InlineKeyboardButton(EXPORT_FORMATS[name][0], callback_data=f'export_all_{name}')]
+        for name in available_export_formats()
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data='export_menu')])
+    text = "🗄️ *Export Full History*\n\n" \
+           "Every expense you have recorded, in one file for spreadsheets or analysis tools.\n\n" \
+           "Select format:"
+
+    if update.callback_query:
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(
+            text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown'
+        )
+    else:
+        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+
+async def export_all_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer("🗄️ Exporting your history...")
+
     user_id = update.effective_user.id
-    current_month = datetime.now().strftime('%Y-%m')
+    export_format = query.data.replace('export_all_', '')
+    back_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data='export_all')]])
 
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
+    if export_format not in available_export_formats():
+        await query.edit_message_text("❌ This export format is not available.", reply_markup=back_markup)
+        return
 
-    cursor.execute('''
-        SELECT SUM(amount) FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-    ''', (user_id, f'{current_month}%'))
+    await query.edit_message_text("⏳ Your export is being prepared...")
+    extension = EXPORT_FORMATS[export_format][1]
+    path = await asyncio.to_thread(new_report_path, f'{user_id}_export_', extension + '.tmp')
 
-    total = cursor.fetchone()[0] or 0
+    try:
+        try:
+            rows = await run_report_build(
+                write_expense_export, user_id, export_format, path, abandon=lambda: discard_report_file(path)
+            )
+        except TimeoutError:
+            logger.warning("Export for user %s timed out after %.0fs", user_id, REPORT_TIMEOUT)
+            await query.edit_message_text(
+                "⌛ The export is taking too long. Please try again in a few minutes.",
+                reply_markup=back_markup
+            )
+            return
+        except Exception:
+            logger.exception("Export for user %s failed", user_id)
+            await query.edit_message_text(
+                "❌ Something went wrong while exporting. Please try again later.",
+                reply_markup=back_markup
+            )
+            return
 
-    cursor.execute('''
-        SELECT category, SUM(amount), COUNT(*)
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-        GROUP BY category
-        ORDER BY SUM(amount) DESC
-    ''', (user_id, f'{current_month}%'))
+        if not rows:
+            await query.edit_message_text("📭 No expenses to export yet.", reply_markup=back_markup)
+            return
 
-    categories_data = cursor.fetchall()
+        if os.path.getsize(path) > EXPORT_MAX_BYTES:
+            await query.edit_message_text(
+                "❌ The export is larger than Telegram allows. Try Parquet, or a range report from /start.",
+                reply_markup=back_markup
+            )
+            return
 
-    cursor.execute('''
-        SELECT COUNT(DISTINCT DATE(date))
-        FROM expenses
-        WHERE user_id = ? AND date LIKE ?
-    ''', (user_id, f'{current_month}%'))
+        with open(path, 'rb') as handle:
+            await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=handle,
+                filename=f"expenses_{datetime.now():%Y%m%d}{extension}",
+                caption=f"🗄️ Full history: {rows:,} expenses"
+            )
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
 
-    days_count = cursor.fetchone()[0] or 1
-    conn.close()
+    await query.edit_message_text("✅ Export sent!", reply_markup=back_markup)
+
+
+async def current_month_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+    current_month = datetime.now().strftime('%Y-%m')
+
+    total, categories_data, days_count = await run_db(get_month_report, user_id, current_month)
 
     if not categories_data:
         message = f"📊 *Current Month - {datetime.now().strftime('%B %Y')}*\n\n" \
@@ -1828,6 +4495,11 @@ async def current_month_report(update: Update, context: ContextTypes.DEFAULT_TYP
         parse_mode='Markdown'
     )
 
+    if categories_data:
+        context.application.create_task(
+            send_month_chart(context.bot, query.message.chat_id, user_id, current_month)
+        )
+
 
 async def import_excel_instructions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1845,7 +4517,8 @@ async def import_excel_instructions(update: Update, context: ContextTypes.DEFAUL
               "• Subcategory\n" \
               "• Description/Note\n" \
               "• Account\n\n" \
-              "Just upload your file and I'll handle the rest!"
+              "Just upload your file and I'll handle the rest!\n" \
+              "Large files import in the background - check /jobs for progress."
 
     keyboard = [[InlineKeyboardButton("🔙 Back", callback_data='menu')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1859,7 +4532,7 @@ async def add_expense_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     user_id = update.effective_user.id
-    categories = get_user_categories(user_id)
+    categories = await run_db(get_user_categories, user_id)
 
     keyboard = []
     for i in range(0, len(categories), 2):
@@ -1888,7 +4561,7 @@ async def category_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['category'] = category
 
     user_id = update.effective_user.id
-    subcategories = get_subcategories_for_category(user_id, category)
+    subcategories = await run_db(get_subcategories_for_category, user_id, category)
 
     keyboard = []
     for i in range(0, len(subcategories), 2):
@@ -1986,7 +4659,7 @@ async def amount_entered(update: Update, context: ContextTypes.DEFAULT_TYPE):
         category = context.user_data['category']
         subcategory = context.user_data.get('subcategory')
 
-        suggestions = get_description_suggestions(user_id, category, subcategory)
+        suggestions = await run_db(get_description_suggestions, user_id, category, subcategory)
 
         subcategory_text = subcategory if subcategory else 'None'
         message = f"Category: *{category}*\n" \
@@ -2064,7 +4737,7 @@ async def description_button_selected(update: Update, context: ContextTypes.DEFA
     context.user_data['description'] = description
 
     user_id = update.effective_user.id
-    accounts = get_user_accounts(user_id)
+    accounts = await run_db(get_user_accounts, user_id)
 
     keyboard = []
     for i in range(0, len(accounts), 2):
@@ -2101,7 +4774,7 @@ async def description_entered(update: Update, context: ContextTypes.DEFAULT_TYPE
     context.user_data['description'] = description
 
     user_id = update.effective_user.id
-    accounts = get_user_accounts(user_id)
+    accounts = await run_db(get_user_accounts, user_id)
 
     keyboard = []
     for i in range(0, len(accounts), 2):
@@ -2267,12 +4940,12 @@ async def date_text_received(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def finalize_save_expense(trigger, context: ContextTypes.DEFAULT_TYPE):
-    if hasattr(trigger, 'message'):
-        user_id = trigger.from_user.id
-        send_msg = trigger.message.reply_text
-    else:
+    # trigger is the CallbackQuery of a button or the Update of a typed message
+    if isinstance(trigger, Update):
         user_id = trigger.effective_user.id
-        send_msg = trigger.edit_message_text
+    else:
+        user_id = trigger.from_user.id
+    send_msg = trigger.message.reply_text
 
     category = context.user_data['category']
     subcategory = context.user_data.get('subcategory')
@@ -2283,23 +4956,10 @@ async def finalize_save_expense(trigger, context: ContextTypes.DEFAULT_TYPE):
 
     date_str = chosen_dt.strftime('%Y-%m-%d %H:%M:%S')
 
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO expenses (user_id, category, subcategory, amount, description, account, date)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, category, subcategory, amount, description, account, date_str))
-    conn.commit()
-    conn.close()
-
-    balance_updated = False
-    new_balance = None
-    if account:
-        balance_info = get_account_balance(user_id, account)
-        if balance_info:
-            update_account_balance(user_id, account, amount, 'subtract')
-            new_balance = get_account_balance(user_id, account)['current']
-            balance_updated = True
+    new_balance = await run_db(
+        save_expense, user_id, category, subcategory, amount, description, account, date_str
+    )
+    balance_updated = new_balance is not None
 
     keyboard = [
         [InlineKeyboardButton("➕ Add Another", callback_data='add_expense')],
@@ -2328,50 +4988,102 @@ async def finalize_save_expense(trigger, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+async def quick_add_expense(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Save expenses typed as text: "250 food lunch upi yesterday 8pm", one per line, or after /add."""
+    text = update.message.text
+    if context.args is not None:
+        text = re.sub(r'^/\S*', '', text, count=1)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    user_id = update.effective_user.id
+
+    index = await run_db(get_quick_add_index, user_id)
+
+    if len(lines) > 1:
+        await quick_add_batch(update, index, lines)
+        return
+
+    expense, error = resolve_quick_add(lines[0] if lines else '', index)
+
+    if expense is None and error is None:
+        await update.message.reply_text(
+            "⚡ *Quick Add*\n\n"
+            "Send the amount first, then any of category, subcategory, account, note and date:\n"
+            "`250 food lunch upi yesterday 8pm`\n"
+            "`/add 1200 shopping groceries`\n\n"
+            "Send several lines to add several expenses at once.",
+            parse_mode='Markdown'
+        )
+        return
+
+    if error:
+        await update.message.reply_text(f"❌ Couldn't save that: {error}.")
+        return
+
+    context.user_data.update(expense)
+    await finalize_save_expense(update, context)
+
+
+async def quick_add_batch(update: Update, index, lines):
+    """Validate every line first, then save them all in one transaction."""
+    if len(lines) > QUICK_ADD_MAX_LINES:
+        await update.message.reply_text(f"❌ Please send at most {QUICK_ADD_MAX_LINES} expenses at a time.")
+        return
+
+    expenses, errors = [], []
+    for number, line in enumerate(lines, 1):
+        expense, error = resolve_quick_add(line, index)
+        if expense is None:
+            errors.append(f"Line {number} ({line}): {error or 'no amount'}")
+        else:
+            expenses.append(expense)
+
+    # Plain text: descriptions often contain Markdown characters
+    if errors:
+        await update.message.reply_text(
+            "❌ Nothing was saved. Please fix these lines and send the list again:\n\n" + "\n".join(errors)
+        )
+        return
+
+    balances = await run_db(save_expenses, update.effective_user.id, [
+        (expense['category'], expense['subcategory'], expense['amount'], expense['description'],
+         expense['account'], expense['chosen_dt'].strftime('%Y-%m-%d %H:%M:%S'))
+        for expense in expenses
+    ])
+
+    message = f"✅ Saved {len(expenses)} expenses - ₹{sum(expense['amount'] for expense in expenses):.2f}\n\n"
+    for expense in expenses:
+        message += (f"• ₹{expense['amount']:.2f} {expense['category']}"
+                    f"{' / ' + expense['subcategory'] if expense['subcategory'] else ''}"
+                    f" - {expense['chosen_dt'].strftime('%d %b, %I:%M %p')}\n")
+    for account, balance in balances.items():
+        message += f"\n💰 {account} balance: ₹{balance:.2f}"
+
+    keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data='menu')]]
+    await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
 async def delete_last(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect('expenses.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT id, category, amount, description, account
-        FROM expenses
-        WHERE user_id = ?
-        ORDER BY id DESC
-        LIMIT 1
-    ''', (user_id,))
-
-    last_expense = cursor.fetchone()
+    last_expense, new_balance = await run_db(delete_last_expense, user_id)
 
     if last_expense:
         expense_id, category, amount, description, account = last_expense
 
-        if account:
-            balance_info = get_account_balance(user_id, account)
-            if balance_info:
-                update_account_balance(user_id, account, amount, 'add')
-
-        cursor.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
-        conn.commit()
-
         message = f"🗑️ *Deleted:*\n\n" \
                   f"Category: {category}\n" \
                   f"Amount: ₹{amount:.2f}\n" \
                   f"Description: {description}"
 
-        if account and balance_info:
-            new_balance = get_account_balance(user_id, account)['current']
+        if new_balance is not None:
             message += f"\n\n💰 Refunded to {account}\n" \
                        f"New Balance: ₹{new_balance:.2f}"
     else:
         message = "No expenses to delete."
 
-    conn.close()
-
     keyboard = [[InlineKeyboardButton("🔙 Back", callback_data='menu')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -2390,10 +5102,14 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=os.getenv('LOG_LEVEL', 'INFO')
+    )
     init_db()
 
     TOKEN = os.getenv('BOT_TOKEN', '6793523642:AAEX6Kbb_La-OxHJlqMkKx5n54XqVNquiUo')
-    application = Application.builder().token(TOKEN).build()
+    application = Application.builder().token(TOKEN).post_init(post_init).build()
 
     # Conversation handler for adding expenses
     conv_handler = ConversationHandler(
@@ -2438,10 +5154,24 @@ def main():
         per_message=False
     )
 
+    # Conversation handler for custom range reports
+    report_range_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(export_custom_range_start, pattern='^export_custom$')],
+        states={
+            REPORT_RANGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, export_custom_range_entered)]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        allow_reentry=True,
+        per_message=False
+    )
+
     # Basic command handlers
     application.add_handler(CommandHandler('start', start))
+    application.add_handler(CommandHandler('jobs', show_import_jobs))
+    application.add_handler(CommandHandler('export_all', export_all_menu))
     application.add_handler(conv_handler)
     application.add_handler(balance_conv_handler)
+    application.add_handler(report_range_conv_handler)
     application.add_handler(CallbackQueryHandler(menu, pattern='^menu$'))
 
     # View transactions handlers
@@ -2473,17 +5203,41 @@ def main():
     # Export handlers
     application.add_handler(CallbackQueryHandler(export_menu, pattern='^export_menu$'))
     application.add_handler(CallbackQueryHandler(export_excel_report, pattern='^export_excel_'))
+    application.add_handler(CallbackQueryHandler(export_range_report, pattern='^export_range_'))
+    application.add_handler(CallbackQueryHandler(export_all_menu, pattern='^export_all$'))
+    application.add_handler(CallbackQueryHandler(export_all_selected, pattern='^export_all_'))
 
     # Other handlers
     application.add_handler(CallbackQueryHandler(delete_last, pattern='^delete_last$'))
     application.add_handler(CallbackQueryHandler(import_excel_instructions, pattern='^import_excel$'))
     application.add_handler(MessageHandler(filters.Document.ALL, handle_excel_import))
 
+    # Quick add: any other text starting with an amount, or /add
+    application.add_handler(CommandHandler('add', quick_add_expense))
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND & filters.Regex(re.compile(r'^\s*(?:₹|rs\.?)?\d', re.IGNORECASE)),
+        quick_add_expense
+    ))
+
     print("Bot is running...")
     application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    import_executor.shutdown(wait=True, cancel_futures=True)
+    report_executor.shutdown(wait=True, cancel_futures=True)
+    prewarm_executor.shutdown(wait=True, cancel_futures=True)
+    db_executor.shutdown(wait=True)
+    db.close()
+
+
+# Maintenance commands: python finbot.py <command>
+MAINTENANCE_COMMANDS = {
+    'check-indexes': check_indexes_command,
+    'rebuild-rollups': rebuild_rollups_command,
+}
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in MAINTENANCE_COMMANDS:
+        sys.exit(MAINTENANCE_COMMANDS[sys.argv[1]]())
     main()
 
 
@@ -0,0 +1,465 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Always a throwaway database, even when EXPENSES_DB points at a real one
+os.environ['EXPENSES_DB'] = os.path.join(tempfile.mkdtemp(prefix='finbot_test_'), 'expenses.db')
+
+import pytest
+
+import finbot
+
+
+finbot.init_db()
+
+
+class FakeMessage:
+    async def edit_text(self, text, **kwargs):
+        pass
+
+
+def stored_rows(user_id):
+    return finbot.db.fetchall(
+        'SELECT category, amount, description FROM expenses WHERE user_id = ? ORDER BY id', (user_id,)
+    )
+
+
+def run_csv_import(user_id, path):
+    job, _ = finbot.create_import_job(user_id, user_id, 'file', f'unique-{user_id}', 'expenses.csv')
+    job = {**job, **dict(zip(
+        ('rows_read', 'rows_imported', 'rows_skipped', 'rows_failed'),
+        finbot.db.fetchone(
+            'SELECT rows_read, rows_imported, rows_skipped, rows_failed FROM import_jobs WHERE id = ?', (job['id'],)
+        )
+    ))}
+    return asyncio.run(finbot.stream_csv_import(job, path, FakeMessage()))
+
+
+@pytest.mark.parametrize('user_id, description', [(1101, 'Tea'), (1102, 'Tea\nand snacks')])
+def test_resumed_csv_import_keeps_repeated_rows(tmp_path, monkeypatch, user_id, description):
+    path = tmp_path / 'expenses.csv'
+    quoted = '"' + description + '"'
+    path.write_text(
+        'Date,Category,Amount,Description\n'
+        + f'2025-10-01 09:00:00,Food,10,{quoted}\n' * 2
+        + f'2025-10-01 09:00:00,Food,10,{quoted}\n' * 2
+    )
+    monkeypatch.setattr(finbot, 'IMPORT_CHUNK_ROWS', 2)
+
+    commit = finbot.commit_import_chunk
+    calls = []
+
+    def interrupted_commit(*args):
+        if calls:
+            raise RuntimeError('interrupted')
+        calls.append(args)
+        return commit(*args)
+
+    monkeypatch.setattr(finbot, 'commit_import_chunk', interrupted_commit)
+    with pytest.raises(RuntimeError):
+        run_csv_import(user_id, str(path))
+    assert len(stored_rows(user_id)) == 2
+
+    monkeypatch.setattr(finbot, 'commit_import_chunk', commit)
+    imported, skipped, failed, _ = run_csv_import(user_id, str(path))
+
+    assert (imported, skipped, failed) == (4, 0, 0)
+    assert stored_rows(user_id) == [('Food', 10.0, description)] * 4
+
+
+@pytest.fixture
+def quick_add_index():
+    return finbot.build_quick_add_index(1201)
+
+
+@pytest.mark.parametrize('text, date, time', [
+    ('100 food 28/10/2025 2:35 pm', (2025, 10, 28), (14, 35)),
+    ('100 food 8 pm', None, (20, 0)),
+    ('100 food lunch at 5pm', None, (17, 0)),
+    ('100 food at 5 p.m.', None, (17, 0)),
+])
+def test_quick_add_times_are_not_descriptions(quick_add_index, text, date, time):
+    expense, error = finbot.resolve_quick_add(text, quick_add_index)
+
+    assert error is None
+    assert expense['description'] == 'No description'
+    assert (expense['chosen_dt'].hour, expense['chosen_dt'].minute) == time
+    if date:
+        assert expense['chosen_dt'].timetuple()[:3] == date
+
+
+def test_quick_add_decimal_is_not_a_date(quick_add_index):
+    parsed = finbot.parse_quick_add('100 food 12.50', quick_add_index)
+
+    assert parsed['date_text'] is None
+    assert parsed['description'] == '12.50'
+    assert finbot.parse_quick_add('12.50 food', quick_add_index)['amount'] == 12.5
+
+
+def test_quick_add_keeps_at_without_a_time(quick_add_index):
+    assert finbot.parse_quick_add('100 food at home', quick_add_index)['description'] == 'at home'
+
+
+def traced_statements(func, *args):
+    statements = []
+    with finbot.db.connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            func(*args)
+        finally:
+            conn.set_trace_callback(None)
+    return statements
+
+
+def test_warm_entry_flow_runs_no_queries():
+    user_id = 1301
+    finbot.add_default_categories(user_id)
+    finbot.update_account_balance(user_id, 'Cash', 1000, 'set')
+    finbot.save_expense(user_id, '🍔 Food', 'Lunch', 10, 'Thali', 'Cash', '2025-10-01 12:00:00')
+
+    def entry_flow():
+        finbot.get_user_categories(user_id)
+        finbot.get_subcategories_for_category(user_id, '🍔 Food')
+        finbot.get_description_suggestions(user_id, '🍔 Food', 'Lunch')
+        finbot.get_user_accounts(user_id)
+        finbot.get_account_balance(user_id, 'Cash')
+
+    entry_flow()
+    assert traced_statements(entry_flow) == []
+    assert finbot.get_description_suggestions(user_id, '🍔 Food', 'Lunch') == ['Thali']
+
+    finbot.save_expense(user_id, '🍔 Food', 'Lunch', 10, 'Dosa', 'Cash', '2025-10-02 12:00:00')
+    assert finbot.get_description_suggestions(user_id, '🍔 Food', 'Lunch') == ['Dosa', 'Thali']
+    assert finbot.user_profiles._generations == {}
+
+
+def test_save_expense_does_not_reload_the_profile():
+    user_id = 1302
+    finbot.update_account_balance(user_id, 'Cash', 1000, 'set')
+
+    statements = traced_statements(
+        finbot.save_expense, user_id, '🍔 Food', 'Lunch', 10, 'Thali', 'Cash', '2025-10-01 12:00:00'
+    )
+
+    assert not [statement for statement in statements if 'FROM categories' in statement]
+    assert finbot.get_account_balance(user_id, 'Cash')['current'] == 990
+
+
+def test_save_expenses_charges_each_account_once():
+    user_id = 1401
+    finbot.update_account_balance(user_id, 'Cash', 100, 'set')
+    finbot.update_account_balance(user_id, 'UPI', 50, 'set')
+    expenses = [
+        ('🍔 Food', 'Lunch', 10, 'Thali', 'Cash', '2025-10-01 12:00:00'),
+        ('🍔 Food', 'Lunch', 5, 'Tea', 'Cash', '2025-10-01 16:00:00'),
+        ('🚗 Transport', 'Bus', 20, 'Bus', 'UPI', '2025-10-02 09:00:00'),
+        ('🚗 Transport', 'Taxi', 30, 'Taxi', 'Wallet', '2025-10-02 19:00:00'),
+    ]
+
+    balances = {}
+    statements = traced_statements(lambda: balances.update(finbot.save_expenses(user_id, expenses)))
+
+    assert balances == {'Cash': 85, 'UPI': 30}
+    assert not [statement for statement in statements if 'FROM categories' in statement]
+    assert len([statement for statement in statements if statement.lstrip().startswith('UPDATE account_balances')]) == 3
+    assert {name: current for name, _, current, _ in finbot.get_all_account_balances(user_id)} == balances
+    assert finbot.save_expenses(user_id, []) == {}
+
+
+def test_timed_out_report_build_keeps_its_slot(monkeypatch):
+    monkeypatch.setattr(finbot, 'REPORT_TIMEOUT', 0.05)
+    release = threading.Event()
+
+    async def scenario():
+        slots = asyncio.Semaphore(1)
+        with ThreadPoolExecutor(1) as executor:
+            with pytest.raises(TimeoutError):
+                await finbot.run_report_build(release.wait, executor=executor, slots=slots)
+            assert slots.locked()
+
+            release.set()
+            await asyncio.sleep(0.1)
+            assert not slots.locked()
+            assert await finbot.run_report_build(sum, [1, 2], executor=executor, slots=slots) == 3
+
+    asyncio.run(scenario())
+
+
+def test_failed_report_build_reports_an_error():
+    statuses = []
+
+    async def edit_status(text, reply_markup=None):
+        statuses.append(text)
+
+    async def generate():
+        raise RuntimeError('worker crashed')
+
+    asyncio.run(finbot.send_excel_report(
+        None, 1, 1501, '2025-10', 1, generate, 'report.xlsx', 'caption', edit_status
+    ))
+
+    assert statuses[-1].startswith('❌')
+
+
+def test_abandoned_report_build_leaves_no_files(tmp_path, monkeypatch):
+    user_id = 1601
+    finbot.save_expenses(user_id, [('🍔 Food', 'Lunch', 10, 'Thali', 'Cash', '2025-10-01 12:00:00')])
+    monkeypatch.setattr(finbot, 'REPORT_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(finbot, 'REPORT_TIMEOUT', 0.05)
+    release = threading.Event()
+
+    def slow_report(*args):
+        release.wait()
+        return finbot.stream_excel_report(*args)
+
+    def broken_report(*args):
+        raise OSError('disk full')
+
+    async def build(func):
+        path = finbot.new_report_path(f'{user_id}_')
+        with ThreadPoolExecutor(1) as executor:
+            with pytest.raises((TimeoutError, OSError)):
+                await finbot.run_report_build(
+                    func, user_id, *finbot.month_range('2025-10'), path,
+                    executor=executor, slots=None, abandon=lambda: finbot.discard_report_file(path)
+                )
+            release.set()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(build(broken_report))
+    assert os.listdir(tmp_path) == []
+
+    release.clear()
+    asyncio.run(build(slow_report))
+    assert os.listdir(tmp_path) == []
+
+
+DATETIME_NOW = finbot.datetime(2025, 10, 29, 9, 15, 30)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2 days ago', DATETIME_NOW - finbot.timedelta(days=2)),
+    ('2 days ago 8pm', finbot.datetime(2025, 10, 27, 20, 0)),
+    ('1 day ago at 7:45', finbot.datetime(2025, 10, 28, 7, 45)),
+    ('yesterday 8pm', finbot.datetime(2025, 10, 28, 20, 0)),
+    ('13pm', None),
+    ('yesterday 13pm', None),
+    ('today 0am', None),
+])
+def test_parse_human_datetime_shapes(text, expected):
+    assert finbot.parse_human_datetime(text, DATETIME_NOW) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('05/03/2025', finbot.datetime(2025, 3, 5)),
+    ('05-03-2025', finbot.datetime(2025, 3, 5)),
+    ('5-3-2025', finbot.datetime(2025, 3, 5)),
+    ('12.5.2025', finbot.datetime(2025, 5, 12)),
+    ('5/3/25', finbot.datetime(2025, 3, 5)),
+    ('2025.10.28 8pm', finbot.datetime(2025, 10, 28, 20, 0)),
+    ('5/3', finbot.datetime(2025, 3, 5)),
+    ('29/10', finbot.datetime(2025, 10, 29)),
+    ('5/12', finbot.datetime(2024, 12, 5)),
+    ('5-12 8pm', finbot.datetime(2024, 12, 5, 20, 0)),
+    ('29/2', None),
+])
+def test_parse_human_datetime_is_day_first(text, expected):
+    assert finbot.parse_human_datetime(text, DATETIME_NOW) == expected
+
+
+@pytest.mark.parametrize('text, date', [
+    ('100 food 05-03-2025', (2025, 3, 5)),
+    ('100 food 5-3-2025', (2025, 3, 5)),
+    ('100 food 12.5.2025', (2025, 5, 12)),
+    ('100 food 05/03/2025', (2025, 3, 5)),
+])
+def test_quick_add_dates_are_day_first(quick_add_index, text, date):
+    expense, error = finbot.resolve_quick_add(text, quick_add_index)
+
+    assert error is None
+    assert expense['chosen_dt'].timetuple()[:3] == date
+
+
+def test_quick_add_date_without_a_year_is_never_in_the_future(quick_add_index):
+    expense, _ = finbot.resolve_quick_add('100 food 31/12', quick_add_index)
+
+    assert (expense['chosen_dt'].month, expense['chosen_dt'].day) == (12, 31)
+    assert expense['chosen_dt'] <= finbot.datetime.now()
+
+
+@pytest.mark.parametrize('text, days_back, time', [
+    ('250 food 2 days ago 8pm', 2, (20, 0)),
+    ('250 food 8pm 2 days ago', 2, (20, 0)),
+    ('250 food 10 days ago at 7:30', 10, (7, 30)),
+    ('250 food yesterday 8pm', 1, (20, 0)),
+    ('250 food yesterday at 9:15 am', 1, (9, 15)),
+])
+def test_quick_add_applies_the_time_to_the_day(quick_add_index, text, days_back, time):
+    expense, error = finbot.resolve_quick_add(text, quick_add_index)
+
+    assert error is None
+    assert expense['chosen_dt'].date() == finbot.datetime.now().date() - finbot.timedelta(days=days_back)
+    assert (expense['chosen_dt'].hour, expense['chosen_dt'].minute) == time
+
+
+def test_quick_add_rejects_an_unreadable_time(quick_add_index):
+    expense, error = finbot.resolve_quick_add('250 food yesterday 13pm', quick_add_index)
+
+    assert expense is None
+    assert 'yesterday 13pm' in error
+
+
+def test_import_job_fails_when_the_bot_cannot_reply():
+    class BlockedBot:
+        async def send_message(self, *args, **kwargs):
+            raise RuntimeError('Forbidden: bot was blocked by the user')
+
+    job, _ = finbot.create_import_job(1701, 1701, 'file', 'unique-1701', 'expenses.csv')
+    asyncio.run(finbot.run_import_job(BlockedBot(), job))
+
+    status, error = finbot.db.fetchone('SELECT status, error FROM import_jobs WHERE id = ?', (job['id'],))
+    assert status == 'failed'
+    assert 'blocked' in error
+
+
+def test_lower_process_priority_without_os_nice(monkeypatch):
+    monkeypatch.delattr(finbot.os, 'nice')
+    finbot.lower_process_priority()
+
+    def refused(increment):
+        raise PermissionError('not permitted')
+
+    monkeypatch.setattr(finbot.os, 'nice', refused, raising=False)
+    finbot.lower_process_priority()
+
+
+def rollup_snapshot(user_id):
+    return (
+        finbot.db.fetchall('''
+            SELECT month, category, subcategory, account, ROUND(total, 2), txn_count, active_days
+            FROM expense_rollups WHERE user_id = ? ORDER BY 1, 2, 3, 4
+        ''', (user_id,)),
+        finbot.db.fetchall('''
+            SELECT day, ROUND(total, 2), txn_count FROM expense_daily_rollups WHERE user_id = ? ORDER BY 1
+        ''', (user_id,)),
+    )
+
+
+def test_incremental_rollups_match_a_rebuild():
+    user_id = 1801
+    for category, subcategory, amount, account, date in [
+        ('🍔 Food', 'Lunch', 10, 'Cash', '2025-09-30 23:59:59'),
+        ('🍔 Food', 'Lunch', 12.5, 'Cash', '2025-10-01 00:00:00'),
+        ('🍔 Food', 'Lunch', 12.5, 'Cash', '2025-10-01 13:00:00'),
+        ('🍔 Food', None, 4, None, '2025-10-01 16:00:00'),
+        ('🍔 Food', 'Dinner', 30, 'UPI', '2025-10-02 21:00:00'),
+        ('🚗 Transport', 'Bus', 2, 'Cash', '2025-10-31 08:00:00'),
+    ]:
+        finbot.save_expense(user_id, category, subcategory, amount, 'x', account, date)
+        incremental = rollup_snapshot(user_id)
+        finbot.rebuild_rollups(user_id)
+        assert rollup_snapshot(user_id) == incremental
+
+    for _ in range(6):
+        finbot.delete_last_expense(user_id)
+        incremental = rollup_snapshot(user_id)
+        finbot.rebuild_rollups(user_id)
+        assert rollup_snapshot(user_id) == incremental
+
+    assert rollup_snapshot(user_id) == ([], [])
+
+
+def test_fingerprints_number_repeated_rows_stably():
+    row = (1901, '🍔 Food', 'Tea', 10.0, 'Tea', 'Cash', '2025-10-01 09:00:00')
+    ts = finbot.to_timestamp(row[-1])
+
+    def fingerprints(count):
+        occurrences = Counter()
+        return [finbot.expense_fingerprint(1901, ts, 10, '🍔 Food', 'Tea', 'Tea', 'Cash', occurrences)
+                for _ in range(count)]
+
+    assert len(set(fingerprints(3))) == 3
+    assert fingerprints(3) == fingerprints(3)
+    assert fingerprints(4)[:3] == fingerprints(3)
+
+    assert finbot.insert_expenses([row] * 3) == (3, 0)
+    assert finbot.insert_expenses([row] * 3) == (0, 3)
+    assert finbot.insert_expenses([row] * 4) == (1, 3)
+
+    stored = finbot.db.fetchall('SELECT fingerprint FROM expenses WHERE user_id = ? ORDER BY id', (1901,))
+    assert [fingerprint for fingerprint, in stored] == fingerprints(4)
+
+
+def test_fingerprint_migration_matches_live_fingerprints():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE expenses (id INTEGER PRIMARY KEY, user_id INTEGER, ts INTEGER, amount REAL, category TEXT,
+                               subcategory TEXT, description TEXT, account TEXT, fingerprint TEXT)
+    ''')
+    rows = [(1, 1759309200, 10.0, '🍔 Food', 'Tea', None, 'Cash')] * 2 + [(1, 1759309200, 10.0, '🍔 Food', None, 'x', None)]
+    conn.executemany('''
+        INSERT INTO expenses (user_id, ts, amount, category, subcategory, description, account) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+    finbot.migrate_fingerprints(conn)
+
+    occurrences = Counter()
+    expected = [finbot.expense_fingerprint(*row, occurrences) for row in rows]
+    assert [fingerprint for fingerprint, in conn.execute('SELECT fingerprint FROM expenses ORDER BY id')] == expected
+
+
+def test_transaction_pages_do_not_skip_or_repeat_rows_with_the_same_ts():
+    user_id = 2001
+    finbot.save_expenses(user_id, [
+        ('🍔 Food', 'Tea', amount, 'Tea', 'Cash', date)
+        for amount, date in [(1, '2025-10-05 09:00:00')] * 7 + [(2, '2025-10-05 10:00:00')] * 2
+        + [(3, '2025-10-04 09:00:00'), (4, '2025-10-06 09:00:00')]
+    ])
+    start, end = finbot.month_range('2025-10')
+    everything = finbot.get_transactions_page(user_id, start, end, 100)
+
+    for limit in (1, 2, 3, 4, 7):
+        seen, before = [], None
+        while True:
+            page = finbot.get_transactions_page(user_id, start, end, limit, before)
+            if not page:
+                break
+            seen.extend(page)
+            before = page[-1][6:8]
+        assert [row[7] for row in seen] == [row[7] for row in everything]
+
+    assert len(everything) == 11
+    assert [row[6] for row in everything] == sorted((row[6] for row in everything), reverse=True)
+
+
+@pytest.mark.parametrize('when, year_start, quarter_start', [
+    (finbot.datetime(2025, 3, 31, 23, 59, 59), finbot.datetime(2024, 4, 1), finbot.datetime(2025, 1, 1)),
+    (finbot.datetime(2025, 4, 1), finbot.datetime(2025, 4, 1), finbot.datetime(2025, 4, 1)),
+    (finbot.datetime(2025, 6, 30), finbot.datetime(2025, 4, 1), finbot.datetime(2025, 4, 1)),
+    (finbot.datetime(2025, 7, 1), finbot.datetime(2025, 4, 1), finbot.datetime(2025, 7, 1)),
+])
+def test_financial_year_edges(when, year_start, quarter_start):
+    assert finbot.financial_year_start(when) == year_start
+    assert finbot.financial_quarter_start(when) == quarter_start
+
+
+def test_financial_year_range_includes_31_march_and_excludes_1_april():
+    user_id = 2101
+    finbot.save_expenses(user_id, [
+        ('🍔 Food', 'Tea', 1, 'Tea', 'Cash', '2024-03-31 23:59:59'),
+        ('🍔 Food', 'Tea', 10, 'Tea', 'Cash', '2024-04-01 00:00:00'),
+        ('🍔 Food', 'Tea', 100, 'Tea', 'Cash', '2025-03-31 23:59:59'),
+        ('🍔 Food', 'Tea', 1000, 'Tea', 'Cash', '2025-04-01 00:00:00'),
+    ])
+    start = finbot.datetime(2024, 4, 1)
+    end = finbot.add_months(start, 12)
+
+    assert end == finbot.datetime(2025, 4, 1)
+    assert finbot.describe_report_range(start, end) == 'FY2024-25'
+    assert finbot.month_range('2025-03')[1] == finbot.to_timestamp(end)
+    assert finbot.months_between(finbot.to_timestamp(start), finbot.to_timestamp(end))[::11] == ['2024-04', '2025-03']
+    assert finbot.get_range_totals(user_id, finbot.to_timestamp(start), finbot.to_timestamp(end)) == (2, 110)